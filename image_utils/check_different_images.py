@@ -1,5 +1,14 @@
+import argparse
+import hashlib
+import io
+import json
 import os
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff')
 
 def find_similar_files(root_folder):
     """
@@ -28,10 +37,173 @@ def find_similar_files(root_folder):
 
     return similar_files
 
+def dhash(img, hash_size=8):
+    # Difference hash: compare horizontally adjacent pixels of a tiny grayscale thumbnail
+    pixels = np.asarray(img.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS), dtype=np.int16)
+    return bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+def phash(img, hash_size=8, highfreq_factor=4):
+    # Perceptual hash: sign of the low-frequency DCT coefficients against their median
+    size = hash_size * highfreq_factor
+    pixels = np.asarray(img.convert('L').resize((size, size), Image.LANCZOS), dtype=np.float64)
+    k = np.arange(size)
+    dct_matrix = np.cos(np.pi * (2 * k[np.newaxis, :] + 1) * k[:, np.newaxis] / (2 * size))
+    low_freq = (dct_matrix @ pixels @ dct_matrix.T)[:hash_size, :hash_size]
+    return bits_to_int(low_freq > np.median(low_freq))
+
+def bits_to_int(bits):
+    # Pack a boolean array into an integer hash
+    return int(''.join('1' if bit else '0' for bit in bits.flatten()), 2)
+
+def hash_file(file_path):
+    """
+    Computes the content and perceptual hashes of one image file.
+
+    Returns:
+        tuple: (file_path, sha256 hex digest, dHash, pHash); the perceptual hashes
+        are None if the file cannot be decoded, and all three hashes are None if it
+        cannot be read.
+    """
+    try:
+        with open(file_path, 'rb') as file:
+            data = file.read()
+    except OSError:
+        return file_path, None, None, None
+    content_hash = hashlib.sha256(data).hexdigest()
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return file_path, content_hash, dhash(img), phash(img)
+    except Exception:  # Any decoder failure; one bad file must not abort the whole pool
+        return file_path, content_hash, None, None
+
+class BKTree:
+    """
+    Burkhard-Keller tree over integer hashes with Hamming distance.
+
+    Radius queries only visit subtrees whose edge distance can still be within range,
+    so finding near-duplicates stays far below all-pairs comparisons.
+    """
+
+    def __init__(self):
+        self.root = None  # [hash, items, {distance: child}]
+
+    def add(self, value, item):
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = (value ^ node[0]).bit_count()
+            if distance == 0:
+                node[1].append(item)
+                return
+            if distance not in node[2]:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = node[2][distance]
+
+    def search(self, value, max_distance):
+        # Return the items of every hash within max_distance of value
+        matches = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = (value ^ node[0]).bit_count()
+            if distance <= max_distance:
+                matches.extend(node[1])
+            stack.extend(child for edge, child in node[2].items()
+                         if distance - max_distance <= edge <= distance + max_distance)
+        return matches
+
+def find_duplicate_files(root_folder, max_distance=4, hash_name='phash', workers=None):
+    """
+    Groups exact duplicates (same content) and near-duplicates (close perceptual hash).
+
+    Args:
+        root_folder (str): Path to the root folder where the search begins.
+        max_distance (int): Largest Hamming distance between perceptual hashes of near-duplicates.
+        hash_name (str): Perceptual hash to compare, 'phash' or 'dhash'.
+        workers (int): Number of worker processes hashing files (defaults to the CPU count).
+
+    Returns:
+        list: Groups (lists of paths) of two or more duplicate files.
+    """
+    file_paths = [os.path.join(root, file)
+                  for root, dirs, files in os.walk(root_folder)
+                  for file in files if file.lower().endswith(IMAGE_EXTENSIONS)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        hashes = list(executor.map(hash_file, file_paths, chunksize=64))
+
+    # Union-find over file indices
+    parent = list(range(len(hashes)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        parent[find(i)] = find(j)
+
+    # Exact duplicates share a content hash
+    first_by_content = {}
+    for i, (_, content_hash, _, _) in enumerate(hashes):
+        if content_hash is not None:
+            union(i, first_by_content.setdefault(content_hash, i))
+
+    # Near-duplicates are found with radius queries on a BK-tree
+    tree = BKTree()
+    hash_index = 3 if hash_name == 'phash' else 2
+    for i, file_hashes in enumerate(hashes):
+        perceptual_hash = file_hashes[hash_index]
+        if perceptual_hash is None:
+            continue
+        for j in tree.search(perceptual_hash, max_distance):
+            union(i, j)
+        tree.add(perceptual_hash, i)
+
+    groups = defaultdict(list)
+    for i, (file_path, _, _, _) in enumerate(hashes):
+        groups[find(i)].append(file_path)
+    return [paths for paths in groups.values() if len(paths) > 1]
+
+def split_of(file_path, root_folder):
+    # The split (e.g. train/validation/test) is the first folder below the root
+    return os.path.relpath(file_path, root_folder).split(os.sep)[0]
+
+def leakage_report(duplicate_groups, root_folder):
+    """
+    Lists the duplicate groups whose files appear in more than one split.
+
+    Returns:
+        dict: Number of duplicate groups, number of leaking groups and the leaking
+        groups with the files of each split.
+    """
+    leaks = []
+    for paths in duplicate_groups:
+        splits = defaultdict(list)
+        for file_path in paths:
+            splits[split_of(file_path, root_folder)].append(file_path)
+        if len(splits) > 1:
+            leaks.append(dict(splits))
+    return {"duplicate_groups": len(duplicate_groups), "leaking_groups": len(leaks), "leaks": leaks}
+
 # Example usage
 if __name__ == "__main__":
-    root_folder = "C:/Users/krisa/Desktop/CPRO 2902/signature_verification_dataset4"
-    if os.path.exists(root_folder) and os.path.isdir(root_folder):
+    parser = argparse.ArgumentParser(description="Find duplicate signature images and cross-split leakage.")
+    parser.add_argument("root_folder", nargs="?", default="C:/Users/krisa/Desktop/CPRO 2902/signature_verification_dataset4")
+    parser.add_argument("--names", action="store_true", help="Only report files with the same name")
+    parser.add_argument("--max-distance", type=int, default=4, help="Hamming distance for near-duplicates")
+    parser.add_argument("--hash", choices=["phash", "dhash"], default="phash")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--report", default=None, help="Write the leakage report to this JSON file")
+    args = parser.parse_args()
+    root_folder = args.root_folder
+
+    if not (os.path.exists(root_folder) and os.path.isdir(root_folder)):
+        print(f"The path '{root_folder}' is invalid or not a folder.")
+    elif args.names:
         similar_files = find_similar_files(root_folder)
         if similar_files:
             print("\nSimilar Files Found:")
@@ -42,4 +214,14 @@ if __name__ == "__main__":
         else:
             print("No similar file names found.")
     else:
-        print(f"The path '{root_folder}' is invalid or not a folder.")
+        duplicate_groups = find_duplicate_files(root_folder, args.max_distance, args.hash, args.workers)
+        report = leakage_report(duplicate_groups, root_folder)
+        print(f"{report['duplicate_groups']} duplicate groups, {report['leaking_groups']} spanning several splits")
+        for leak in report["leaks"]:
+            print()
+            for split, paths in leak.items():
+                for path in paths:
+                    print(f"  [{split}] {path}")
+        if args.report:
+            with open(args.report, "w") as file:
+                json.dump(report, file, indent=2)
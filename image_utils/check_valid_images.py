@@ -1,17 +1,151 @@
+import argparse
+import hashlib
+import io
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
 from PIL import Image
+from count_images import cache_path
 
-folder_path = "C:/Users/krisa/Desktop/CPRO 2902/signature_verification_dataset"
-print("Checking folder contents...")
-
-# Walk through all folders and subfolders
-for root, dirs, files in os.walk(folder_path):
-    for filename in files:
-        if filename.lower().endswith(".png"):  # Case-insensitive check for .png files
-            image_path = os.path.join(root, filename)
-            try:
-                with Image.open(image_path) as img:
-                    img.verify()  # Check if it's an actual image without loading
-                pass
-            except (IOError, Image.UnidentifiedImageError):
-                print(f"{filename} in folder {root} is corrupted or cannot be identified.")
+# Extensions the training loaders read (see version_2/data_preparation.py)
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+# The manifest is saved after every this many validated files, so an interrupted run keeps its progress
+SAVE_EVERY = 1000
+
+def validate_image(image_path):
+    """
+    Checks that a file is a decodable image and fingerprints it.
+
+    Args:
+        image_path (str): Path to the image file.
+
+    Returns:
+        dict: Manifest record with path, size, mtime_ns, sha256, width, height, mode and valid.
+        Any error reading or decoding the file (including the file disappearing) marks it invalid.
+    """
+    record = {"path": image_path, "size": None, "mtime_ns": None,
+              "sha256": None, "width": None, "height": None, "mode": None, "valid": False}
+    try:
+        stat = os.stat(image_path)
+        record["size"], record["mtime_ns"] = stat.st_size, stat.st_mtime_ns
+        with open(image_path, "rb") as file:
+            data = file.read()
+        record["sha256"] = hashlib.sha256(data).hexdigest()
+        with Image.open(io.BytesIO(data)) as img:
+            record["width"], record["height"] = img.size
+            record["mode"] = img.mode
+            img.verify()  # Check the file structure (e.g. PNG chunk checksums)
+        # verify() doesn't decode JPEG pixel data, so decode the image the way the loaders do
+        # (a truncated JPEG passes verify() but cv2.imdecode returns None)
+        record["valid"] = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED) is not None
+    except Exception:  # e.g. OSError, SyntaxError, ValueError, Image.DecompressionBombError
+        pass
+    return record
+
+def default_manifest_path(folder_path):
+    # Manifest of a folder in the cache folder of count_images, keyed by its absolute path
+    # (None if caching is disabled), so the dataset itself is never written to
+    return cache_path("image_manifest", folder_path, ".json")
+
+def load_manifest(manifest_path):
+    # Read the records of a previous run, keyed by path relative to the scanned folder
+    if manifest_path is None or not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as manifest:
+        return json.load(manifest)["files"]
+
+def save_manifest(manifest_path, folder_path, files):
+    # Write the manifest atomically so a crash never leaves a truncated file
+    if manifest_path is None:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, "w") as manifest:
+        json.dump({"root": os.path.abspath(folder_path), "files": files}, manifest)
+    os.replace(temp_path, manifest_path)
+
+def validate_folder(folder_path, manifest_path=None, workers=None, extensions=IMAGE_EXTENSIONS):
+    """
+    Validates every image in a folder tree and records the results in a persistent manifest.
+
+    Files whose size and mtime match the manifest are not opened again; new and changed
+    files are validated on a process pool. The manifest is saved every SAVE_EVERY files,
+    so an interrupted run resumes where it stopped.
+
+    Args:
+        folder_path (str): Root folder of the images.
+        manifest_path (str): Manifest file (defaults to default_manifest_path(folder_path)).
+        workers (int): Number of worker processes (defaults to the CPU count).
+        extensions (tuple): Lowercase file extensions to check.
+
+    Returns:
+        dict: Manifest records keyed by path relative to folder_path.
+    """
+    manifest_path = manifest_path or default_manifest_path(folder_path)
+    previous = load_manifest(manifest_path)
+
+    files, pending = {}, []
+    # Walk through all folders and subfolders
+    for root, dirs, filenames in os.walk(folder_path):
+        for filename in filenames:
+            if filename.lower().endswith(extensions):  # Case-insensitive extension check
+                image_path = os.path.join(root, filename)
+                relative_path = os.path.relpath(image_path, folder_path)
+                try:
+                    stat = os.stat(image_path)
+                except OSError:  # Removed while walking
+                    continue
+                record = previous.get(relative_path)
+                if record and record["size"] == stat.st_size and record["mtime_ns"] == stat.st_mtime_ns:
+                    files[relative_path] = record
+                else:
+                    pending.append(image_path)
+
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for done, record in enumerate(executor.map(validate_image, pending, chunksize=64), 1):
+                relative_path = os.path.relpath(record.pop("path"), folder_path)
+                files[relative_path] = record
+                if done % SAVE_EVERY == 0:
+                    save_manifest(manifest_path, folder_path, files)
+    finally:
+        save_manifest(manifest_path, folder_path, files)
+    elapsed = time.perf_counter() - start
+    print(f"Checked {len(pending)} new or changed files in {elapsed:.1f}s "
+          f"({len(files) - len(pending)} unchanged)")
+    return files
+
+def load_valid_paths(manifest_path):
+    """
+    Reads the absolute paths of the valid images recorded in a manifest.
+
+    Training loaders use this as a pre-filter so they never open a corrupt file.
+
+    Returns:
+        set: Normalized absolute paths of valid images.
+    """
+    with open(manifest_path) as manifest:
+        manifest = json.load(manifest)
+    return {os.path.normpath(os.path.join(manifest["root"], relative_path))
+            for relative_path, record in manifest["files"].items() if record["valid"]}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate signature images and record them in a manifest.")
+    parser.add_argument("folder_path", nargs="?", default="C:/Users/krisa/Desktop/CPRO 2902/signature_verification_dataset")
+    parser.add_argument("--manifest", default=None, help="Manifest path (default: in the cache folder, keyed by the folder path)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--extensions", nargs="+", default=list(IMAGE_EXTENSIONS), help="File extensions to check")
+    args = parser.parse_args()
+
+    manifest_path = args.manifest or default_manifest_path(args.folder_path)
+    print(f"Checking folder contents (manifest: {manifest_path or 'not saved, caching is disabled'})...")
+    files = validate_folder(args.folder_path, manifest_path, args.workers, tuple(ext.lower() for ext in args.extensions))
+    for relative_path, record in sorted(files.items()):
+        if not record["valid"]:
+            filename = os.path.basename(relative_path)
+            root = os.path.join(args.folder_path, os.path.dirname(relative_path))
+            print(f"{filename} in folder {root} is corrupted or cannot be identified.")
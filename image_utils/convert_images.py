@@ -1,39 +1,164 @@
+import argparse
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from PIL import Image
+from count_images import cache_path
 
-def convert_tiff_to_png(input_folder, output_folder):
+# Manifests of older runs were written into the output folder; they are still read once
+LEGACY_MANIFEST_NAME = "conversion_manifest.jsonl"
+
+def find_tiff_files(input_folder, output_folder):
     """
-    Converts all TIFF files in a folder (and its subfolders) to PNG files,
-    preserving the directory structure.
-    
+    Lists the TIFF files in a folder (and its subfolders) with their PNG output paths.
+
     Args:
         input_folder (str): Path to the folder containing TIFF files.
         output_folder (str): Path to the folder where the PNG files will be saved.
+
+    Returns:
+        list: (tiff_path, png_path) tuples preserving the directory structure.
     """
-    # Loop through all files and directories in the input folder
+    jobs = []
     for root, _, files in os.walk(input_folder):
         for filename in files:
             if filename.lower().endswith('.tif') or filename.lower().endswith('.tiff'):
-                tiff_path = os.path.join(root, filename)
-                
-                # Construct the corresponding output folder path
                 relative_path = os.path.relpath(root, input_folder)
-                output_subfolder = os.path.join(output_folder, relative_path)
-                os.makedirs(output_subfolder, exist_ok=True)
-
-                # Define the output PNG file path
                 png_filename = f"{os.path.splitext(filename)[0]}.png"
-                png_path = os.path.join(output_subfolder, png_filename)
+                jobs.append((os.path.join(root, filename), os.path.join(output_folder, relative_path, png_filename)))
+    return jobs
+
+def convert_file(tiff_path, png_path, grayscale=False, optimize=False):
+    """
+    Converts one TIFF file to PNG.
+
+    Returns:
+        tuple: (tiff_path, source mtime in ns, error message or None).
+    """
+    try:
+        mtime_ns = os.stat(tiff_path).st_mtime_ns
+        os.makedirs(os.path.dirname(png_path), exist_ok=True)
+        with Image.open(tiff_path) as img:
+            if grayscale:
+                img = img.convert('L')
+            # Write to a temporary file first so an interrupted run never leaves a truncated PNG
+            temp_path = png_path + ".tmp"
+            img.save(temp_path, 'PNG', optimize=optimize)
+        os.replace(temp_path, png_path)
+        return tiff_path, mtime_ns, None
+    except Exception as e:
+        return tiff_path, None, str(e)
+
+def default_manifest_path(output_folder):
+    # Manifest of an output folder in the cache folder of count_images, keyed by its absolute
+    # path (None if caching is disabled), so the dataset itself is never written to
+    return cache_path("conversion_manifest", output_folder, ".jsonl")
 
+def load_manifest(manifest_path):
+    # Read the records (source mtime and conversion options) of files already converted
+    converted = {}
+    if manifest_path is not None and os.path.exists(manifest_path):
+        with open(manifest_path) as manifest:
+            for line in manifest:
                 try:
-                    # Open the TIFF image and save as PNG
-                    with Image.open(tiff_path) as img:
-                        img.save(png_path, 'PNG')
-                    print(f"Converted {filename} to {png_filename}")
-                except Exception as e:
-                    print(f"Error processing {filename}: {e}")
+                    record = json.loads(line)
+                except json.JSONDecodeError:  # Last line of an interrupted run
+                    continue
+                converted[record["source"]] = record
+    return converted
+
+def compact_manifest(manifest_path, records):
+    # Rewrite the manifest with one record per file, dropping superseded records and files
+    # that no longer exist, so the append-only manifest doesn't grow with every run
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, "w") as manifest:
+        for record in records:
+            manifest.write(json.dumps(record) + "\n")
+    os.replace(temp_path, manifest_path)
+
+def is_up_to_date(tiff_path, png_path, source, converted, options):
+    # A file is skipped if its PNG exists and the manifest records its current mtime and the
+    # same options, or (for files without options in the manifest) its PNG is newer than it
+    if not os.path.exists(png_path):
+        return False
+    source_mtime = os.stat(tiff_path).st_mtime_ns
+    record = converted.get(source)
+    if record is not None and "options" in record:
+        return record["mtime_ns"] == source_mtime and record["options"] == options
+    return os.stat(png_path).st_mtime_ns > source_mtime
+
+def convert_tiff_to_png(input_folder, output_folder, workers=None, grayscale=False, optimize=False, force=False,
+                        manifest_path=None):
+    """
+    Converts all TIFF files in a folder (and its subfolders) to PNG files,
+    preserving the directory structure.
+
+    Conversion runs on a process pool and is incremental: files recorded in the manifest
+    with their current mtime and the same options are skipped, so an interrupted run
+    resumes where it stopped. Missing PNGs are always converted.
+
+    Args:
+        input_folder (str): Path to the folder containing TIFF files.
+        output_folder (str): Path to the folder where the PNG files will be saved.
+        workers (int): Number of worker processes (defaults to the CPU count).
+        grayscale (bool): Save single-channel PNGs.
+        optimize (bool): Let PIL spend extra time producing smaller PNGs.
+        force (bool): Convert every file even if it is up to date.
+        manifest_path (str): Manifest file (defaults to default_manifest_path(output_folder)).
+
+    Returns:
+        dict: Counts of converted, skipped and failed files.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_path = manifest_path or default_manifest_path(output_folder)
+    converted = {}
+    if not force:
+        converted = load_manifest(os.path.join(output_folder, LEGACY_MANIFEST_NAME))
+        converted.update(load_manifest(manifest_path))
+    options = {"grayscale": grayscale, "optimize": optimize}
+
+    jobs = find_tiff_files(input_folder, output_folder)
+    sources = [os.path.relpath(tiff_path, input_folder) for tiff_path, _ in jobs]
+    pending = [job for job, source in zip(jobs, sources)
+               if force or not is_up_to_date(*job, source, converted, options)]
+    if manifest_path is not None:
+        compact_manifest(manifest_path, [converted[source] for source in sources if source in converted])
+    stats = {"converted": 0, "skipped": len(jobs) - len(pending), "failed": 0}
+    print(f"Found {len(jobs)} TIFF files, {len(pending)} to convert ({stats['skipped']} up to date)")
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(manifest_path or os.devnull, "a") as manifest:
+        futures = [executor.submit(convert_file, tiff_path, png_path, grayscale, optimize) for tiff_path, png_path in pending]
+        for done, future in enumerate(as_completed(futures), 1):
+            tiff_path, mtime_ns, error = future.result()
+            if error is None:
+                stats["converted"] += 1
+                source = os.path.relpath(tiff_path, input_folder)
+                manifest.write(json.dumps({"source": source, "mtime_ns": mtime_ns, "options": options}) + "\n")
+                manifest.flush()
+            else:
+                stats["failed"] += 1
+                print(f"Error processing {os.path.basename(tiff_path)}: {error}")
+
+            if done % 100 == 0 or done == len(futures):
+                elapsed = time.perf_counter() - start
+                print(f"{done}/{len(futures)} files, {done / elapsed:.1f} files/sec")
+
+    print(f"Converted {stats['converted']}, skipped {stats['skipped']}, failed {stats['failed']}")
+    return stats
 
 # Example usage
-input_folder = "C:/Users/krisa/Desktop/CPRO 2902/signature_dataset3/BHSig260-Hindi/BHSig260-Hindi"
-output_folder = "C:/Users/krisa/Desktop/CPRO 2902/signature_dataset3_png/Hindi"
-convert_tiff_to_png(input_folder, output_folder)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert TIFF signatures to PNG, preserving the folder layout.")
+    parser.add_argument("input_folder", nargs="?", default="C:/Users/krisa/Desktop/CPRO 2902/signature_dataset3/BHSig260-Hindi/BHSig260-Hindi")
+    parser.add_argument("output_folder", nargs="?", default="C:/Users/krisa/Desktop/CPRO 2902/signature_dataset3_png/Hindi")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--grayscale", action="store_true", help="Write single-channel PNGs")
+    parser.add_argument("--optimize", action="store_true", help="Write smaller (slower to encode) PNGs")
+    parser.add_argument("--force", action="store_true", help="Reconvert files that are up to date")
+    parser.add_argument("--manifest", default=None, help="Manifest path (default: in the cache folder, keyed by the output folder)")
+    args = parser.parse_args()
+    convert_tiff_to_png(args.input_folder, args.output_folder, args.workers, args.grayscale, args.optimize, args.force,
+                        args.manifest)
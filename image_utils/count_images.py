@@ -1,12 +1,21 @@
+import argparse
+import hashlib
+import json
 import os
+from PIL import Image
+
+# Indexes are cached outside the datasets (which may be read-only or shared), in the cache folder
+# of version_2/preprocess_cache.py; set SIGNATURE_CACHE_DIR to an empty string to keep them in memory only
+CACHE_DIR = os.environ.get("SIGNATURE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "signature_verification"))
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff')
 
 def count_files_in_subfolders(folder_path):
     """
     Counts the number of files in each immediate subfolder of a given folder.
-    
+
     Args:
         folder_path (str): The path to the root folder.
-    
+
     Returns:
         dict: A dictionary where keys are subfolder paths and values are the number of files in them.
     """
@@ -25,13 +34,161 @@ def count_files_in_subfolders(folder_path):
 
     return folder_file_counts
 
+def cache_path(kind, path, extension):
+    # Cache file of one kind for a folder or file, keyed by its absolute path (None if caching is disabled)
+    if not CACHE_DIR:
+        return None
+    path = os.path.abspath(path)
+    digest = hashlib.sha1(path.encode()).hexdigest()[:12]
+    return os.path.join(CACHE_DIR, kind, f"{os.path.basename(os.path.normpath(path))}-{digest}{extension}")
+
+def default_index_path(root):
+    # Cache file of the index of a dataset root
+    return cache_path("dataset_index", root, ".json")
+
+def image_size(image_path):
+    # Read the image dimensions from the file header only
+    try:
+        with Image.open(image_path) as img:
+            return list(img.size)
+    except (IOError, SyntaxError, Image.UnidentifiedImageError):
+        return None
+
+class DatasetIndex:
+    """
+    Cached index of a dataset split laid out as <root>/<class>/<user>/<image>.
+
+    The index stores every image of every user folder with its dimensions and is saved
+    in the cache folder, keyed by the root path, so the dataset itself is never written to.
+    Refreshing only rescans folders whose mtime changed
+    (adding, removing or renaming a file updates its folder's mtime), so unchanged
+    user folders cost one stat call each.
+
+    Args:
+        root (str): Folder with one subfolder per class (e.g. 'genuine' and 'forged').
+        index_path (str): Where the index is cached (defaults to default_index_path(root)).
+    """
+
+    def __init__(self, root, index_path=None):
+        self.root = os.path.abspath(root)
+        self.index_path = index_path or default_index_path(self.root)
+        self.classes = {}  # class -> {"mtime_ns": int, "users": {user: {"mtime_ns": int, "files": {name: [w, h]}}}}
+        if self.index_path and os.path.exists(self.index_path):
+            with open(self.index_path) as file:
+                self.classes = json.load(file)["classes"]
+        self.refresh()
+
+    def refresh(self):
+        # Rescan the folders whose mtime changed and save the index if anything did
+        changed = False
+        with os.scandir(self.root) as entries:
+            class_dirs = {entry.name: entry for entry in entries if entry.is_dir()}
+        for class_name in list(self.classes):
+            if class_name not in class_dirs:
+                del self.classes[class_name]
+                changed = True
+
+        for class_name, class_entry in class_dirs.items():
+            class_mtime = class_entry.stat().st_mtime_ns
+            cached_class = self.classes.get(class_name, {"mtime_ns": None, "users": {}})
+            if cached_class["mtime_ns"] == class_mtime:
+                user_names = list(cached_class["users"])
+            else:
+                with os.scandir(class_entry.path) as entries:
+                    user_names = [entry.name for entry in entries if entry.is_dir()]
+                changed = True
+
+            users = {}
+            for user in user_names:
+                user_path = os.path.join(class_entry.path, user)
+                user_mtime = os.stat(user_path).st_mtime_ns
+                cached_user = cached_class["users"].get(user)
+                if cached_user is not None and cached_user["mtime_ns"] == user_mtime:
+                    users[user] = cached_user
+                    continue
+                users[user] = {"mtime_ns": user_mtime, "files": self._scan_user(user_path, cached_user)}
+                changed = True
+            self.classes[class_name] = {"mtime_ns": class_mtime, "users": users}
+
+        if changed:
+            self.save()
+
+    def _scan_user(self, user_path, cached_user):
+        # List a user folder, only reading the dimensions of files not seen before
+        known = cached_user["files"] if cached_user else {}
+        files = {}
+        with os.scandir(user_path) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    files[entry.name] = known.get(entry.name) or image_size(entry.path)
+        return files
+
+    def save(self):
+        if not self.index_path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump({"root": self.root, "classes": self.classes}, file)
+        os.replace(temp_path, self.index_path)
+
+    def users(self, class_name):
+        # User folder names of a class
+        return sorted(self.classes.get(class_name, {"users": {}})["users"])
+
+    def list_files(self, class_name, user=None, extensions=IMAGE_EXTENSIONS):
+        # Full paths of the images of a class (or of one user of a class)
+        class_users = self.classes.get(class_name, {"users": {}})["users"]
+        user_names = [user] if user is not None else sorted(class_users)
+        return [os.path.join(self.root, class_name, user_name, name)
+                for user_name in user_names
+                for name in sorted(class_users.get(user_name, {"files": {}})["files"])
+                if name.lower().endswith(extensions)]
+
+    def statistics(self):
+        """
+        Summarizes the dataset.
+
+        Returns:
+            dict: Per-class image and user counts, per-user counts of every class,
+            the distinct image dimensions and the genuine/forged balance.
+        """
+        stats = {"classes": {}, "users": {}, "dimensions": {}}
+        for class_name, class_data in self.classes.items():
+            stats["classes"][class_name] = {
+                "users": len(class_data["users"]),
+                "images": sum(len(user["files"]) for user in class_data["users"].values()),
+            }
+            for user, user_data in class_data["users"].items():
+                user_name = user.replace('_forged', '')  # Forged folders may carry a '_forged' suffix
+                stats["users"].setdefault(user_name, {})[class_name] = len(user_data["files"])
+                for size in user_data["files"].values():
+                    key = "unreadable" if size is None else f"{size[0]}x{size[1]}"
+                    stats["dimensions"][key] = stats["dimensions"].get(key, 0) + 1
+        genuine = stats["classes"].get("genuine", {}).get("images", 0)
+        forged = stats["classes"].get("forged", {}).get("images", 0)
+        stats["genuine_forged_ratio"] = genuine / forged if forged else None
+        return stats
+
 # Example usage
 if __name__ == "__main__":
-    folder_path = "C:/Users/krisa/Desktop/CPRO 2902/signature_verification_dataset4/test - database signatures/forged"
+    parser = argparse.ArgumentParser(description="Index a dataset split and print per-user statistics.")
+    parser.add_argument("folder_path", nargs="?", default="C:/Users/krisa/Desktop/CPRO 2902/signature_verification_dataset4/test - database signatures")
+    args = parser.parse_args()
+    folder_path = args.folder_path
+
     if os.path.exists(folder_path) and os.path.isdir(folder_path):
-        results = count_files_in_subfolders(folder_path)
-        print("\nFile Counts in Subfolders:")
-        for subfolder, count in results.items():
-            print(f"{subfolder}: {count} files")
+        stats = DatasetIndex(folder_path).statistics()
+        print("\nImages per class:")
+        for class_name, counts in sorted(stats["classes"].items()):
+            print(f"{class_name}: {counts['images']} images from {counts['users']} users")
+        print("\nImages per user:")
+        for user, counts in sorted(stats["users"].items()):
+            print(f"{user}: " + ", ".join(f"{count} {class_name}" for class_name, count in sorted(counts.items())))
+        print("\nImage dimensions:")
+        for size, count in sorted(stats["dimensions"].items(), key=lambda item: -item[1]):
+            print(f"{size}: {count} images")
+        if stats["genuine_forged_ratio"] is not None:
+            print(f"\nGenuine/forged ratio: {stats['genuine_forged_ratio']:.2f}")
     else:
         print(f"The path '{folder_path}' is invalid or not a folder.")
@@ -1,17 +1,17 @@
 import numpy as np
-import cv2
 import os
+import sys
 from tensorflow.keras.models import load_model
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "version_2"))
+from preprocessing import CV2_GRAY_PIPELINE, decode_image, to_float
+
 # Function to load and preprocess an image
 def load_and_preprocess_image(path):
-    image = cv2.imread(path)
+    # Grayscale 224x224 (cv2 linear resize, as in training), normalized, with the channel dimension
+    image = decode_image(path, pipeline=CV2_GRAY_PIPELINE)
     if image is not None:
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        image = cv2.resize(image, (224, 224))
-        image = image / 255.0  # Normalize
-        image = image.reshape(224, 224, 1)  # Add the channel dimension
-        return image
+        return to_float(image[np.newaxis], channels=1)[0]
     else:
         return None
 
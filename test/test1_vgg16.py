@@ -1,22 +1,21 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
-import cv2
+import os
+import sys
 import numpy as np
 from tensorflow.keras.models import load_model # type: ignore
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "version_2"))
+from preprocessing import CV2_COLOR_PIPELINE, preprocess_batch, to_float
+
 # Load your trained model (adjust the path)
 model = load_model("C:/Users/krisa/Desktop/CPRO 2902/Offline-Signature-Verification/verification_model.h5")
 
-def preprocess_image(image_path):
-    image = cv2.imread(image_path)
-
-    # Check if the image is grayscale and convert to RGB if necessary
-    if image.shape[-1] == 1:  # Check if the image is grayscale
-        image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)  # Convert to RGB
-        
-    image = cv2.resize(image, (224, 224))  # Resize to match model input
-    image = image.astype('float32') / 255.0  # Normalize
-    return np.expand_dims(image, axis=0)  # Add batch dimension
+def preprocess_images(*image_paths):
+    # Decode the images together (cv2.imread color and linear resize); returns normalized
+    # batches of one image
+    images = to_float(preprocess_batch(image_paths, pipeline=CV2_COLOR_PIPELINE))
+    return [image[np.newaxis] for image in images]
 
 def compare_signatures():
     file_path1 = filedialog.askopenfilename(title="Select Signature 1")
@@ -24,8 +23,7 @@ def compare_signatures():
     
     if file_path1 and file_path2:
         # Preprocess images
-        signature1 = preprocess_image(file_path1)
-        signature2 = preprocess_image(file_path2)
+        signature1, signature2 = preprocess_images(file_path1, file_path2)
 
         # Predict similarity using the model
         similarity_score = model.predict([signature1, signature2])
@@ -1,54 +1,55 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
-import cv2
 import numpy as np
 from tensorflow.keras.models import load_model  # type: ignore
 import os
+import sys
+from functools import partial
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "version_2"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image_utils"))
+from identification_index import SignatureIndex
+from model_utils import split_similarity_model, model_tag
+from preprocess_cache import cached_loader
+from preprocessing import CV2_COLOR_PIPELINE, decode_image, image_shape, to_float, pipeline_tag
+from count_images import cache_path
 
 # Load the trained model (adjust the path)
-model = load_model("C:/Users/krisa/Desktop/CPRO 2902/Offline-Signature-Verification/verification_model2.h5")
+MODEL_PATH = "C:/Users/krisa/Desktop/CPRO 2902/Offline-Signature-Verification/verification_model2.h5"
+model = load_model(MODEL_PATH)
+embedding_model, head_model = split_similarity_model(model)
+
+# Get the database of genuine signatures and the persistent index built over it
+DATABASE_FOLDER = "C:/Users/krisa/Desktop/CPRO 2902/signature_dataset2_after16/genuine"  # Adjust path to your database folder
+INDEX_PATH = cache_path("signature_index", DATABASE_FOLDER, ".npz")  # Kept out of the dataset folder
+TOP_K = 3
 
 # Define a threshold for similarity (adjust based on model performance)
 THRESHOLD = 0.5  # Genuine if similarity score > threshold
 
+# Decoded images are cached on disk, keyed by path, mtime, size and the pipeline parameters
+# (cv2.imread color and linear resize, as this script always decoded)
+load_cached_image = cached_loader("test2", partial(decode_image, pipeline=CV2_COLOR_PIPELINE),
+                                  image_shape(CV2_COLOR_PIPELINE), {"pipeline": CV2_COLOR_PIPELINE})
+
 # Preprocess image
 def preprocess_image(image_path):
-    image = cv2.imread(image_path)
+    image = load_cached_image(image_path)
 
     if image is None:
         print(f"Error: Failed to load image at {image_path}")
         return np.array([])  # Return empty array if image cannot be loaded
 
-    # Check if the image is grayscale and convert to RGB if necessary
-    if image.shape[-1] == 1:  # Check if the image is grayscale
-        image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)  # Convert to RGB
-        
-    image = cv2.resize(image, (224, 224))  # Resize to match model input
-    image = image.astype('float32') / 255.0  # Normalize
-    return np.expand_dims(image, axis=0)  # Add batch dimension
-
-# Load the signature database
-def load_signature_database(database_folder):
-    signatures = []
-    labels = []
-    
-    if not os.path.exists(database_folder):
-        print("Error: Database folder does not exist.")
-        return signatures, labels
-
-    # Walk through the database folder and load images from subfolders
-    for root, dirs, files in os.walk(database_folder):
-        for filename in files:
-            if filename.endswith(".jpg") or filename.endswith(".png"):  # Support image formats
-                file_path = os.path.join(root, filename)
-                signature = preprocess_image(file_path)
-                if signature.size != 0:
-                    signatures.append(signature)
-                    # Use the folder name as the label (this assumes each folder corresponds to a user)
-                    label = os.path.basename(root)  # Folder name as the label
-                    labels.append(label)
-
-    return np.array(signatures), labels
+    return to_float(image[np.newaxis])  # Normalize, with a batch dimension
+
+# Lazily open the identification index so it is built once and reused between clicks
+signature_index = None
+
+def get_signature_index():
+    global signature_index
+    if signature_index is None:
+        signature_index = SignatureIndex(INDEX_PATH, embedding_model, head_model, preprocess_image, pipeline_tag(model_tag(MODEL_PATH), CV2_COLOR_PIPELINE))
+    return signature_index
 
 # Compare the input signature to the database
 def compare_signatures(input_signature_path):
@@ -60,24 +61,22 @@ def compare_signatures(input_signature_path):
             messagebox.showerror("Error", "Failed to load input signature.")
             return
 
-        # Get the database of genuine signatures
-        database_folder = "C:/Users/krisa/Desktop/CPRO 2902/signature_dataset2_after16/genuine"  # Adjust path to your database folder
-        database_signatures, labels = load_signature_database(database_folder)
+        if not os.path.exists(DATABASE_FOLDER):
+            messagebox.showerror("Error", "Database folder does not exist.")
+            return
+
+        # Only signatures added, removed or changed since the last query are (re-)embedded
+        index = get_signature_index()
+        index.sync(DATABASE_FOLDER)
 
-        if len(database_signatures) == 0:
+        if len(index) == 0:
             messagebox.showerror("Error", "No signatures found in the database.")
             return
 
-        # Predict the similarity scores for each signature in the database
-        similarity_scores = []
-        for signature in database_signatures:
-            similarity_score = model.predict([input_signature, signature])
-            similarity_scores.append(similarity_score[0][0])
-
-        # Find the most similar signature
-        most_similar_index = np.argmax(similarity_scores)
-        most_similar_score = similarity_scores[most_similar_index]
-        most_similar_label = labels[most_similar_index]
+        # Score the input against every indexed signature and keep the best match per user
+        matches = index.query(input_signature, top_k=TOP_K)
+        most_similar_label, most_similar_score, _ = matches[0]
+        ranking = "\n".join(f"{label}: {score:.2f}" for label, score, _ in matches)
 
         # Determine if the input signature is genuine or forged
         if most_similar_score > THRESHOLD:
@@ -86,6 +85,7 @@ def compare_signatures(input_signature_path):
         else:
             result = (f"The signature is **forged**, with no sufficient match found.\n"
                       f"The highest similarity score was {most_similar_score:.2f}.")
+        result += f"\n\nTop matches:\n{ranking}"
 
         # Display the result
         messagebox.showinfo("Result", result)
@@ -0,0 +1,51 @@
+import argparse
+import os
+import time
+
+def time_batches(batches, num_batches):
+    # Time how fast num_batches batches can be pulled (after one warmup batch)
+    iterator = iter(batches)
+    next(iterator)
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        next(iterator)
+    return num_batches / (time.perf_counter() - start)
+
+def sequence_batches(generator):
+    # Iterate a keras Sequence the way model.fit does, epoch after epoch
+    while True:
+        for index in range(len(generator)):
+            yield generator[index]
+        generator.on_epoch_end()
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare SignaturePairGenerator with the tf.data pair pipeline.")
+    parser.add_argument("image_dir", help="Folder with 'genuine' and 'forged' subfolders of user folders")
+    parser.add_argument("--variant", choices=["train4", "train5"], default="train5")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--batches", type=int, default=50)
+    parser.add_argument("--use-cache", action="store_true", help="Let the Sequence use the preprocessed image cache")
+    args = parser.parse_args()
+
+    if not args.use_cache:
+        os.environ["SIGNATURE_CACHE_DIR"] = ""  # Must be set before preprocess_cache is imported
+
+    from pair_dataset import make_pair_dataset
+    if args.variant == "train4":
+        from train4_2inputs import SignaturePairGenerator
+    else:
+        from train5 import SignaturePairGenerator
+
+    generator = SignaturePairGenerator(args.image_dir, batch_size=args.batch_size)
+    sequence_rate = time_batches(sequence_batches(generator), args.batches)
+
+    dataset = make_pair_dataset(args.image_dir, batch_size=args.batch_size, seed=0,
+                                include_matching_pairs=args.variant == "train5")
+    dataset_rate = time_batches(dataset.repeat(), args.batches)
+
+    print(f"SignaturePairGenerator ({args.variant}): {sequence_rate:.2f} batches/sec")
+    print(f"tf.data pipeline ({args.variant}): {dataset_rate:.2f} batches/sec")
+    print(f"Speedup: {dataset_rate / sequence_rate:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import os
+import tensorflow as tf
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+def list_image_paths(image_dir, class_name, valid_paths=None, dataset_index=None):
+    # List the images of every user subfolder of image_dir/class_name
+    if dataset_index is not None:  # Cached listing (see image_utils/count_images.DatasetIndex)
+        image_paths = dataset_index.list_files(class_name, extensions=('jpg', 'jpeg', 'png'))
+    else:
+        class_path = os.path.join(image_dir, class_name)
+        image_paths = []
+        for subfolder in os.listdir(class_path):
+            subfolder_path = os.path.join(class_path, subfolder)
+            if os.path.isdir(subfolder_path):
+                image_paths.extend([os.path.join(subfolder_path, f) for f in os.listdir(subfolder_path) if f.endswith(('jpg', 'jpeg', 'png'))])
+    if valid_paths is not None:  # Skip files the validation manifest marks as corrupt
+        image_paths = [path for path in image_paths if os.path.normpath(os.path.abspath(path)) in valid_paths]
+    return image_paths
+
+def load_image(path, image_size):
+    # Read, decode and resize one image file (same output as load_img + img_to_array / 255,
+    # i.e. version_2/preprocessing.LOAD_IMG_PIPELINE: RGB, nearest-neighbour resize)
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    image = tf.image.resize(image, image_size, method="nearest")
+    return tf.cast(image, tf.float32) / 255.0
+
+def make_pair_dataset(image_dir, batch_size, image_size=(224, 224), shuffle=True, seed=None,
+                      include_matching_pairs=False, num_shards=1, shard_index=0, valid_paths=None,
+                      dataset_index=None):
+    """
+    Builds a tf.data pipeline of signature pairs, a drop-in for SignaturePairGenerator.
+
+    Pairs the i-th genuine image with the i-th forged image (label 0), like the
+    train4_2inputs generator. With include_matching_pairs, every genuine image is also
+    paired with itself (label 1) and batches hold 2 * batch_size pairs, like train5.
+    Files are read, decoded and resized in parallel and batches are prefetched while
+    the model trains.
+
+    Args:
+        image_dir (str): Folder with 'genuine' and 'forged' subfolders of user folders.
+        batch_size (int): Number of genuine/forged pairs per batch.
+        image_size (tuple): Size images are resized to.
+        shuffle (bool): Reshuffle the pairs every epoch.
+        seed (int): Shuffle seed; when given the pipeline output is deterministic.
+        include_matching_pairs (bool): Also emit (genuine, genuine) pairs labelled 1.
+        num_shards (int): Number of interleaved shards the pairs are split into.
+        shard_index (int): Shard read by this pipeline.
+        valid_paths (set): When given, only these images are used (see
+            image_utils/check_valid_images.load_valid_paths).
+        dataset_index (DatasetIndex): Cached listing of image_dir used instead of
+            listing the folders (see image_utils/count_images.py).
+
+    Returns:
+        tf.data.Dataset: Yields ({"signature1": x1, "signature2": x2}, y) batches.
+    """
+    genuine_images = list_image_paths(image_dir, 'genuine', valid_paths, dataset_index)
+    forged_images = list_image_paths(image_dir, 'forged', valid_paths, dataset_index)
+    pair_count = min(len(genuine_images), len(forged_images))
+
+    dataset = tf.data.Dataset.from_tensor_slices((genuine_images[:pair_count], forged_images[:pair_count]))
+    if num_shards > 1:
+        dataset = dataset.shard(num_shards, shard_index)  # Every num_shards-th pair
+    if shuffle:
+        dataset = dataset.shuffle(pair_count, seed=seed, reshuffle_each_iteration=True)
+
+    def load_pair(genuine_path, forged_path):
+        return load_image(genuine_path, image_size), load_image(forged_path, image_size)
+
+    dataset = dataset.map(load_pair, num_parallel_calls=AUTOTUNE)
+
+    if include_matching_pairs:
+        def expand_pair(genuine_img, forged_img):
+            # Matching pair (label 1) followed by non-matching pair (label 0)
+            return tf.data.Dataset.from_tensor_slices((
+                tf.stack([genuine_img, genuine_img]),
+                tf.stack([genuine_img, forged_img]),
+                tf.constant([1, 0], dtype=tf.int64),
+            ))
+        dataset = dataset.flat_map(expand_pair)
+        batch_size *= 2
+    else:
+        # Label is 0 for every genuine/forged pair
+        dataset = dataset.map(lambda genuine_img, forged_img: (genuine_img, forged_img, tf.constant(0, dtype=tf.int64)))
+
+    dataset = dataset.batch(batch_size, drop_remainder=True)
+    dataset = dataset.map(lambda x1, x2, y: ({"signature1": x1, "signature2": x2}, y))
+
+    options = tf.data.Options()
+    options.deterministic = seed is not None
+    return dataset.with_options(options).prefetch(AUTOTUNE)
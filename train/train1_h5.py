@@ -1,5 +1,5 @@
 import os
-import cv2
+import sys
 import numpy as np
 from sklearn.model_selection import train_test_split
 from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense # type: ignore
@@ -7,14 +7,15 @@ from tensorflow.keras.models import Sequential # type: ignore
 from tensorflow.keras.utils import to_categorical # type: ignore
 from tensorflow.keras.preprocessing.image import ImageDataGenerator # type: ignore
 
-def load_and_preprocess_image(path, label):
-    image = cv2.imread(path)
-    if image is not None:
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        image = cv2.resize(image, (224, 224))
-        return image, label
-    else:
-        return None, None
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "version_2"))
+from preprocessing import CV2_GRAY_PIPELINE, decode_batch, to_float
+
+def load_images(folder):
+    # Decode every image under folder in one batch (grayscale, 224x224 with the cv2.resize
+    # linear interpolation this model was trained with), skipping unreadable files
+    paths = [os.path.join(root, f) for root, _, files in os.walk(folder) for f in files]
+    images, ok = decode_batch(paths, pipeline=CV2_GRAY_PIPELINE)
+    return images[ok]
 
 # Path to the genuine signatures
 genuine_path = "C:/Users/krisa/Desktop/CPRO 2902/signature_verification_dataset/sign_data/test/genuine"
@@ -22,25 +23,9 @@ genuine_path = "C:/Users/krisa/Desktop/CPRO 2902/signature_verification_dataset/
 # Path to the forged signatures
 forged_path = "C:/Users/krisa/Desktop/CPRO 2902/signature_verification_dataset/sign_data/test/forged"
 
-# Walk through the genuine signature folder
-genuine_images_and_labels = []
-for root, _, files in os.walk(genuine_path):
-    for f in files:
-        img, lbl = load_and_preprocess_image(os.path.join(root, f), 0)
-        if img is not None:
-            genuine_images_and_labels.append((img, lbl))
-
-# Walk through the forged signature folder
-forged_images_and_labels = []
-for root, _, files in os.walk(forged_path):
-    for f in files:
-        img, lbl = load_and_preprocess_image(os.path.join(root, f), 1)
-        if img is not None:
-            forged_images_and_labels.append((img, lbl))
-
-# Extract images and labels
-genuine_images = np.array([img for img, lbl in genuine_images_and_labels]) / 255.0
-forged_images = np.array([img for img, lbl in forged_images_and_labels]) / 255.0
+# Load and normalize the images (float32, one channel)
+genuine_images = to_float(load_images(genuine_path), channels=1)
+forged_images = to_float(load_images(forged_path), channels=1)
 
 genuine_labels = np.zeros(len(genuine_images))
 forged_labels = np.ones(len(forged_images))
@@ -3,22 +3,50 @@ import tensorflow as tf
 from tensorflow.keras import layers
 from tensorflow.keras.models import Model
 from tensorflow.keras.applications import VGG16
-from tensorflow.keras.preprocessing.image import load_img, img_to_array
 from tensorflow.keras.utils import Sequence
 import os
+import sys
+from functools import partial
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "version_2"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image_utils"))
+from preprocess_cache import cached_loader
+from preprocessing import IMAGE_SIZE, LOAD_IMG_PIPELINE, decode_image, image_shape, to_float
+from pair_dataset import make_pair_dataset
+from compile_dataset import CompiledDataset
+from check_valid_images import load_valid_paths
+from count_images import DatasetIndex
+
+# Feed model.fit from the parallel tf.data pipeline instead of SignaturePairGenerator
+USE_TF_DATA = True
+# Output folder of version_2/compile_dataset.py; when set, training reads its memmap instead
+COMPILED_DATASET_DIR = None
+# Manifest written by image_utils/check_valid_images.py (by default at
+# default_manifest_path(<folder>), printed by the script); when set, corrupt images are skipped
+IMAGE_MANIFEST = None
+SEED = 42
 
 class SignaturePairGenerator(Sequence):
-    def __init__(self, image_dir, batch_size, image_size=(224, 224), subset='training', shuffle=True):
+    def __init__(self, image_dir, batch_size, image_size=(224, 224), subset='training', shuffle=True, dataset_index=None):
         self.image_dir = image_dir
+        self.dataset_index = dataset_index
         self.batch_size = batch_size
+        if tuple(image_size) != IMAGE_SIZE:
+            raise ValueError(f"image_size must be {IMAGE_SIZE}, the size of the preprocessing pipeline")
         self.image_size = image_size
         self.subset = subset
         self.shuffle = shuffle
+        # Decoded uint8 RGB images (as load_img returns them) are cached on disk, keyed by path,
+        # mtime, size and the pipeline parameters
+        self.load_image = cached_loader("pair_generator", partial(decode_image, pipeline=LOAD_IMG_PIPELINE),
+                                        image_shape(LOAD_IMG_PIPELINE), {"pipeline": LOAD_IMG_PIPELINE})
         self.genuine_images = self._load_image_paths('genuine')
         self.forged_images = self._load_image_paths('forged')
         self.on_epoch_end()
 
     def _load_image_paths(self, class_name):
+        if self.dataset_index is not None:  # Cached listing (see image_utils/count_images.DatasetIndex)
+            return self.dataset_index.list_files(class_name, extensions=('jpg', 'jpeg', 'png'))
         class_path = os.path.join(self.image_dir, class_name)
         image_paths = []
         for subfolder in os.listdir(class_path):
@@ -43,11 +71,8 @@ class SignaturePairGenerator(Sequence):
         y = []
         
         for path_genuine, path_forged in zip(batch_genuine_paths, batch_forged_paths):
-            img1 = load_img(path_genuine, target_size=self.image_size)
-            img2 = load_img(path_forged, target_size=self.image_size)
-            
-            img1 = img_to_array(img1) / 255.0
-            img2 = img_to_array(img2) / 255.0
+            img1 = self.load_image(path_genuine)
+            img2 = self.load_image(path_forged)
             
             x1.append(img1)
             x2.append(img2)
@@ -56,7 +81,8 @@ class SignaturePairGenerator(Sequence):
             label = 0  # Assume forged pairs for simplicity
             y.append(label)
         
-        return np.array(x1), np.array(x2), np.array(y)
+        # Normalized once per batch
+        return to_float(np.array(x1)), to_float(np.array(x2)), np.array(y)
 
     def on_epoch_end(self):
         if self.shuffle:
@@ -69,54 +95,73 @@ class SignaturePairGenerator(Sequence):
             self.forged_images = np.array(self.forged_images)[indices]
 
 
-# Load Pre-trained VGG16 Model without the top classification layers
-base_model = VGG16(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
-base_model.trainable = False  # Freeze the pre-trained layers
-
-# Define the Input Layers for two signatures
-input_signature1 = layers.Input(shape=(224, 224, 3), name="signature1")  # Input for uploaded signature
-input_signature2 = layers.Input(shape=(224, 224, 3), name="signature2")  # Input for database signature
-
-# Pass the inputs through the VGG16 base model
-x1 = base_model(input_signature1)
-x1 = layers.Flatten()(x1)
-x2 = base_model(input_signature2)
-x2 = layers.Flatten()(x2)
-
-# Calculate the Euclidean distance between the feature vectors of the two signatures
-distance = layers.Lambda(
-    lambda tensors: tf.norm(tensors[0] - tensors[1], axis=1, keepdims=True),
-    output_shape=(1,)
-)([x1, x2])
-
-# Add a Dense layer for classification (match or non-match)
-x = layers.Dense(256, activation='relu')(distance)
-x = layers.Dropout(0.5)(x)
-output = layers.Dense(1, activation='sigmoid')(x)  # Binary classification: 1 for match, 0 for non-match
-
-# Define the Model with two inputs and one output
-model = Model(inputs={'signature1': input_signature1, 'signature2': input_signature2}, outputs=output)
-
-# Compile the Model
-model.compile(optimizer='adam', loss='binary_crossentropy', metrics=['accuracy'])
-
-# Set up the training and validation generators
-train_generator = SignaturePairGenerator(
-    image_dir="C:/Users/krisa/Desktop/CPRO 2902/signature_verification_dataset3/train",  # Replace with your dataset path
-    batch_size=32,
-    image_size=(224, 224),
-    subset='training'
-)
-
-validation_generator = SignaturePairGenerator(
-    image_dir="C:/Users/krisa/Desktop/CPRO 2902/signature_verification_dataset3/validation",  # Replace with your dataset path
-    batch_size=32,
-    image_size=(224, 224),
-    subset='validation'
-)
-
-# Train the Model
-model.fit(train_generator, validation_data=validation_generator, epochs=15)
-
-# Save the Model
-model.save('verification_model.h5')
+if __name__ == "__main__":
+    # Load Pre-trained VGG16 Model without the top classification layers
+    base_model = VGG16(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
+    base_model.trainable = False  # Freeze the pre-trained layers
+
+    # Define the Input Layers for two signatures
+    input_signature1 = layers.Input(shape=(224, 224, 3), name="signature1")  # Input for uploaded signature
+    input_signature2 = layers.Input(shape=(224, 224, 3), name="signature2")  # Input for database signature
+
+    # Pass the inputs through the VGG16 base model
+    x1 = base_model(input_signature1)
+    x1 = layers.Flatten()(x1)
+    x2 = base_model(input_signature2)
+    x2 = layers.Flatten()(x2)
+
+    # Calculate the Euclidean distance between the feature vectors of the two signatures
+    distance = layers.Lambda(
+        lambda tensors: tf.norm(tensors[0] - tensors[1], axis=1, keepdims=True),
+        output_shape=(1,)
+    )([x1, x2])
+
+    # Add a Dense layer for classification (match or non-match)
+    x = layers.Dense(256, activation='relu')(distance)
+    x = layers.Dropout(0.5)(x)
+    output = layers.Dense(1, activation='sigmoid')(x)  # Binary classification: 1 for match, 0 for non-match
+
+    # Define the Model with two inputs and one output
+    model = Model(inputs={'signature1': input_signature1, 'signature2': input_signature2}, outputs=output)
+
+    # Compile the Model
+    model.compile(optimizer='adam', loss='binary_crossentropy', metrics=['accuracy'])
+
+    train_dir = "C:/Users/krisa/Desktop/CPRO 2902/signature_verification_dataset3/train"  # Replace with your dataset path
+    validation_dir = "C:/Users/krisa/Desktop/CPRO 2902/signature_verification_dataset3/validation"  # Replace with your dataset path
+
+    valid_paths = load_valid_paths(IMAGE_MANIFEST) if IMAGE_MANIFEST else None
+
+    if COMPILED_DATASET_DIR:
+        # Pairs from the compiled dataset, last 30% held out for validation
+        train_generator, validation_generator = CompiledDataset(COMPILED_DATASET_DIR).sequences(
+            validation_fraction=0.3, batch_size=32, seed=SEED, input_names=("signature1", "signature2"))
+    elif USE_TF_DATA:
+        # Set up the training and validation pipelines
+        train_generator = make_pair_dataset(train_dir, batch_size=32, image_size=(224, 224), seed=SEED,
+                                            valid_paths=valid_paths, dataset_index=DatasetIndex(train_dir))
+        validation_generator = make_pair_dataset(validation_dir, batch_size=32, image_size=(224, 224), shuffle=False,
+                                                 valid_paths=valid_paths, dataset_index=DatasetIndex(validation_dir))
+    else:
+        # Set up the training and validation generators
+        train_generator = SignaturePairGenerator(
+            image_dir=train_dir,
+            dataset_index=DatasetIndex(train_dir),
+            batch_size=32,
+            image_size=(224, 224),
+            subset='training'
+        )
+
+        validation_generator = SignaturePairGenerator(
+            image_dir=validation_dir,
+            dataset_index=DatasetIndex(validation_dir),
+            batch_size=32,
+            image_size=(224, 224),
+            subset='validation'
+        )
+
+    # Train the Model
+    model.fit(train_generator, validation_data=validation_generator, epochs=15)
+
+    # Save the Model
+    model.save('verification_model.h5')
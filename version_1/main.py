@@ -2,7 +2,7 @@ from tkinter import Tk, Label, Entry, Button, filedialog, messagebox, Frame
 from tkinter.ttk import Combobox
 import re
 from db_manager import add_user, get_users, add_signature, get_signatures
-from signature_utils import preprocess_image, verify_signature
+from signature_utils import preprocess_image, verify_signature, model_manager
 from tkinter import font
 
 # Helper Functions
@@ -113,6 +113,10 @@ def handle_verify_signature():
         messagebox.showwarning("Input Error", "Please select a signature file!")
         return
 
+    if not model_manager.done:
+        messagebox.showinfo("Please Wait", "The model is still loading, try again in a moment.")
+        return
+
     user_id = selected_user.split(" - ")[0]
     try:
         uploaded_signature = preprocess_image(file_path)  # Preprocess the uploaded signature
@@ -208,4 +212,7 @@ verify_button.grid(row=3, column=0, columnspan=3, pady=15)
 # Populate user dropdown
 refresh_users()
 
+# Load the model in the background so the window shows up right away
+model_manager.start()
+
 app.mainloop()
@@ -1,32 +1,55 @@
-import cv2
+import os
+import sys
+from functools import partial
 import numpy as np
-from tensorflow.keras.models import load_model
 
-# Load the trained model
-model = load_model("C:/Users/krisa/Desktop/CPRO 2902/Offline-Signature-Verification/verification_model.h5")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "version_2"))
+from preprocess_cache import cached_loader
+from preprocessing import IMAGE_SIZE, CV2_GRAY_PIPELINE, decode_image, preprocess_batch, to_float
+from model_manager import ModelManager
+
+# Largest number of references scored in one forward call
+MAX_BATCH_SIZE = 32
+
+# Model path (set VERIFICATION_MODEL_PATH to use another model)
+MODEL_PATH = os.environ.get("VERIFICATION_MODEL_PATH",
+                            "C:/Users/krisa/Desktop/CPRO 2902/Offline-Signature-Verification/verification_model.h5")
+
+def load_verification_model():
+    # Load the trained model (TensorFlow is imported here, not at module import) and run one
+    # dummy pair through it so the first verification doesn't pay for building the graph
+    from tensorflow.keras.models import load_model
+    model = load_model(MODEL_PATH)
+    dummy = np.zeros((1, 224, 224, 3), dtype=np.float32)
+    model.predict_on_batch([dummy, dummy])
+    return model
+
+# The model is loaded on a background thread by model_manager.start(), or on first use
+model_manager = ModelManager(load_verification_model, name="verification model")
+
+# Grayscale with the cv2.resize linear interpolation this app always used
+decode_grayscale = partial(decode_image, pipeline=CV2_GRAY_PIPELINE)
+# Decoded images are cached on disk, keyed by path, mtime, size and the pipeline parameters
+load_cached_image = cached_loader("version_1", decode_grayscale, IMAGE_SIZE, {"pipeline": CV2_GRAY_PIPELINE})
 
 def preprocess_image(image):
-    # Preprocess image for the model
-    if isinstance(image, str):  # File path
-        img = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
-    else:  # Numpy array
-        img = image
-
-    img = cv2.resize(img, (224, 224))  # Resize to 224x224
-    img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)  # Convert to 3 channels
-    img = img / 255.0  # Normalize
-    return np.expand_dims(img, axis=0)
-
-def verify_signature(uploaded_signature, genuine_signatures, threshold=0.5):
-    # Verify a signature against stored signatures
-    similarity_scores = []
-    for genuine_image_data in genuine_signatures:
-        genuine_image = np.frombuffer(genuine_image_data, dtype=np.uint8)
-        genuine_image = cv2.imdecode(genuine_image, cv2.IMREAD_GRAYSCALE)
-        genuine_image = preprocess_image(genuine_image)
-
-        similarity = model.predict([uploaded_signature, genuine_image])[0][0]
-        similarity_scores.append(similarity)
-
-    max_score = max(similarity_scores)
+    # Preprocess image for the model: a file path or a decoded image array
+    img = load_cached_image(image) if isinstance(image, str) else decode_grayscale(image)
+    if img is None:
+        raise ValueError(f"Could not load image: {image}" if isinstance(image, str) else "Could not decode image")
+    return to_float(img[np.newaxis])  # Normalized RGB, with a batch dimension
+
+def verify_signature(uploaded_signature, genuine_signatures, threshold=0.5, max_batch_size=MAX_BATCH_SIZE):
+    # Verify a signature against stored signatures: decode and score them in chunks of
+    # max_batch_size, one forward call per chunk
+    model = model_manager.get()
+    similarity_scores = np.empty(len(genuine_signatures), dtype=np.float32)
+    for start in range(0, len(genuine_signatures), max_batch_size):
+        chunk = genuine_signatures[start:start + max_batch_size]
+        genuine_images = to_float(preprocess_batch(chunk, pipeline=CV2_GRAY_PIPELINE))
+        uploaded_images = np.broadcast_to(uploaded_signature, genuine_images.shape)
+        similarity_scores[start:start + len(chunk)] = np.asarray(
+            model.predict_on_batch([uploaded_images, genuine_images])).reshape(-1)
+
+    max_score = float(similarity_scores.max())
     return max_score, max_score > threshold
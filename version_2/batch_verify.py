@@ -0,0 +1,244 @@
+import argparse
+import csv
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import numpy as np
+from signature_utils import embed_signatures, aggregate_scores
+from preprocessing import decode_batch
+
+HEAD_BATCH_SIZE = 4096
+# Bound on the embedding values per side of one head call (64 MB of float32), so large
+# embeddings (e.g. the 25088-dim Flatten output of train4/train5) get fewer pairs per call
+HEAD_BATCH_ELEMENTS = 1 << 24
+
+def read_rows(input_path):
+    # Stream (user, image_path) rows from a CSV (with a header) or JSONL file. The user is
+    # the user_id column if present, else the email column.
+    with open(input_path, newline="") as file:
+        if input_path.lower().endswith((".jsonl", ".json")):
+            records = (json.loads(line) for line in file if line.strip())
+        else:
+            records = csv.DictReader(file)
+        for record in records:
+            user = record.get("user_id") or record.get("email")
+            yield str(user).strip() if user is not None else None, record.get("image_path") or record.get("path")
+
+def load_checkpoint(checkpoint_path):
+    # Rows already processed and the output size they produced
+    if not os.path.exists(checkpoint_path):
+        return {"rows": 0, "output_bytes": 0}
+    with open(checkpoint_path) as file:
+        return json.load(file)
+
+def save_checkpoint(checkpoint_path, rows, output_bytes):
+    temp_path = checkpoint_path + ".tmp"
+    with open(temp_path, "w") as file:
+        json.dump({"rows": rows, "output_bytes": output_bytes}, file)
+    os.replace(temp_path, checkpoint_path)
+
+class BatchVerifier:
+    """
+    Scores (user, image) rows in windows, loading each user's references once.
+
+    Rows of a window are grouped by user; every query image is embedded in batches and
+    the (query, reference) pairs of a user are scored with a few large head calls. Only the
+    pairs of the current head call are materialized.
+
+    Args:
+        embedding_model, head_model, tag: From inference_backend.load_inference_models.
+        threshold (float): Verification threshold on the best reference score.
+        top_k (int): Number of best reference scores averaged into top_k_mean.
+        batch_size (int): Tower batch size.
+        cache_users (int): Users whose reference embeddings are kept in memory.
+        workers (int): Threads decoding query images.
+    """
+
+    def __init__(self, embedding_model, head_model, tag, threshold=0.5, top_k=3, batch_size=32,
+                 cache_users=1000, workers=8):
+        # Imported here so SIGNATURE_DB_PATH can be set before the database is opened
+        from db_manager import get_user_by_email
+        from reference_embeddings import load_reference_embeddings
+        self.get_user_by_email = get_user_by_email
+        self.load_reference_embeddings = load_reference_embeddings
+
+        self.embedding_model = embedding_model
+        self.head_model = head_model
+        self.tag = tag
+        self.threshold = threshold
+        self.top_k = top_k
+        self.batch_size = batch_size
+        self.cache_users = cache_users
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.user_ids = {}  # email or user_id string -> user_id (None if unknown)
+        self.references = OrderedDict()  # user_id -> embeddings, least recently used first
+
+    def resolve_user(self, user):
+        if user not in self.user_ids:
+            self.user_ids[user] = int(user) if user.isdigit() else self.get_user_by_email(user)
+        return self.user_ids[user]
+
+    def user_references(self, user_id):
+        if user_id in self.references:
+            self.references.move_to_end(user_id)
+        else:
+            embeddings = self.load_reference_embeddings(user_id, self.embedding_model, self.tag)
+            self.references[user_id] = np.asarray(embeddings, dtype=np.float32) if embeddings else np.empty((0, 0), np.float32)
+            if len(self.references) > self.cache_users:
+                self.references.popitem(last=False)
+        return self.references[user_id]
+
+    def score_window(self, rows):
+        """
+        Scores one window of rows.
+
+        Args:
+            rows (list): (row_number, user, image_path) tuples.
+
+        Returns:
+            list: One result dict per row, in row order.
+        """
+        # uint8 grayscale images, normalized per tower batch by embed_signatures
+        images, decoded = decode_batch([image_path or "" for _, _, image_path in rows], executor=self.executor)
+        results = {}
+        by_user = {}
+        for (row_number, user, image_path), image, ok in zip(rows, images, decoded):
+            result = {"row": row_number, "user": user, "image_path": image_path}
+            results[row_number] = result
+            user_id = self.resolve_user(user) if user else None
+            if user_id is None:
+                result["error"] = "Unknown user"
+            elif not ok:
+                result["error"] = "Could not load image"
+            else:
+                result["user_id"] = user_id
+                by_user.setdefault(user_id, []).append((row_number, image))
+
+        # Embed every readable query of the window in tower batches
+        queued = [(user_id, row_number, image) for user_id, queries in by_user.items() for row_number, image in queries]
+        if queued:
+            query_embeddings = embed_signatures(np.stack([image for _, _, image in queued]), self.embedding_model,
+                                                self.batch_size)
+            embedding_rows = {row_number: i for i, (_, row_number, _) in enumerate(queued)}
+
+        for user_id, queries in by_user.items():
+            try:
+                references = self.user_references(user_id)
+            except ValueError as e:  # e.g. a stored reference that can't be decoded
+                for row_number, _ in queries:
+                    results[row_number]["error"] = f"Could not load the user's references: {e}"
+                continue
+            if not len(references):
+                for row_number, _ in queries:
+                    results[row_number]["error"] = "No genuine signatures found for this user"
+                continue
+            queries_matrix = query_embeddings[[embedding_rows[row_number] for row_number, _ in queries]]
+            scores = self.score_pairs(queries_matrix, references)
+            for (row_number, _), row_scores in zip(queries, scores):
+                summary = aggregate_scores(row_scores, self.threshold, self.top_k)
+                results[row_number].update(max_score=summary["max_score"], top_k_mean=summary["top_k_mean"],
+                                           is_verified=bool(summary["is_verified"]))
+        return [results[row_number] for row_number, _, _ in rows]
+
+    def score_pairs(self, queries, references):
+        """
+        Scores every (query, reference) pair of one user with the head.
+
+        Each head call gets a chunk of queries against a chunk of references, at most
+        HEAD_BATCH_SIZE pairs and HEAD_BATCH_ELEMENTS embedding values per side.
+
+        Returns:
+            np.ndarray: float32 scores of shape (len(queries), len(references)).
+        """
+        scores = np.empty((len(queries), len(references)), dtype=np.float32)
+        pairs_per_call = max(1, min(HEAD_BATCH_SIZE, HEAD_BATCH_ELEMENTS // max(1, references.shape[1])))
+        reference_step = min(len(references), pairs_per_call)
+        query_step = max(1, pairs_per_call // reference_step)
+        for query_start in range(0, len(queries), query_step):
+            query_chunk = queries[query_start:query_start + query_step]
+            for reference_start in range(0, len(references), reference_step):
+                reference_chunk = references[reference_start:reference_start + reference_step]
+                if len(query_chunk) == 1:  # One query against many references needs no copies
+                    left, right = np.broadcast_to(query_chunk, reference_chunk.shape), reference_chunk
+                else:  # Query-major pairs of the chunk
+                    left = np.repeat(query_chunk, len(reference_chunk), axis=0)
+                    right = np.tile(reference_chunk, (len(query_chunk), 1))
+                scores[query_start:query_start + len(query_chunk),
+                       reference_start:reference_start + len(reference_chunk)] = \
+                    self.head_model.predict_on_batch([left, right]).reshape(len(query_chunk), len(reference_chunk))
+        return scores
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify a CSV/JSONL list of (user_id or email, image_path) rows.")
+    parser.add_argument("input", help="CSV with a header (user_id or email, image_path) or JSONL with the same keys")
+    parser.add_argument("output", help="JSONL results, appended to when resuming")
+    parser.add_argument("--model", default=os.environ.get("SIGNATURE_MODEL_PATH", os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "signature_similarity_model.h5")),
+        help=".h5 model or export_model.py folder")
+    parser.add_argument("--db", default=None, help="Database file (default: SIGNATURE_DB_PATH or signature_verification2.db)")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the first row")
+    parser.add_argument("--window", type=int, default=2048, help="Rows grouped by user per window")
+    parser.add_argument("--batch-size", type=int, default=32, help="Tower batch size")
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--cache-users", type=int, default=1000, help="Users whose references stay in memory")
+    parser.add_argument("--workers", type=int, default=8, help="Threads decoding images")
+    parser.add_argument("--uint8-input", action="store_true", help="Feed uint8 grayscale images to a Keras model through model_utils.add_uint8_input")
+    args = parser.parse_args()
+
+    checkpoint_path = args.checkpoint or args.output + ".checkpoint"
+    checkpoint = {"rows": 0, "output_bytes": 0} if args.restart else load_checkpoint(checkpoint_path)
+    output_bytes = os.path.getsize(args.output) if os.path.exists(args.output) else 0
+    if output_bytes < checkpoint["output_bytes"]:  # Resuming would pad the output with NUL bytes
+        parser.error(f"{args.output} is shorter than {checkpoint_path} records "
+                     f"({output_bytes} < {checkpoint['output_bytes']} bytes); use --restart to start over")
+
+    if args.db:
+        os.environ["SIGNATURE_DB_PATH"] = args.db  # Must be set before db_manager is imported
+    from inference_backend import load_inference_models
+    embedding_model, head_model, tag = load_inference_models(args.model, uint8_input=args.uint8_input)
+    verifier = BatchVerifier(embedding_model, head_model, tag, args.threshold, args.top_k, args.batch_size,
+                             args.cache_users, args.workers)
+
+    rows_done = checkpoint["rows"]
+    rows = read_rows(args.input)
+    for _ in islice(rows, rows_done):  # Skip rows finished by a previous run
+        pass
+
+    with open(args.output, "a+b") as output:
+        # Drop results written after the last checkpoint (an interrupted window is redone)
+        output.truncate(checkpoint["output_bytes"])
+        output.seek(0, os.SEEK_END)
+        if rows_done:
+            print(f"Resuming after {rows_done} rows")
+
+        start = time.perf_counter()
+        processed = 0
+        row_number = rows_done
+        while True:
+            window = []
+            for user, image_path in islice(rows, args.window):
+                window.append((row_number, user, image_path))
+                row_number += 1
+            if not window:
+                break
+
+            for result in verifier.score_window(window):
+                output.write((json.dumps(result) + "\n").encode())
+            output.flush()
+            os.fsync(output.fileno())
+            save_checkpoint(checkpoint_path, row_number, output.tell())
+
+            processed += len(window)
+            elapsed = time.perf_counter() - start
+            print(f"{row_number} rows done ({processed / elapsed:.1f} images/sec)")
+
+    elapsed = time.perf_counter() - start
+    print(f"Verified {processed} images in {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.1f} images/sec)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import os
+import random
+import time
+import numpy as np
+from data_preparation import prepare_data
+from signature_utils import load_pair_indices, model_images, embed_signatures, MAX_BATCH_SIZE
+from inference_backend import load_inference_models, is_export_dir, read_export_manifest
+
+def artifact_size(model_path):
+    # Bytes on disk of a .h5 model or of every .tflite file of an export
+    if not is_export_dir(model_path):
+        return os.path.getsize(model_path)
+    return sum(os.path.getsize(os.path.join(model_path, file_name))
+               for file_name in read_export_manifest(model_path)["files"].values())
+
+def percentile_ms(durations, percentile):
+    return float(np.percentile(durations, percentile)) * 1000
+
+def time_calls(function, repeats):
+    # Time repeated calls after one warmup call
+    function()
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def score_pairs(embedding_model, head_model, images, index1, index2):
+    # Embed every image once (converted to each model's input, see model_images), then
+    # score the pairs with the head
+    embeddings = embed_signatures(images, embedding_model)
+    scores = np.empty(len(index1), dtype=np.float32)
+    for start in range(0, len(index1), MAX_BATCH_SIZE):
+        end = start + MAX_BATCH_SIZE
+        scores[start:end] = head_model.predict_on_batch([embeddings[index1[start:end]],
+                                                         embeddings[index2[start:end]]]).reshape(-1)
+    return scores
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the accuracy and latency of a Keras model and its TFLite exports.")
+    parser.add_argument("model", help="Reference .h5/.keras similarity model")
+    parser.add_argument("exports", nargs="+", help="Folders written by export_model.py")
+    parser.add_argument("--genuine-dir", required=True, help="Held-out genuine folder (one subfolder per user)")
+    parser.add_argument("--forged-dir", required=True, help="Held-out forged folder (one subfolder per user)")
+    parser.add_argument("--pairs", type=int, default=500, help="Number of labelled pairs scored")
+    parser.add_argument("--repeats", type=int, default=20, help="Timed calls per latency measurement")
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--threads", type=int, default=None, help="TFLite interpreter threads")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)  # prepare_data shuffles with the random module
+    pairs, labels = prepare_data(args.genuine_dir, args.forged_dir)
+    pairs, labels = pairs[:args.pairs], labels[:args.pairs]
+    # The bank stays uint8 grayscale; each model gets it in its own input format, so exports
+    # made with --uint8-input are fed uint8 and the others normalized float32 RGB
+    images, index1, index2, labels = load_pair_indices(pairs, labels)
+    print(f"{len(labels)} pairs over {len(images)} images")
+
+    reference_scores = None
+    for model_path in [args.model] + args.exports:
+        embedding_model, head_model, tag = load_inference_models(model_path, args.threads)
+        scores = score_pairs(embedding_model, head_model, images, index1, index2)
+        decisions = scores > args.threshold
+        accuracy = float(np.mean(decisions == (labels == 1)))
+
+        single_input = model_images(images[:1], embedding_model)
+        batch_input = model_images(images[:MAX_BATCH_SIZE], embedding_model)
+        single = time_calls(lambda: embedding_model.predict_on_batch(single_input), args.repeats)
+        batch = time_calls(lambda: embedding_model.predict_on_batch(batch_input), args.repeats)
+        embedding = embedding_model.predict_on_batch(single_input)
+        head = time_calls(lambda: head_model.predict_on_batch([embedding, embedding]), args.repeats)
+
+        print(f"\n{tag} ({artifact_size(model_path) / 1e6:.1f} MB)")
+        print(f"  accuracy: {accuracy:.4f}")
+        if reference_scores is None:
+            reference_scores, reference_decisions = scores, decisions
+        else:
+            delta = np.abs(scores - reference_scores)
+            print(f"  score delta vs Keras: mean {delta.mean():.5f}, max {delta.max():.5f}; "
+                  f"decisions agree on {np.mean(decisions == reference_decisions):.2%} of pairs")
+        print(f"  tower, 1 image: p50 {percentile_ms(single, 50):.1f} ms, p95 {percentile_ms(single, 95):.1f} ms")
+        batch_p50 = percentile_ms(batch, 50)
+        print(f"  tower, {len(images[:MAX_BATCH_SIZE])} images: p50 {batch_p50:.1f} ms "
+              f"({batch_p50 / len(images[:MAX_BATCH_SIZE]):.1f} ms/image)")
+        print(f"  head, 1 pair: p50 {percentile_ms(head, 50):.2f} ms")
+
+if __name__ == "__main__":
+    main()
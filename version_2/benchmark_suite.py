@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import numpy as np
+import cv2
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def peak_rss_mb():
+    # Peak resident set size of this process so far (None where unsupported)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024  # Bytes on macOS, KB on Linux
+
+def synthetic_signature(rng, width=400, height=200):
+    # Random pen strokes on a white page, roughly the look of a scanned signature
+    image = np.full((height, width), 255, dtype=np.uint8)
+    for _ in range(rng.integers(3, 7)):
+        points = np.cumsum(rng.integers(-25, 26, size=(12, 2)), axis=0) + [width // 2, height // 2]
+        points = np.clip(points, 0, [width - 1, height - 1]).astype(np.int32)
+        cv2.polylines(image, [points], False, int(rng.integers(0, 80)), int(rng.integers(1, 4)), cv2.LINE_AA)
+    return image
+
+def generate_dataset(root, users, signatures, seed=0):
+    """
+    Writes synthetic signature folders laid out like the training data.
+
+    Args:
+        root (str): Folder receiving genuine/<user>/ and forged/<user>/ subfolders.
+        users (int): Number of users.
+        signatures (int): Genuine and forged images per user.
+        seed (int): Image generator seed.
+
+    Returns:
+        tuple: (genuine_dir, forged_dir)
+    """
+    rng = np.random.default_rng(seed)
+    for class_name in ("genuine", "forged"):
+        for user in range(users):
+            user_dir = os.path.join(root, class_name, f"user_{user:04d}")
+            os.makedirs(user_dir, exist_ok=True)
+            for index in range(signatures):
+                cv2.imwrite(os.path.join(user_dir, f"{index:03d}.png"), synthetic_signature(rng))
+    return os.path.join(root, "genuine"), os.path.join(root, "forged")
+
+def legacy_cv2_image(image_path):
+    # Per-image preprocessing of version_1 and the test scripts before preprocessing.py
+    image = cv2.resize(cv2.imread(image_path, cv2.IMREAD_GRAYSCALE), (224, 224))
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB) / 255.0
+
+def legacy_load_img_image(image_path):
+    # Per-image preprocessing of version_2 and the pair generators before preprocessing.py
+    from tensorflow.keras.preprocessing.image import load_img
+    return np.asarray(load_img(image_path, target_size=(224, 224)), dtype=np.float32) / 255.0
+
+def build_stand_in_model(image_size=(224, 224), embedding_size=64, seed=0):
+    # Small randomly initialized siamese model with the train6_2inputs layout (shared tower,
+    # abs-diff Lambda, sigmoid head), so model_utils.split_similarity_model works on it
+    import tensorflow as tf
+    from tensorflow.keras.models import Model
+    from tensorflow.keras.layers import Input, Conv2D, GlobalAveragePooling2D, Dense, Lambda
+    tf.random.set_seed(seed)
+
+    tower_input = Input(shape=(*image_size, 3))
+    x = Conv2D(16, 3, strides=4, activation="relu")(tower_input)
+    x = Conv2D(32, 3, strides=4, activation="relu")(x)
+    x = GlobalAveragePooling2D()(x)
+    tower = Model(tower_input, Dense(embedding_size, activation="relu")(x))
+
+    input_1 = Input(shape=(*image_size, 3))
+    input_2 = Input(shape=(*image_size, 3))
+    diff = Lambda(lambda tensors: tf.abs(tensors[0] - tensors[1]), output_shape=(embedding_size,))(
+        [tower(input_1), tower(input_2)])
+    return Model([input_1, input_2], Dense(1, activation="sigmoid")(diff))
+
+def time_calls(function, repeats, warmup=1):
+    # Durations of repeated calls (seconds), after warmup calls
+    for _ in range(warmup):
+        function()
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def summarize(durations, items_per_call=1):
+    # p50/p95 latency and throughput of a timed hot path
+    durations = np.asarray(durations)
+    p50, p95 = np.percentile(durations * 1000, [50, 95])
+    return {"calls": len(durations), "items_per_call": items_per_call, "p50_ms": float(p50), "p95_ms": float(p95),
+            "items_per_sec": float(items_per_call / durations.mean()), "peak_rss_mb": peak_rss_mb()}
+
+def compare(results, baseline, tolerance):
+    # Benchmarks whose p50 grew by more than tolerance over the baseline
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        ratio = result["p50_ms"] / previous["p50_ms"] if previous["p50_ms"] else float("inf")
+        result["baseline_p50_ms"] = previous["p50_ms"]
+        result["p50_ratio"] = ratio
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return regressions
+
+def run_benchmarks(work_dir, users, signatures, repeats, seed=0):
+    genuine_dir, forged_dir = generate_dataset(os.path.join(work_dir, "dataset"), users, signatures, seed)
+
+    # The database and blob store live in the work folder; these variables are read when
+    # db_manager is imported, so the imports come after them
+    os.environ["SIGNATURE_DB_PATH"] = os.path.join(work_dir, "benchmark.db")
+    os.environ["SIGNATURE_BLOB_STORE"] = "files:" + os.path.join(work_dir, "blobs")
+    import db_manager
+    from data_preparation import create_pairs, prepare_data
+    from model_utils import split_similarity_model
+    from preprocessing import preprocess_batch, to_float
+    from signature_utils import (preprocess_image, preprocess_signatures, load_pairs, verify_signature,
+                                 embed_signatures, verify_signature_embeddings, MAX_BATCH_SIZE)
+
+    random.seed(seed)
+    rng = random.Random(seed)
+    results = {}
+    image_paths = sorted(os.path.join(root, name) for root, _, names in os.walk(genuine_dir) for name in names)
+
+    results["preprocess_image"] = summarize(time_calls(lambda: preprocess_image(rng.choice(image_paths)), repeats))
+    # One batch through the shared pipeline against the per-image loops it replaced
+    batch_paths = image_paths[:MAX_BATCH_SIZE]
+    results["preprocess_batch"] = summarize(time_calls(lambda: to_float(preprocess_batch(batch_paths)), repeats),
+                                            len(batch_paths))
+    results["preprocess_per_image_cv2"] = summarize(time_calls(
+        lambda: np.stack([legacy_cv2_image(path) for path in batch_paths]), repeats), len(batch_paths))
+    results["preprocess_per_image_load_img"] = summarize(time_calls(
+        lambda: np.stack([legacy_load_img_image(path) for path in batch_paths]), repeats), len(batch_paths))
+    results["create_pairs"] = summarize(time_calls(lambda: create_pairs(genuine_dir, True), repeats),
+                                        len(create_pairs(genuine_dir, True)[0]))
+    pairs, labels = prepare_data(genuine_dir, forged_dir)
+    pairs, labels = pairs[:256], labels[:256]
+    results["load_pairs"] = summarize(time_calls(lambda: load_pairs(pairs, labels), max(1, repeats // 5)), len(pairs))
+
+    # Enroll every user with their genuine images
+    emails = [(f"user_{user:04d}", f"user_{user:04d}@example.com") for user in range(users)]
+    start = time.perf_counter()
+    user_ids = db_manager.add_users_bulk(emails)
+    enrolled = []
+    for name, email in emails:
+        for path in sorted(os.listdir(os.path.join(genuine_dir, name))):
+            with open(os.path.join(genuine_dir, name, path), "rb") as file:
+                enrolled.append((user_ids[email], file.read()))
+    db_manager.add_signatures_bulk(enrolled)
+    results["db_enroll"] = summarize([time.perf_counter() - start], len(enrolled))
+
+    user_id_list = list(user_ids.values())
+    results["db_get_signatures"] = summarize(time_calls(
+        lambda: [handle.read() for handle in db_manager.get_signatures(rng.choice(user_id_list))], repeats), signatures)
+    results["db_get_signature_tensors"] = summarize(time_calls(
+        lambda: db_manager.get_signature_tensors(rng.choice(user_id_list)), repeats), signatures)
+
+    model = build_stand_in_model(seed=seed)
+    embedding_model, head_model = split_similarity_model(model)
+    query = preprocess_image(image_paths[0])
+    genuine_signatures = [handle.read() for handle in db_manager.get_signatures(user_id_list[0])]
+    results["verify_signature"] = summarize(time_calls(
+        lambda: verify_signature(query, genuine_signatures, model), repeats), len(genuine_signatures))
+
+    reference_embeddings = embed_signatures(preprocess_signatures(genuine_signatures), embedding_model)
+    def verify_with_embeddings():
+        query_embedding = embed_signatures(query[np.newaxis], embedding_model)[0]
+        verify_signature_embeddings(query_embedding, reference_embeddings, head_model)
+    results["verify_signature_embeddings"] = summarize(time_calls(verify_with_embeddings, repeats),
+                                                       len(reference_embeddings))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the preprocessing, pairing, database and inference hot paths on synthetic data.")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--signatures", type=int, default=5, help="Genuine and forged images per user")
+    parser.add_argument("--repeats", type=int, default=20, help="Timed calls per benchmark")
+    parser.add_argument("--work-dir", default=None, help="Folder for the synthetic data (default: a temporary folder)")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where the results are written")
+    parser.add_argument("--baseline", default=None, help="Earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p50 slowdown before flagging a regression")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--use-cache", action="store_true", help="Let preprocess_image use the preprocessed image cache")
+    args = parser.parse_args()
+
+    if not args.use_cache:
+        os.environ["SIGNATURE_CACHE_DIR"] = ""  # Must be set before preprocess_cache is imported
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = args.work_dir or temp_dir
+        os.makedirs(work_dir, exist_ok=True)
+        results = run_benchmarks(work_dir, args.users, args.signatures, args.repeats, args.seed)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file)["results"], args.tolerance)
+
+    for name, result in results.items():
+        line = (f"{name:30s} p50 {result['p50_ms']:9.2f} ms  p95 {result['p95_ms']:9.2f} ms  "
+                f"{result['items_per_sec']:10.1f} items/sec")
+        if "p50_ratio" in result:
+            line += f"  {result['p50_ratio']:.2f}x baseline" + ("  REGRESSION" if name in regressions else "")
+        print(line)
+    print(f"Peak RSS: {peak_rss_mb() or 0:.0f} MB")
+
+    with open(args.output, "w") as file:
+        json.dump({"config": {"users": args.users, "signatures": args.signatures, "repeats": args.repeats, "seed": args.seed},
+                   "platform": {"python": platform.python_version(), "machine": platform.machine(), "system": platform.system()},
+                   "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "peak_rss_mb": peak_rss_mb(), "results": results},
+                  file, indent=2)
+    if regressions:
+        sys.exit(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+
+if __name__ == "__main__":
+    main()
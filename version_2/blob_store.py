@@ -0,0 +1,119 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from instrumentation import timer
+
+class FileBlobStore:
+    """
+    Content-addressed store keeping each image as a file named by its SHA-256.
+
+    Files are sharded into two levels of subfolders (ab/cd/abcd...) so no folder grows
+    too large. Identical images are stored once, whichever users they belong to.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, content_hash):
+        return os.path.join(self.root, content_hash[:2], content_hash[2:4], content_hash)
+
+    def put(self, data, content_hash=None):
+        # Store the bytes (if not already stored) and return their hash
+        content_hash = content_hash or hashlib.sha256(data).hexdigest()
+        path = self._path(content_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        return content_hash
+
+    def get(self, content_hash):
+        with open(self._path(content_hash), "rb") as file:
+            return file.read()
+
+class SQLiteBlobStore:
+    """
+    Content-addressed store keeping images in a separate SQLite database.
+
+    Reads go through sqlite3.Blob incremental I/O, so the image is streamed from
+    its own row instead of being materialized by a SELECT.
+    """
+
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS Blobs (
+            blob_id INTEGER PRIMARY KEY,
+            content_hash TEXT UNIQUE NOT NULL,
+            data BLOB NOT NULL
+        )""")
+        self.conn.commit()
+
+    def put(self, data, content_hash=None):
+        content_hash = content_hash or hashlib.sha256(data).hexdigest()
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO Blobs (content_hash, data) VALUES (?, ?)", (content_hash, data))
+        return content_hash
+
+    def get(self, content_hash):
+        with self.lock:
+            row = self.conn.execute("SELECT blob_id FROM Blobs WHERE content_hash = ?", (content_hash,)).fetchone()
+            if row is None:
+                raise KeyError(content_hash)
+            with self.conn.blobopen("Blobs", "data", row[0], readonly=True) as blob:
+                return blob.read()
+
+def open_blob_store(spec):
+    """
+    Opens the blob store described by spec.
+
+    Args:
+        spec (str): "files:<folder>", "sqlite:<database file>" or "inline" (images
+            stay in the Signatures table).
+
+    Returns:
+        FileBlobStore, SQLiteBlobStore or None for inline storage.
+    """
+    kind, _, location = spec.partition(":")
+    if kind == "inline":
+        return None
+    if kind == "files":
+        return FileBlobStore(location)
+    if kind == "sqlite":
+        return SQLiteBlobStore(location)
+    raise ValueError(f"Unknown blob store: {spec}")
+
+class SignatureHandle:
+    """
+    Lazy reference to a stored signature image.
+
+    The bytes are only fetched from the blob store when read() (or bytes(handle)) is called.
+    """
+
+    def __init__(self, store, content_hash, data=None):
+        self.store = store
+        self.content_hash = content_hash
+        self.data = data or None  # Inline bytes of rows not moved to the store
+
+    def read(self):
+        if self.data is not None:
+            return self.data
+        with timer("blob.read"):
+            return self.store.get(self.content_hash)
+
+    def __bytes__(self):
+        return self.read()
+
+    def __eq__(self, other):
+        if isinstance(other, SignatureHandle):
+            return self.content_hash == other.content_hash
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.content_hash)
@@ -0,0 +1,85 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+def read_file(file_path):
+    with open(file_path, "rb") as file:
+        return file.read()
+
+def list_user_folders(genuine_dir):
+    # One folder per user, each holding that user's genuine signature images
+    users = []
+    with os.scandir(genuine_dir) as entries:
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            if entry.is_dir():
+                with os.scandir(entry.path) as files:
+                    images = sorted(file.path for file in files
+                                    if file.is_file() and file.name.lower().endswith(IMAGE_EXTENSIONS))
+                users.append((entry.name, images))
+    return users
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-enroll users and signatures from a genuine/<user>/ folder tree.")
+    parser.add_argument("genuine_dir", help="Folder with one subfolder of genuine signatures per user")
+    parser.add_argument("--db", default=None, help="Database file (default: SIGNATURE_DB_PATH or signature_verification2.db)")
+    parser.add_argument("--email-domain", default="example.com", help="Users are enrolled as <folder>@<domain>")
+    parser.add_argument("--workers", type=int, default=16, help="Threads reading image files")
+    parser.add_argument("--batch-users", type=int, default=500, help="Users inserted per transaction")
+    parser.add_argument("--model", default=None, help="Similarity model (or export_model.py folder) used to store embeddings at enrollment")
+    parser.add_argument("--uint8-input", action="store_true", help="Feed uint8 grayscale images to a Keras model through model_utils.add_uint8_input")
+    args = parser.parse_args()
+
+    if args.db:
+        os.environ["SIGNATURE_DB_PATH"] = args.db  # Must be set before db_manager is imported
+    from db_manager import enroll_users_bulk
+
+    compute_embeddings = None
+    if args.model:
+        from inference_backend import load_inference_models
+        from preprocessing import decode_batch
+        from signature_utils import embed_signatures, embedding_to_blob
+        embedding_model, _, tag = load_inference_models(args.model, uint8_input=args.uint8_input)
+
+        def compute_embeddings(images):
+            # Images that can't be decoded get no embedding; enroll_users_bulk rejects them
+            tensors, decoded = decode_batch(images)
+            embeddings = iter(embed_signatures(tensors[decoded], embedding_model) if decoded.any() else [])
+            return [(embedding_to_blob(next(embeddings)), tag) if ok else (None, None) for ok in decoded]
+
+    users = list_user_folders(args.genuine_dir)
+    start = time.perf_counter()
+    enrolled_users = enrolled_signatures = rejected_signatures = 0
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for batch_start in range(0, len(users), args.batch_users):
+            batch = users[batch_start:batch_start + args.batch_users]
+
+            # Read every file of the batch in parallel
+            file_data = iter(executor.map(read_file, [path for _, image_paths in batch for path in image_paths]))
+
+            enrollments = []
+            for name, image_paths in batch:
+                images = [next(file_data) for _ in image_paths]
+                if compute_embeddings and images:
+                    signatures = [(image, *embedding) for image, embedding in zip(images, compute_embeddings(images))]
+                else:
+                    signatures = images
+                enrollments.append((name, f"{name}@{args.email_domain}", signatures))
+            # Users and their signatures are committed together; images already enrolled are skipped
+            _, added, rejected = enroll_users_bulk(enrollments)
+            paths = {f"{name}@{args.email_domain}": image_paths for name, image_paths in batch}
+            for email, index in rejected:
+                print(f"Skipped {paths[email][index]}: could not decode the image")
+
+            enrolled_users += len(batch)
+            enrolled_signatures += added
+            rejected_signatures += len(rejected)
+            elapsed = time.perf_counter() - start
+            print(f"{enrolled_users}/{len(users)} users, {enrolled_signatures} signatures added, "
+                  f"{rejected_signatures} rejected ({enrolled_signatures / elapsed:.1f} signatures/sec)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from data_preparation import PathTable, PairSampler, prepare_data
+from signature_utils import PairBatchSequence
+from preprocessing import IMAGE_SIZE, PIPELINE, preprocess_batch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image_utils"))
+from check_valid_images import load_valid_paths
+
+IMAGES_FILE = "images.npy"
+MANIFEST_FILE = "manifest.npz"
+META_FILE = "manifest.json"
+
+def compile_dataset(train_genuine_dir, train_forged_dir, output_dir, num_pairs=None,
+                    positive_fraction=0.5, seed=None, workers=8, valid_paths=None):
+    """
+    Writes every unique training image once into a grayscale uint8 memmap plus a pair manifest.
+
+    Args:
+        train_genuine_dir (str): Folder of genuine user folders.
+        train_forged_dir (str): Folder of forged user folders.
+        output_dir (str): Folder receiving images.npy, manifest.npz and manifest.json.
+        num_pairs (int): Number of pairs to sample with PairSampler. When None, the pairs
+            of prepare_data (every genuine combination plus one forgery per genuine image) are used.
+        positive_fraction (float): Fraction of positive pairs when sampling.
+        seed (int): Seed for pair sampling and shuffling.
+        workers (int): Number of threads decoding images.
+        valid_paths (set): When given, images missing from it are left out
+            (see image_utils/check_valid_images.load_valid_paths).
+
+    Returns:
+        dict: The metadata written to manifest.json.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    table = PathTable(train_genuine_dir, train_forged_dir, workers=workers, valid_paths=valid_paths)
+
+    # Decode every image once into the memmap
+    images = np.lib.format.open_memmap(os.path.join(output_dir, IMAGES_FILE), mode="w+",
+                                       dtype=np.uint8, shape=(len(table), *IMAGE_SIZE))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        preprocess_batch(table.paths, images, executor)
+    images.flush()
+
+    # Build the pairs as indices into the image store
+    if num_pairs is not None:
+        pairs, labels = PairSampler(table, positive_fraction, seed).sample(num_pairs)
+    else:
+        if seed is not None:
+            random.seed(seed)
+        path_pairs, path_labels = prepare_data(train_genuine_dir, train_forged_dir)
+        path_index = {path: i for i, path in enumerate(table.paths)}
+        kept = [(path_index[img1_path], path_index[img2_path], label)
+                for (img1_path, img2_path), label in zip(path_pairs, path_labels)
+                if img1_path in path_index and img2_path in path_index]  # Drop pairs with excluded images
+        pairs = np.array([pair[:2] for pair in kept], dtype=np.int32).reshape(-1, 2)
+        labels = np.array([pair[2] for pair in kept], dtype=np.int8)
+
+    np.savez(os.path.join(output_dir, MANIFEST_FILE), paths=np.array(table.paths), users=np.array(table.users),
+             user_ids=table.user_ids, is_forged=table.is_forged, pairs=pairs, labels=labels)
+
+    meta = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "genuine_dir": train_genuine_dir,
+        "forged_dir": train_forged_dir,
+        "image_shape": list(images.shape[1:]),
+        "color_mode": "grayscale",
+        "pipeline": PIPELINE,
+        "num_images": len(table),
+        "num_users": len(table.users),
+        "num_pairs": len(labels),
+        "num_positive_pairs": int(labels.sum()),
+    }
+    with open(os.path.join(output_dir, META_FILE), "w") as file:
+        json.dump(meta, file, indent=2)
+    return meta
+
+class CompiledDataset:
+    """
+    Read-only view of a dataset written by compile_dataset.
+
+    Images are memory-mapped, so batches are sliced straight from the page cache
+    (shared between training processes) without decoding any files.
+    """
+
+    def __init__(self, output_dir):
+        self.images = np.load(os.path.join(output_dir, IMAGES_FILE), mmap_mode="r")
+        with np.load(os.path.join(output_dir, MANIFEST_FILE)) as manifest:
+            self.paths = manifest["paths"]
+            self.users = manifest["users"]
+            self.user_ids = manifest["user_ids"]
+            self.is_forged = manifest["is_forged"]
+            self.pairs = manifest["pairs"]
+            self.labels = manifest["labels"]
+
+    def sequences(self, validation_fraction=0.3, batch_size=32, seed=None, input_names=None, uint8_input=False):
+        # Training and validation Sequences; the last validation_fraction of the pairs is held out
+        split = int(len(self.labels) * (1 - validation_fraction))
+        index1, index2 = self.pairs[:, 0], self.pairs[:, 1]
+        train_sequence = PairBatchSequence(self.images, index1[:split], index2[:split], self.labels[:split],
+                                           batch_size=batch_size, seed=seed, input_names=input_names,
+                                           uint8_input=uint8_input)
+        validation_sequence = PairBatchSequence(self.images, index1[split:], index2[split:], self.labels[split:],
+                                                batch_size=batch_size, shuffle=False, input_names=input_names,
+                                                uint8_input=uint8_input)
+        return train_sequence, validation_sequence
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile signature folders into a memory-mapped training set.")
+    parser.add_argument("genuine_dir", help="Folder of genuine user folders")
+    parser.add_argument("forged_dir", help="Folder of forged user folders")
+    parser.add_argument("output_dir", help="Folder to write the compiled dataset to")
+    parser.add_argument("--pairs", type=int, default=None, help="Sample this many pairs instead of using prepare_data")
+    parser.add_argument("--positive-fraction", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--manifest", default=None, help="Validation manifest from image_utils/check_valid_images.py")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    meta = compile_dataset(args.genuine_dir, args.forged_dir, args.output_dir, args.pairs,
+                           args.positive_fraction, args.seed, args.workers,
+                           load_valid_paths(args.manifest) if args.manifest else None)
+    print(f"Compiled {meta['num_images']} images and {meta['num_pairs']} pairs "
+          f"into {args.output_dir} in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
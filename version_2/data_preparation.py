@@ -1,16 +1,27 @@
 import os
 import itertools
 import random
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
-def create_pairs(data_dir, is_positive):
+def list_user_images(class_dir, user_folder, dataset_index=None):
+    # List a user's images from the dataset index when given, otherwise from the folder
+    if dataset_index is not None:
+        return dataset_index.list_files(os.path.basename(os.path.normpath(class_dir)), user_folder)
+    user_path = os.path.join(class_dir, user_folder)
+    return [os.path.join(user_path, img) for img in os.listdir(user_path)]
+
+def create_pairs(data_dir, is_positive, dataset_index=None):
     pairs = []
     labels = []
     
     # Iterate through each user's folder in the data_dir (either 'genuine' or 'forged')
-    user_folders = os.listdir(data_dir)
+    if dataset_index is not None:  # Cached listing (see image_utils/count_images.DatasetIndex)
+        user_folders = dataset_index.users(os.path.basename(os.path.normpath(data_dir)))
+    else:
+        user_folders = os.listdir(data_dir)
     for user_folder in user_folders:
-        user_path = os.path.join(data_dir, user_folder)
-        images = [os.path.join(user_path, img) for img in os.listdir(user_path)]
+        images = list_user_images(data_dir, user_folder, dataset_index)
         
         if is_positive:
             # Positive pairs: Two genuine signatures from the same user
@@ -21,13 +32,10 @@ def create_pairs(data_dir, is_positive):
             # Negative pairs: Genuine + Forged signatures
             # For forged images, the user folder name has '_forged' appended
             genuine_user_folder = user_folder.replace('_forged', '')  # Remove '_forged' if present
-            genuine_images_dir = os.path.join(data_dir.replace('forged', 'genuine'), genuine_user_folder)  # Point to genuine subfolder
+            genuine_class_dir = data_dir.replace('forged', 'genuine')  # Point to genuine subfolder
             
             # Get genuine images from the correct subfolder in 'genuine'
-            genuine_images = [
-                os.path.join(genuine_images_dir, img)
-                for img in os.listdir(genuine_images_dir)
-            ]
+            genuine_images = list_user_images(genuine_class_dir, genuine_user_folder, dataset_index)
             
             # Now `images` contains forged signatures
             forged_images = images
@@ -40,10 +48,10 @@ def create_pairs(data_dir, is_positive):
     
     return pairs, labels
 
-def prepare_data(train_genuine_dir, train_forged_dir):
+def prepare_data(train_genuine_dir, train_forged_dir, dataset_index=None):
     # Generate training pairs
-    positive_pairs, positive_labels = create_pairs(train_genuine_dir, is_positive=True)
-    negative_pairs, negative_labels = create_pairs(train_forged_dir, is_positive=False)
+    positive_pairs, positive_labels = create_pairs(train_genuine_dir, is_positive=True, dataset_index=dataset_index)
+    negative_pairs, negative_labels = create_pairs(train_forged_dir, is_positive=False, dataset_index=dataset_index)
 
     # Combine and shuffle
     train_pairs = positive_pairs + negative_pairs
@@ -53,3 +61,134 @@ def prepare_data(train_genuine_dir, train_forged_dir):
     train_pairs, train_labels = zip(*combined)
     
     return list(train_pairs), list(train_labels)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def scan_user_folder(user_path, valid_paths=None):
+    # List the image files of one user folder with a single os.scandir pass
+    with os.scandir(user_path) as entries:
+        images = sorted(entry.path for entry in entries
+                        if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS))
+    if valid_paths is not None:  # Skip files the validation manifest marks as corrupt
+        images = [path for path in images if os.path.normpath(os.path.abspath(path)) in valid_paths]
+    return images
+
+class PathTable:
+    """
+    Int-indexed table of every genuine and forged image, scanned once.
+
+    Attributes:
+        paths (list): Image paths; pairs refer to images by their index in this list.
+        user_ids (numpy.ndarray): int32 user index of each image.
+        is_forged (numpy.ndarray): bool flag of each image.
+        users (list): User folder names (without the '_forged' suffix).
+
+    Pass valid_paths (see image_utils/check_valid_images.load_valid_paths) to leave out
+    images that failed validation.
+    """
+
+    def __init__(self, train_genuine_dir, train_forged_dir, workers=8, valid_paths=None):
+        # Scan every user folder of both directories in parallel
+        genuine_users = sorted(entry.name for entry in os.scandir(train_genuine_dir) if entry.is_dir())
+        forged_folders = sorted(entry.name for entry in os.scandir(train_forged_dir) if entry.is_dir())
+        folders = [(os.path.join(train_genuine_dir, user), user, False) for user in genuine_users]
+        folders += [(os.path.join(train_forged_dir, folder), folder.replace('_forged', ''), True) for folder in forged_folders]
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            listings = list(executor.map(lambda folder: scan_user_folder(folder[0], valid_paths), folders))
+
+        self.users = genuine_users
+        user_index = {user: i for i, user in enumerate(genuine_users)}
+        self.paths = []
+        user_ids, is_forged = [], []
+        for (_, user, forged), images in zip(folders, listings):
+            if user not in user_index:  # Forged folder without genuine signatures
+                continue
+            self.paths.extend(images)
+            user_ids.extend([user_index[user]] * len(images))
+            is_forged.extend([forged] * len(images))
+        self.user_ids = np.array(user_ids, dtype=np.int32)
+        self.is_forged = np.array(is_forged, dtype=bool)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def grouped(self, forged):
+        # Image indices of one class sorted by user, with per-user start offsets and counts
+        indices = np.flatnonzero(self.is_forged == forged).astype(np.int32)
+        indices = indices[np.argsort(self.user_ids[indices], kind='stable')]
+        counts = np.bincount(self.user_ids[indices], minlength=len(self.users))
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        return indices, starts, counts
+
+class PairSampler:
+    """
+    Samples balanced positive/negative pairs from a PathTable without enumerating them.
+
+    Positive pairs are two different genuine signatures of the same user, with users
+    weighted by their number of genuine combinations. Negative pairs are a genuine
+    signature and a forgery of the same user, with users weighted by their number of
+    genuine signatures (as in create_pairs).
+
+    Args:
+        table (PathTable): Images to sample from.
+        positive_fraction (float): Fraction of positive pairs in every epoch.
+        seed (int): Seed of the random generator.
+    """
+
+    def __init__(self, table, positive_fraction=0.5, seed=None):
+        self.table = table
+        self.positive_fraction = positive_fraction
+        self.rng = np.random.default_rng(seed)
+        self.genuine, self.genuine_starts, self.genuine_counts = table.grouped(forged=False)
+        self.forged, self.forged_starts, self.forged_counts = table.grouped(forged=True)
+
+        positive_weights = self.genuine_counts * (self.genuine_counts - 1) / 2.0
+        negative_weights = np.where(self.forged_counts > 0, self.genuine_counts, 0).astype(np.float64)
+        if not positive_weights.sum() or not negative_weights.sum():
+            raise ValueError("Need users with at least two genuine signatures and with forgeries")
+        self.positive_weights = positive_weights / positive_weights.sum()
+        self.negative_weights = negative_weights / negative_weights.sum()
+
+    def _pick(self, indices, starts, counts, users, offsets=None):
+        # Pick one image of each given user (optionally at given offsets)
+        if offsets is None:
+            offsets = (self.rng.random(len(users)) * counts[users]).astype(np.int64)
+        return indices[starts[users] + offsets]
+
+    def sample(self, num_pairs):
+        """
+        Samples one block of pairs.
+
+        Returns:
+            tuple: (pairs, labels) where pairs is an int32 (num_pairs, 2) array of
+            PathTable indices and labels is an int8 array (1 genuine pair, 0 forged pair).
+        """
+        num_positive = int(round(num_pairs * self.positive_fraction))
+        num_negative = num_pairs - num_positive
+
+        users = self.rng.choice(len(self.table.users), size=num_positive, p=self.positive_weights)
+        counts = self.genuine_counts[users]
+        first = (self.rng.random(num_positive) * counts).astype(np.int64)
+        second = (self.rng.random(num_positive) * (counts - 1)).astype(np.int64)
+        second += second >= first  # Skip the first image so both images differ
+        positives = np.stack([
+            self._pick(self.genuine, self.genuine_starts, self.genuine_counts, users, first),
+            self._pick(self.genuine, self.genuine_starts, self.genuine_counts, users, second),
+        ], axis=1)
+
+        users = self.rng.choice(len(self.table.users), size=num_negative, p=self.negative_weights)
+        negatives = np.stack([
+            self._pick(self.genuine, self.genuine_starts, self.genuine_counts, users),
+            self._pick(self.forged, self.forged_starts, self.forged_counts, users),
+        ], axis=1)
+
+        pairs = np.concatenate([positives, negatives]).astype(np.int32)
+        labels = np.concatenate([np.ones(num_positive, dtype=np.int8), np.zeros(num_negative, dtype=np.int8)])
+        order = self.rng.permutation(num_pairs)
+        return pairs[order], labels[order]
+
+    def iter_epoch(self, pairs_per_epoch, block_size=4096):
+        # Lazily yield an epoch of pairs in blocks of at most block_size
+        for start in range(0, pairs_per_epoch, block_size):
+            yield self.sample(min(block_size, pairs_per_epoch - start))
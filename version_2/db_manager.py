@@ -1,10 +1,30 @@
+import hashlib
+import os
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import numpy as np
+from blob_store import open_blob_store, SignatureHandle
+from instrumentation import timed, count
+from signature_tensors import PREPROCESS_VERSION, TENSOR_SIZE, signature_to_tensor, tensor_to_blob, blob_to_tensor
 
-# Database setup
-conn = sqlite3.connect("signature_verification2.db")
+# Database setup (set SIGNATURE_DB_PATH to use another database file)
+DB_PATH = os.environ.get("SIGNATURE_DB_PATH", "signature_verification2.db")
+# The connection may be used from a worker thread (see job_worker.py), one thread at a time
+conn = sqlite3.connect(DB_PATH, check_same_thread=False)
 cursor = conn.cursor()
 
+# Signature images are kept outside the Signatures table so metadata queries stay small:
+# "files:<folder>" (default, next to the database), "sqlite:<file>" or "inline"
+BLOB_STORE = os.environ.get("SIGNATURE_BLOB_STORE", "files:" + os.path.splitext(DB_PATH)[0] + "_blobs")
+blob_store = open_blob_store(BLOB_STORE)
+
+# WAL lets readers run during writes and, with synchronous=NORMAL, avoids an fsync per commit
+cursor.execute("PRAGMA journal_mode=WAL")
+cursor.execute("PRAGMA synchronous=NORMAL")
+cursor.execute("PRAGMA cache_size=-65536")  # 64 MB page cache
+cursor.execute("PRAGMA temp_store=MEMORY")
+
 # Create tables if they don't exist
 cursor.execute("""
 CREATE TABLE IF NOT EXISTS Users (
@@ -19,29 +39,348 @@ CREATE TABLE IF NOT EXISTS Signatures (
     user_id INTEGER NOT NULL,
     image_data BLOB NOT NULL,
     upload_date DATETIME NOT NULL,
+    embedding BLOB,
+    embedding_model TEXT,
+    content_hash TEXT,
     FOREIGN KEY (user_id) REFERENCES Users(user_id)
 )""")
 
+# Model-ready 224x224 grayscale tensors computed once at enrollment (see signature_tensors.py)
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS SignatureTensors (
+    signature_id INTEGER PRIMARY KEY,
+    tensor BLOB NOT NULL,
+    preprocess_version INTEGER NOT NULL,
+    FOREIGN KEY (signature_id) REFERENCES Signatures(signature_id)
+)""")
+
+# Add columns introduced after the initial schema to existing databases
+def add_column_if_missing(table, column, definition):
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+add_column_if_missing("Signatures", "embedding", "BLOB")
+add_column_if_missing("Signatures", "embedding_model", "TEXT")
+add_column_if_missing("Signatures", "content_hash", "TEXT")
+
+def content_hash(image_data):
+    # SHA-256 of the image bytes, used to find duplicate uploads
+    return hashlib.sha256(image_data).hexdigest()
+
+def backfill_content_hashes(batch_size=100, dry_run=False):
+    """
+    Hashes signatures stored before the content_hash column existed, deletes duplicate
+    uploads and creates the (user_id, content_hash) unique index. Run by migrate_db.py.
+
+    Older uploads could store the same image twice for a user; the most recent copy is kept.
+
+    Args:
+        batch_size (int): Number of images hashed per query.
+        dry_run (bool): Roll everything back, only reporting the duplicates.
+
+    Returns:
+        list: signature_ids of the duplicate rows deleted (or that would be deleted).
+    """
+    try:
+        while True:
+            cursor.execute("SELECT signature_id, image_data FROM Signatures WHERE content_hash IS NULL LIMIT ?", (batch_size,))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            cursor.executemany("UPDATE Signatures SET content_hash = ? WHERE signature_id = ?",
+                               [(content_hash(image_data), signature_id) for signature_id, image_data in rows])
+
+        cursor.execute("""
+        SELECT signature_id FROM Signatures WHERE signature_id NOT IN (
+            SELECT MAX(signature_id) FROM Signatures GROUP BY user_id, content_hash
+        ) ORDER BY signature_id""")
+        duplicates = [row[0] for row in cursor.fetchall()]
+        if dry_run:
+            conn.rollback()
+            return duplicates
+        for start in range(0, len(duplicates), 500):  # Stay below SQLite's bound parameter limit
+            chunk = duplicates[start:start + 500]
+            cursor.execute(f"DELETE FROM SignatureTensors WHERE signature_id IN ({','.join('?' * len(chunk))})", chunk)
+            cursor.execute(f"DELETE FROM Signatures WHERE signature_id IN ({','.join('?' * len(chunk))})", chunk)
+        cursor.execute("CREATE UNIQUE INDEX idx_signatures_user_hash ON Signatures (user_id, content_hash)")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return duplicates
+
+def move_images_to_blob_store(batch_size=100):
+    # Move images still stored in the Signatures table into the blob store, leaving an
+    # empty image_data (the column is NOT NULL), then shrink the database file. Run by
+    # migrate_db.py; returns the number of images moved.
+    if blob_store is None:
+        return 0
+    moved = 0
+    while True:
+        cursor.execute("SELECT signature_id, content_hash, image_data FROM Signatures WHERE length(image_data) > 0 LIMIT ?", (batch_size,))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        for signature_id, image_hash, image_data in rows:
+            if image_hash is None:  # Not hashed yet (backfill_content_hashes hasn't run)
+                image_hash = content_hash(image_data)
+                cursor.execute("UPDATE Signatures SET content_hash = ? WHERE signature_id = ?", (image_hash, signature_id))
+            blob_store.put(image_data, image_hash)
+        cursor.executemany("UPDATE Signatures SET image_data = X'' WHERE signature_id = ?",
+                           [(signature_id,) for signature_id, _, _ in rows])
+        conn.commit()
+        moved += len(rows)
+    if moved:
+        cursor.execute("VACUUM")
+    return moved
+
+def pending_migrations():
+    # Steps of migrate_db.py this database still needs
+    pending = []
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_signatures_user_hash'")
+    if cursor.fetchone() is None:
+        pending.append("content hashes")
+    if blob_store is not None:
+        cursor.execute("SELECT 1 FROM Signatures WHERE length(image_data) > 0 LIMIT 1")
+        if cursor.fetchone() is not None:
+            pending.append("blob store")
+    return pending
+
+cursor.execute("CREATE INDEX IF NOT EXISTS idx_signatures_user ON Signatures (user_id)")
+cursor.execute("SELECT 1 FROM Signatures LIMIT 1")
+if cursor.fetchone() is None:  # New or empty database: nothing to backfill or deduplicate
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_signatures_user_hash ON Signatures (user_id, content_hash)")
 conn.commit()
 
+# Migrations that rewrite or delete rows only run from migrate_db.py; until then duplicate
+# uploads aren't detected and old images are read from the Signatures table
+PENDING_MIGRATIONS = pending_migrations()
+if PENDING_MIGRATIONS:
+    print(f"Warning: {DB_PATH} needs migration ({', '.join(PENDING_MIGRATIONS)}); "
+          f"run version_2/migrate_db.py {DB_PATH}")
+
 # Functions for database operations
 def add_user(name, email):
     # Add a new user to the database
     cursor.execute("INSERT INTO Users (name, email) VALUES (?, ?)", (name, email))
     conn.commit()
 
+def add_users_bulk(users):
+    # Add many (name, email) users in one transaction; emails that already exist are skipped.
+    # Returns a dict mapping every given email to its user_id.
+    with conn:
+        return insert_users(users)
+
+def insert_users(users):
+    # add_users_bulk without the commit, for use inside a larger transaction
+    users = list(users)
+    cursor.executemany("INSERT OR IGNORE INTO Users (name, email) VALUES (?, ?)", users)
+    user_ids = {}
+    emails = [email for _, email in users]
+    for start in range(0, len(emails), 500):  # Stay below SQLite's bound parameter limit
+        chunk = emails[start:start + 500]
+        cursor.execute(f"SELECT email, user_id FROM Users WHERE email IN ({','.join('?' * len(chunk))})", chunk)
+        user_ids.update(cursor.fetchall())
+    return user_ids
+
 def get_users():
     # Fetch all users from the database
     cursor.execute("SELECT user_id, name FROM Users")
     return cursor.fetchall()
 
-def add_signature(user_id, image_data):
-    # Add a new signature to the database
-    cursor.execute("INSERT INTO Signatures (user_id, image_data, upload_date) VALUES (?, ?, ?)", 
-                   (user_id, image_data, datetime.now()))
+def get_user_by_email(email):
+    # Return the user_id registered with an email, or None
+    cursor.execute("SELECT user_id FROM Users WHERE email = ?", (email,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def store_image(image_data):
+    # Write an image to the blob store; returns the value kept in the image_data column and its hash
+    image_hash = content_hash(image_data)
+    if blob_store is None:
+        return image_data, image_hash
+    blob_store.put(image_data, image_hash)
+    return b"", image_hash
+
+def compute_tensor_blob(image_data):
+    # Compressed model-ready tensor of an image, or None if it can't be decoded
+    tensor = signature_to_tensor(image_data)
+    return None if tensor is None else tensor_to_blob(tensor)
+
+def require_tensor_blob(image_data):
+    # Like compute_tensor_blob, but raises ValueError for an image that can't be decoded, so
+    # it is never stored (every later verification of the user would fail on it)
+    tensor_blob = compute_tensor_blob(image_data)
+    if tensor_blob is None:
+        raise ValueError("Signature image could not be decoded")
+    return tensor_blob
+
+def store_tensor(signature_id, tensor_blob):
+    cursor.execute("INSERT OR REPLACE INTO SignatureTensors (signature_id, tensor, preprocess_version) VALUES (?, ?, ?)",
+                   (signature_id, tensor_blob, PREPROCESS_VERSION))
+
+def add_signature(user_id, image_data, embedding=None, embedding_model=None):
+    # Add a new signature (and optionally its cached embedding) to the database;
+    # raises ValueError if the image can't be decoded
+    tensor_blob = require_tensor_blob(image_data)
+    stored_data, image_hash = store_image(image_data)
+    cursor.execute("INSERT INTO Signatures (user_id, image_data, upload_date, embedding, embedding_model, content_hash) VALUES (?, ?, ?, ?, ?, ?)", 
+                   (user_id, stored_data, datetime.now(), embedding, embedding_model, image_hash))
+    store_tensor(cursor.lastrowid, tensor_blob)
+    conn.commit()
+
+def find_signature(user_id, image_hash):
+    # Return the signature_id of a user's signature with this content hash, or None
+    cursor.execute("SELECT signature_id FROM Signatures WHERE user_id = ? AND content_hash = ?", (user_id, image_hash))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def replace_signature(signature_id, image_data, embedding=None, embedding_model=None):
+    # Replace a stored signature in place; raises ValueError if the image can't be decoded
+    tensor_blob = require_tensor_blob(image_data)
+    stored_data, image_hash = store_image(image_data)
+    cursor.execute("UPDATE Signatures SET image_data = ?, upload_date = ?, embedding = ?, embedding_model = ?, content_hash = ? WHERE signature_id = ?",
+                   (stored_data, datetime.now(), embedding, embedding_model, image_hash, signature_id))
+    store_tensor(signature_id, tensor_blob)
     conn.commit()
 
+def add_signatures_bulk(signatures):
+    # Add many signatures in one transaction; each item is (user_id, image_data)
+    # or (user_id, image_data, embedding, embedding_model). Images a user already has are skipped.
+    # Returns the number of signatures added. Raises ValueError, storing nothing, if any image
+    # can't be decoded.
+    rows, tensor_rows, rejected = prepare_signatures(signatures)
+    if rejected:
+        raise ValueError(f"Signature images could not be decoded (items {', '.join(map(str, rejected))})")
+    with conn:
+        return insert_signatures(rows, tensor_rows)
+
+def enroll_users_bulk(users):
+    """
+    Adds users and their signatures in one transaction, so a crash never leaves a
+    user without signatures.
+
+    Args:
+        users (list): (name, email, signatures) tuples; signatures are image_data or
+            (image_data, embedding, embedding_model) items. Existing emails and images a
+            user already has are skipped, and images that can't be decoded are rejected.
+
+    Returns:
+        tuple: (user_ids, added, rejected) where user_ids maps every given email to its
+        user_id, added is the number of signatures actually inserted and rejected lists
+        the (email, signature index) of every image that couldn't be decoded.
+    """
+    users = list(users)
+    items = [(email, i, signature if isinstance(signature, tuple) else (signature,))
+             for _, email, signatures in users for i, signature in enumerate(signatures)]
+    # Tensors and blob store files are prepared before the transaction, with the email in
+    # place of the user_id until the users are inserted
+    rows, tensor_rows, rejected = prepare_signatures((email, *signature) for email, _, signature in items)
+    with conn:
+        user_ids = insert_users((name, email) for name, email, _ in users)
+        rows = [(user_ids[email], *row) for email, *row in rows]
+        tensor_rows = [(tensor_blob, version, user_ids[email], image_hash)
+                       for tensor_blob, version, email, image_hash in tensor_rows]
+        added = insert_signatures(rows, tensor_rows)
+    return user_ids, added, [items[i][:2] for i in rejected]
+
+def prepare_signatures(signatures):
+    # Decode tensors and write images to the blob store; returns the Signatures and
+    # SignatureTensors rows for insert_signatures, and the indices of the signatures left
+    # out because their image can't be decoded
+    signatures = list(signatures)
+    with ThreadPoolExecutor() as executor:  # cv2 releases the GIL while decoding
+        tensor_blobs = list(executor.map(compute_tensor_blob, [signature[1] for signature in signatures]))
+
+    upload_date = datetime.now()
+    rows, tensor_rows, rejected = [], [], []
+    for i, ((user_id, image_data, *embedding), tensor_blob) in enumerate(zip(signatures, tensor_blobs)):
+        if tensor_blob is None:
+            rejected.append(i)
+            continue
+        embedding, embedding_model = embedding or (None, None)
+        stored_data, image_hash = store_image(image_data)
+        rows.append((user_id, stored_data, upload_date, embedding, embedding_model, image_hash))
+        tensor_rows.append((tensor_blob, PREPROCESS_VERSION, user_id, image_hash))
+    return rows, tensor_rows, rejected
+
+def insert_signatures(rows, tensor_rows):
+    # Insert prepared signatures without committing; returns the number of rows added
+    cursor.executemany("INSERT OR IGNORE INTO Signatures (user_id, image_data, upload_date, embedding, embedding_model, content_hash) VALUES (?, ?, ?, ?, ?, ?)",
+                       rows)
+    inserted = cursor.rowcount
+    # Signatures are found through the (user_id, content_hash) index since executemany has no lastrowid
+    cursor.executemany("""
+    INSERT OR REPLACE INTO SignatureTensors (signature_id, tensor, preprocess_version)
+    SELECT signature_id, ?, ? FROM Signatures WHERE user_id = ? AND content_hash = ?""", tensor_rows)
+    return inserted
+
+@timed("db.get_signatures")
 def get_signatures(user_id):
-    # Fetch all signatures for a specific user
-    cursor.execute("SELECT image_data FROM Signatures WHERE user_id = ?", (user_id,))
-    return cursor.fetchall()
+    # Fetch all signatures for a specific user as lazy handles; the image bytes are
+    # only read from the blob store when handle.read() is called
+    cursor.execute("SELECT content_hash, image_data FROM Signatures WHERE user_id = ?", (user_id,))
+    return [SignatureHandle(blob_store, image_hash, image_data) for image_hash, image_data in cursor.fetchall()]
+
+@timed("db.get_signature_embeddings")
+def get_signature_embeddings(user_id, embedding_model):
+    # Fetch cached embeddings for a user; rows computed by another model come back
+    # as (signature_id, None, handle) so the caller can recompute them
+    cursor.execute("""
+    SELECT signature_id,
+           CASE WHEN embedding_model = ? THEN embedding END,
+           content_hash,
+           CASE WHEN embedding_model = ? THEN NULL ELSE image_data END
+    FROM Signatures WHERE user_id = ? ORDER BY signature_id""", (embedding_model, embedding_model, user_id))
+    return [(signature_id, embedding, None if embedding is not None else SignatureHandle(blob_store, image_hash, image_data))
+            for signature_id, embedding, image_hash, image_data in cursor.fetchall()]
+
+@timed("db.get_signature_tensors")
+def get_signature_tensors(user_id, signature_ids=None):
+    """
+    Fetches the model-ready tensors of a user's signatures.
+
+    Tensors missing or stored by an older PREPROCESS_VERSION are recomputed from the
+    image and saved, so only those images are read from the blob store.
+
+    Args:
+        user_id (int): User whose signatures are loaded.
+        signature_ids (list): Only return these signatures, in this order
+            (defaults to every signature of the user, ordered by signature_id).
+
+    Returns:
+        np.ndarray: uint8 array of shape (N, 224, 224).
+    """
+    cursor.execute("""
+    SELECT s.signature_id, s.content_hash,
+           CASE WHEN t.preprocess_version = ? THEN t.tensor END,
+           CASE WHEN t.preprocess_version = ? THEN NULL ELSE s.image_data END
+    FROM Signatures s LEFT JOIN SignatureTensors t ON t.signature_id = s.signature_id
+    WHERE s.user_id = ? ORDER BY s.signature_id""", (PREPROCESS_VERSION, PREPROCESS_VERSION, user_id))
+    rows = cursor.fetchall()
+    if signature_ids is not None:
+        rows_by_id = {row[0]: row for row in rows}
+        rows = [rows_by_id[signature_id] for signature_id in signature_ids]
+
+    tensors = np.empty((len(rows), *TENSOR_SIZE), dtype=np.uint8)
+    recomputed = []
+    for i, (signature_id, image_hash, tensor_blob, image_data) in enumerate(rows):
+        if tensor_blob is None:
+            tensor_blob = compute_tensor_blob(SignatureHandle(blob_store, image_hash, image_data))
+            if tensor_blob is None:
+                raise ValueError(f"Could not decode stored signature {signature_id}")
+            recomputed.append((signature_id, tensor_blob, PREPROCESS_VERSION))
+        tensors[i] = blob_to_tensor(tensor_blob)
+    if recomputed:
+        count("db.tensors_recomputed", len(recomputed))
+        with conn:
+            cursor.executemany("INSERT OR REPLACE INTO SignatureTensors (signature_id, tensor, preprocess_version) VALUES (?, ?, ?)",
+                               recomputed)
+    return tensors
+
+def set_signature_embedding(signature_id, embedding, embedding_model):
+    # Store a (re)computed embedding for an existing signature
+    cursor.execute("UPDATE Signatures SET embedding = ?, embedding_model = ? WHERE signature_id = ?",
+                   (embedding, embedding_model, signature_id))
+    conn.commit()
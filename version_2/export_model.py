@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import random
+import numpy as np
+import tensorflow as tf
+from model_utils import load_similarity_model, split_similarity_model, model_tag
+from signature_utils import model_images, embed_signatures
+from preprocessing import PIPELINE, preprocess_batch
+from data_preparation import IMAGE_EXTENSIONS
+from inference_backend import EXPORT_MANIFEST
+
+QUANTIZATIONS = ("none", "dynamic", "float16", "int8")
+
+def input_names(model):
+    # Keras input names in call order (recorded so TFLite inputs can be matched by name)
+    return list(getattr(model, "input_names", None) or [tensor.name.split(":")[0] for tensor in model.inputs])
+
+def list_calibration_images(folders, num_samples, seed=0):
+    # Sample image paths from training folders (searched recursively)
+    paths = sorted(os.path.join(root, name)
+                   for folder in folders
+                   for root, _, names in os.walk(folder)
+                   for name in names if name.lower().endswith(IMAGE_EXTENSIONS))
+    return random.Random(seed).sample(paths, min(num_samples, len(paths)))
+
+def load_calibration_images(paths):
+    # Decode calibration images exactly like inference inputs; model_images turns them
+    # into the input of each model
+    return preprocess_batch(paths)
+
+def convert(model, quantization, representative_data=None):
+    """
+    Converts a Keras model to a TFLite flatbuffer.
+
+    Args:
+        model (Model): Keras model to convert.
+        quantization (str): 'none' (float32), 'dynamic' (int8 weights, float activations),
+            'float16' (float16 weights) or 'int8' (int8 weights and activations, float inputs
+            and outputs).
+        representative_data (list): For 'int8', calibration samples; each is a list with one
+            array per model input, without the batch dimension, in the input's dtype.
+
+    Returns:
+        bytes: The .tflite model.
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization != "none":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        dtypes = [getattr(tensor.dtype, "name", tensor.dtype) for tensor in model.inputs]
+
+        def representative_dataset():
+            for sample in representative_data:
+                yield [np.asarray(array, dtype=dtype)[np.newaxis] for array, dtype in zip(sample, dtypes)]
+        converter.representative_dataset = representative_dataset
+        # Ops without an int8 kernel fall back to float
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS]
+    return converter.convert()
+
+def export_model(model_path, output_dir, quantization="dynamic", calibration_dirs=(), num_samples=100,
+                 whole_model=False, seed=0, uint8_input=False):
+    """
+    Exports a trained siamese model to TFLite.
+
+    By default the embedding tower and the comparison head are exported separately (see
+    model_utils.split_similarity_model), which is what the apps use with cached embeddings.
+    With whole_model, the two-input model is exported as is for verify_signature.
+
+    Args:
+        model_path (str): Trained .h5/.keras model (train6_2inputs, train4_2inputs or train5).
+        output_dir (str): Folder receiving the .tflite files and export.json.
+        quantization (str): One of QUANTIZATIONS.
+        calibration_dirs (list): Training folders sampled for int8 calibration.
+        num_samples (int): Number of calibration images.
+        whole_model (bool): Export the two-input model instead of the tower and head.
+        seed (int): Calibration sampling seed.
+        uint8_input (bool): Export the image models with model_utils.add_uint8_input, so the
+            .tflite files take uint8 grayscale images.
+
+    Returns:
+        dict: The export manifest, also written to output_dir/export.json.
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization {quantization!r}, expected one of {QUANTIZATIONS}")
+    calibration_images = None
+    if quantization == "int8":
+        calibration_paths = list_calibration_images(calibration_dirs, num_samples, seed)
+        if not calibration_paths:
+            raise ValueError("int8 quantization needs calibration images (--calibration-dir)")
+        calibration_images = load_calibration_images(calibration_paths)
+
+    os.makedirs(output_dir, exist_ok=True)
+    model = load_similarity_model(model_path, uint8_input)
+    manifest = {"source": os.path.abspath(model_path), "source_tag": model_tag(model_path),
+                "quantization": quantization, "calibration_samples": 0 if calibration_images is None else len(calibration_images),
+                "uint8_input": uint8_input, "pipeline": PIPELINE, "files": {}}
+    rng = np.random.default_rng(seed)
+
+    def write(name, keras_model, representative_data):
+        file_name = f"{name}.tflite"
+        with open(os.path.join(output_dir, file_name), "wb") as file:
+            file.write(convert(keras_model, quantization, representative_data))
+        manifest["files"][name] = file_name
+
+    if whole_model:
+        pairs = None
+        if calibration_images is not None:
+            # Half matching pairs, half random pairs, so both ends of the score range are seen
+            images = model_images(calibration_images, model)
+            partners = rng.permutation(len(images))
+            pairs = [[image, image if i % 2 == 0 else images[partners[i]]]
+                     for i, image in enumerate(images)]
+        write("similarity_model", model, pairs)
+        manifest["model_inputs"] = input_names(model)
+    else:
+        embedding_model, head_model = split_similarity_model(model)
+        write("embedding_tower", embedding_model, None if calibration_images is None
+              else [[image] for image in model_images(calibration_images, embedding_model)])
+        pairs = None
+        if calibration_images is not None:
+            embeddings = embed_signatures(calibration_images, embedding_model)
+            partners = rng.permutation(len(embeddings))
+            pairs = [[embedding, embedding if i % 2 == 0 else embeddings[partners[i]]]
+                     for i, embedding in enumerate(embeddings)]
+        write("comparison_head", head_model, pairs)
+        manifest["head_inputs"] = input_names(head_model)
+
+    with open(os.path.join(output_dir, EXPORT_MANIFEST), "w") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a trained siamese model to TFLite.")
+    parser.add_argument("model", help="Trained .h5/.keras similarity model")
+    parser.add_argument("output_dir", help="Folder for the .tflite files and export.json")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default="dynamic")
+    parser.add_argument("--calibration-dir", action="append", default=[],
+                        help="Training folder sampled for int8 calibration (repeatable)")
+    parser.add_argument("--calibration-samples", type=int, default=100)
+    parser.add_argument("--whole-model", action="store_true", help="Export the two-input model instead of the tower and head")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--uint8-input", action="store_true",
+                        help="Take uint8 grayscale images and normalize them in the graph")
+    args = parser.parse_args()
+
+    manifest = export_model(args.model, args.output_dir, args.quantization, args.calibration_dir,
+                            args.calibration_samples, args.whole_model, args.seed, args.uint8_input)
+    source_size = os.path.getsize(args.model)
+    for name, file_name in manifest["files"].items():
+        size = os.path.getsize(os.path.join(args.output_dir, file_name))
+        print(f"{name}: {size / 1e6:.1f} MB")
+    print(f"Source model: {source_size / 1e6:.1f} MB")
+
+if __name__ == "__main__":
+    main()
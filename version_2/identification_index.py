@@ -0,0 +1,195 @@
+import os
+import numpy as np
+
+IMAGE_EXTENSIONS = (".jpg", ".png")
+EMBED_BATCH_SIZE = 32
+HEAD_BATCH_SIZE = 4096
+
+class SignatureIndex:
+    """
+    Persistent 1:N identification index over a folder of genuine signatures.
+
+    Stores one embedding per signature image (computed by the model's shared tower)
+    together with its user label, path, mtime and size, plus the mtime of every folder
+    scanned so unchanged folders are skipped on the next sync. Queries run the tower once on the
+    input signature and score it against every stored embedding with the comparison head
+    in a few large batched calls.
+
+    Args:
+        index_path (str): .npz file the index is persisted to, or None to keep it in memory only.
+        embedding_model (Model): Shared embedding tower (see model_utils.split_similarity_model).
+        head_model (Model): Comparison head taking two embedding batches.
+        preprocess (callable): Maps an image path to a preprocessed image, or an empty array on failure.
+        model_tag (str): Identifies the model; a saved index built by another model is discarded.
+    """
+
+    def __init__(self, index_path, embedding_model, head_model, preprocess, model_tag=""):
+        self.index_path = index_path
+        self.embedding_model = embedding_model
+        self.head_model = head_model
+        self.preprocess = preprocess
+        self.model_tag = model_tag
+        self.embeddings = None
+        self.labels = np.array([], dtype=str)
+        self.paths = np.array([], dtype=str)
+        self.mtimes = np.array([], dtype=np.int64)
+        self.sizes = np.array([], dtype=np.int64)
+        self.folder_mtimes = {}  # folder path -> mtime_ns at the last sync
+        self.load()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def load(self):
+        # Load the saved index if it exists and was built by the same model
+        if self.index_path is None or not os.path.exists(self.index_path):
+            return
+        with np.load(self.index_path) as data:
+            if str(data["model_tag"]) != self.model_tag:
+                return
+            self.embeddings = data["embeddings"]
+            self.labels = data["labels"]
+            self.paths = data["paths"]
+            self.mtimes = data["mtimes"]
+            self.sizes = data["sizes"]
+            if "folder_paths" in data:  # Indexes saved before folder mtimes were recorded rescan everything once
+                self.folder_mtimes = dict(zip(data["folder_paths"].tolist(), data["folder_mtimes"].tolist()))
+
+    def save(self):
+        # Write the index atomically so an interrupted save never corrupts it
+        if self.index_path is None:
+            return
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "wb") as file:
+            np.savez(file, embeddings=self._embedding_matrix(), labels=self.labels, paths=self.paths,
+                     mtimes=self.mtimes, sizes=self.sizes, model_tag=np.array(self.model_tag),
+                     folder_paths=np.array(list(self.folder_mtimes), dtype=str),
+                     folder_mtimes=np.array(list(self.folder_mtimes.values()), dtype=np.int64))
+        os.replace(temp_path, self.index_path)
+
+    def _embedding_matrix(self):
+        if self.embeddings is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self.embeddings
+
+    def add(self, paths, labels):
+        # Embed new signature images and append them to the index
+        images, kept_paths, kept_labels = [], [], []
+        for path, label in zip(paths, labels):
+            image = self.preprocess(path)
+            if image.size != 0:
+                images.append(image.reshape(image.shape[-3:]))
+                kept_paths.append(path)
+                kept_labels.append(label)
+        if not images:
+            return 0
+
+        images = np.stack(images).astype(np.float32)
+        embeddings = np.concatenate([
+            self.embedding_model.predict_on_batch(images[start:start + EMBED_BATCH_SIZE])
+            for start in range(0, len(images), EMBED_BATCH_SIZE)
+        ]).astype(np.float32)
+        stats = [os.stat(path) for path in kept_paths]
+
+        self.embeddings = embeddings if not len(self) else np.concatenate([self.embeddings, embeddings])
+        self.labels = np.concatenate([self.labels, kept_labels])
+        self.paths = np.concatenate([self.paths, kept_paths])
+        self.mtimes = np.concatenate([self.mtimes, [stat.st_mtime_ns for stat in stats]])
+        self.sizes = np.concatenate([self.sizes, [stat.st_size for stat in stats]])
+        return len(kept_paths)
+
+    def remove(self, paths):
+        # Drop the given signature images from the index
+        keep = ~np.isin(self.paths, list(paths))
+        removed = int((~keep).sum())
+        if removed:
+            self.embeddings = self.embeddings[keep]
+            self.labels = self.labels[keep]
+            self.paths = self.paths[keep]
+            self.mtimes = self.mtimes[keep]
+            self.sizes = self.sizes[keep]
+        return removed
+
+    def sync(self, database_folder, full=False):
+        """
+        Brings the index up to date with a database folder (one subfolder per user).
+
+        Only files that were added, removed or modified since the last sync are
+        (re-)embedded. Folders whose mtime is unchanged (adding, removing or renaming a
+        file updates its folder's mtime) are not listed again, so syncing an unchanged
+        database costs one stat call per folder. The index is saved if anything changed.
+
+        Args:
+            database_folder (str): Folder of user folders.
+            full (bool): Stat every file, also picking up files rewritten in place
+                (which leave their folder's mtime unchanged).
+
+        Returns:
+            tuple: (number of signatures added, number removed).
+        """
+        indexed = {path: (int(mtime), int(size)) for path, mtime, size in zip(self.paths, self.mtimes, self.sizes)}
+        indexed_by_folder, subfolders = {}, {}
+        for path in indexed:
+            indexed_by_folder.setdefault(os.path.dirname(path), []).append(path)
+        for folder in self.folder_mtimes:
+            subfolders.setdefault(os.path.dirname(folder), []).append(folder)
+
+        current, folder_mtimes = {}, {}
+        pending = [database_folder]
+        while pending:
+            folder = pending.pop()
+            folder_mtime = os.stat(folder).st_mtime_ns
+            folder_mtimes[folder] = folder_mtime
+            label = os.path.basename(folder)
+            if not full and self.folder_mtimes.get(folder) == folder_mtime:  # Same files and subfolders as last time
+                for path in indexed_by_folder.get(folder, []):
+                    current[path] = (*indexed[path], label)
+                pending.extend(subfolders.get(folder, []))
+                continue
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        pending.append(entry.path)
+                    elif entry.name.endswith(IMAGE_EXTENSIONS):
+                        stat = entry.stat()
+                        current[entry.path] = (stat.st_mtime_ns, stat.st_size, label)
+
+        stale = [path for path, key in indexed.items() if current.get(path, (None, None))[:2] != key]
+        new = [path for path, key in current.items() if indexed.get(path) != key[:2]]
+
+        removed = self.remove(stale)
+        added = self.add(new, [current[path][2] for path in new])
+        folders_changed = folder_mtimes != self.folder_mtimes
+        self.folder_mtimes = folder_mtimes
+        if added or removed or folders_changed:
+            self.save()
+        return added, removed
+
+    def query(self, input_signature, top_k=5):
+        """
+        Identifies the users whose signatures best match the input signature.
+
+        Args:
+            input_signature (numpy.ndarray): Preprocessed input image (with or without batch dimension).
+            top_k (int): Number of users to return.
+
+        Returns:
+            list: (label, best score, path of best matching signature) tuples, best first.
+        """
+        if not len(self):
+            return []
+        input_signature = np.asarray(input_signature, dtype=np.float32).reshape(1, *input_signature.shape[-3:])
+        query_embedding = self.embedding_model.predict_on_batch(input_signature).astype(np.float32)
+
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), HEAD_BATCH_SIZE):
+            references = self.embeddings[start:start + HEAD_BATCH_SIZE]
+            queries = np.broadcast_to(query_embedding, references.shape)
+            scores[start:start + len(references)] = self.head_model.predict_on_batch([queries, references]).reshape(-1)
+
+        # Keep the best scoring signature of each user
+        order = np.argsort(-scores, kind="stable")
+        _, first = np.unique(self.labels[order], return_index=True)
+        best = order[np.sort(first)][:top_k]
+        return [(str(self.labels[i]), float(scores[i]), str(self.paths[i])) for i in best]
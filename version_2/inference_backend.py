@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+import numpy as np
+from preprocessing import pipeline_tag
+
+EXPORT_MANIFEST = "export.json"
+
+def load_interpreter(model_path, num_threads=None):
+    # Prefer the standalone tflite_runtime package (no TensorFlow import, smaller footprint)
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter(model_path=model_path, num_threads=num_threads)
+
+class TFLiteModel:
+    """
+    Runs an exported .tflite model through the same predict_on_batch call as a Keras model.
+
+    embed_signatures, verify_signature_embeddings and verify_signature only call
+    predict_on_batch, so a TFLiteModel can be passed wherever they take a Keras model.
+
+    Args:
+        model_path (str): .tflite file written by export_model.py.
+        input_names (list): Keras input names in call order. TFLite may reorder the
+            inputs of multi-input models, so they are matched by name when given.
+        num_threads (int): Interpreter threads (defaults to the runtime's choice).
+    """
+
+    def __init__(self, model_path, input_names=None, num_threads=None):
+        self.model_path = model_path
+        self.interpreter = load_interpreter(model_path, num_threads)
+        self.interpreter.allocate_tensors()
+        self.lock = threading.Lock()  # An interpreter must not be invoked from two threads at once
+
+        details = self.interpreter.get_input_details()
+        if input_names:
+            # Converted inputs are named like "serving_default_<keras name>:0"
+            self.input_details = [next(detail for detail in details
+                                       if detail["name"] == name or detail["name"].endswith(f"_{name}:0"))
+                                  for name in input_names]
+        else:
+            self.input_details = details
+        self.input_names = input_names or [detail["name"] for detail in details]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self.input_shapes = [tuple(detail["shape"]) for detail in self.input_details]
+        # Exported with export_model.py --uint8-input: takes uint8 grayscale images (see signature_utils.model_images)
+        self.uint8_input = self.input_details[0]["dtype"] == np.uint8
+
+    def predict_on_batch(self, inputs):
+        if isinstance(inputs, dict):  # train4/train5 models take {"signature1": ..., "signature2": ...}
+            inputs = [inputs[name] for name in self.input_names]
+        elif not isinstance(inputs, (list, tuple)):
+            inputs = [inputs]
+
+        with self.lock:
+            input_shapes = [np.shape(batch) for batch in inputs]
+            if input_shapes != self.input_shapes:  # Batch size changed: resize once, then reuse
+                for detail, shape in zip(self.input_details, input_shapes):
+                    self.interpreter.resize_tensor_input(detail["index"], shape)
+                self.interpreter.allocate_tensors()
+                self.input_shapes = input_shapes
+            for detail, batch in zip(self.input_details, inputs):
+                self.interpreter.set_tensor(detail["index"], np.ascontiguousarray(batch, dtype=detail["dtype"]))
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output_detail["index"]).astype(np.float32)
+
+def is_export_dir(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, EXPORT_MANIFEST))
+
+def read_export_manifest(export_dir):
+    with open(os.path.join(export_dir, EXPORT_MANIFEST)) as manifest:
+        return json.load(manifest)
+
+def load_inference_models(model_path, num_threads=None, uint8_input=False):
+    """
+    Loads the embedding tower and comparison head from a Keras model or a TFLite export.
+
+    Args:
+        model_path (str): Trained .h5/.keras siamese model, or a folder written by
+            export_model.py with the tower and head exported separately.
+        num_threads (int): TFLite interpreter threads.
+        uint8_input (bool): Wrap a Keras tower with model_utils.add_uint8_input. TFLite
+            exports take whatever input they were exported with.
+
+    Returns:
+        tuple: (embedding_model, head_model, tag). Both models expose predict_on_batch;
+        tag identifies the artifact and the preprocessing pipeline, so cached embeddings are
+        recomputed when either changes.
+    """
+    if not is_export_dir(model_path):
+        from model_utils import load_similarity_model, split_similarity_model, model_tag
+        # The adapter computes the same float32 input in the graph, so embeddings keep the model's tag
+        embedding_model, head_model = split_similarity_model(load_similarity_model(model_path, uint8_input))
+        return embedding_model, head_model, pipeline_tag(model_tag(model_path))
+
+    manifest = read_export_manifest(model_path)
+    if "embedding_tower" not in manifest["files"]:
+        raise ValueError(f"{model_path} holds a whole-model export; export the tower and head separately to use embeddings")
+    embedding_model = TFLiteModel(os.path.join(model_path, manifest["files"]["embedding_tower"]),
+                                  num_threads=num_threads)
+    head_model = TFLiteModel(os.path.join(model_path, manifest["files"]["comparison_head"]),
+                             manifest["head_inputs"], num_threads)
+    # Embeddings of a quantized tower differ from the Keras ones, so they get their own tag
+    return embedding_model, head_model, pipeline_tag(f"{manifest['source_tag']}:tflite-{manifest['quantization']}")
+
+def load_pair_model(model_path, num_threads=None, uint8_input=False):
+    # Load a two-input similarity model (for verify_signature) from a .h5 file or a whole-model export
+    if not is_export_dir(model_path):
+        from model_utils import load_similarity_model
+        return load_similarity_model(model_path, uint8_input)
+    manifest = read_export_manifest(model_path)
+    if "similarity_model" not in manifest["files"]:
+        raise ValueError(f"{model_path} holds a tower/head export; use load_inference_models")
+    return TFLiteModel(os.path.join(model_path, manifest["files"]["similarity_model"]),
+                       manifest["model_inputs"], num_threads)
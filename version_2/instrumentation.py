@@ -0,0 +1,181 @@
+import atexit
+import functools
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Set SIGNATURE_PROFILE to "json" (or "1") or "prometheus" to collect stage timings and counters;
+# they are written to SIGNATURE_PROFILE_OUTPUT at exit. When unset, timers and counters are no-ops.
+PROFILE = os.environ.get("SIGNATURE_PROFILE", "")
+ENABLED = bool(PROFILE)
+OUTPUT_PATH = os.environ.get("SIGNATURE_PROFILE_OUTPUT", "")
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    # Count, sum, min, max and bucket counts of observed durations
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)  # Last bucket is +Inf
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+
+def observe(name, seconds):
+    # Record a duration measured by the caller
+    if not ENABLED:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+def count(name, value=1):
+    # Increment a counter
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.start)
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return None
+
+_NULL_TIMER = _NullTimer()
+
+def timer(name):
+    # Context manager recording the duration of its block under name
+    return _Timer(name) if ENABLED else _NULL_TIMER
+
+def timed(name):
+    # Decorator recording the duration of every call; returns the function unchanged when disabled
+    def decorate(function):
+        if not ENABLED:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+def snapshot():
+    """
+    Returns the collected timings and counters.
+
+    Returns:
+        dict: {"histograms": {stage: {count, sum_s, min_s, max_s, mean_ms, buckets}},
+        "counters": {name: value}}. Bucket counts are keyed by their upper bound in seconds
+        and are not cumulative.
+    """
+    with _lock:
+        histograms = {name: {"count": histogram.count, "sum_s": histogram.total, "min_s": histogram.min,
+                             "max_s": histogram.max, "mean_ms": histogram.total / histogram.count * 1000,
+                             "buckets": dict(zip([str(bound) for bound in BUCKETS] + ["+Inf"], histogram.buckets))}
+                      for name, histogram in _histograms.items()}
+        return {"histograms": histograms, "counters": dict(_counters)}
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+def _label(name):
+    return re.sub(r'["\\\n]', "_", name)
+
+def prometheus_text():
+    # Prometheus text exposition of the collected timings and counters
+    lines = ["# TYPE signature_stage_seconds histogram"]
+    with _lock:
+        for name, histogram in sorted(_histograms.items()):
+            cumulative = 0
+            for bound, bucket in zip([str(bound) for bound in BUCKETS] + ["+Inf"], histogram.buckets):
+                cumulative += bucket
+                lines.append(f'signature_stage_seconds_bucket{{stage="{_label(name)}",le="{bound}"}} {cumulative}')
+            lines.append(f'signature_stage_seconds_sum{{stage="{_label(name)}"}} {histogram.total}')
+            lines.append(f'signature_stage_seconds_count{{stage="{_label(name)}"}} {histogram.count}')
+        lines.append("# TYPE signature_events_total counter")
+        for name, value in sorted(_counters.items()):
+            lines.append(f'signature_events_total{{name="{_label(name)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+def dump(path=None, format=None):
+    """
+    Writes the collected timings and counters to a file.
+
+    Args:
+        path (str): Output file (defaults to SIGNATURE_PROFILE_OUTPUT, else
+            signature_profile.json or signature_profile.prom).
+        format (str): "json" or "prometheus" (defaults to SIGNATURE_PROFILE).
+    """
+    format = format or ("prometheus" if PROFILE == "prometheus" else "json")
+    path = path or OUTPUT_PATH or ("signature_profile.prom" if format == "prometheus" else "signature_profile.json")
+    with open(path, "w") as file:
+        if format == "prometheus":
+            file.write(prometheus_text())
+        else:
+            json.dump(snapshot(), file, indent=2)
+
+@contextmanager
+def profile_request(log_dir=None):
+    """
+    Captures a tf.profiler trace of the enclosed block (e.g. one verification).
+
+    The trace is written to log_dir (defaults to SIGNATURE_TF_PROFILE_DIR) and can be opened
+    in TensorBoard's profile tab. Does nothing when no directory is given.
+    """
+    log_dir = log_dir or os.environ.get("SIGNATURE_TF_PROFILE_DIR")
+    if not log_dir:
+        yield
+        return
+    import tensorflow as tf
+    tf.profiler.experimental.start(log_dir)
+    try:
+        yield
+    finally:
+        tf.profiler.experimental.stop()
+
+if ENABLED:
+    atexit.register(dump)
@@ -0,0 +1,132 @@
+import queue
+import threading
+import time
+from instrumentation import observe
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    """
+    A unit of work queued on a JobWorker.
+
+    The job function receives the Job as its first argument and should call
+    job.progress(message) between steps and job.check_cancelled() where it is safe to stop.
+    """
+
+    def __init__(self, worker, name, function, args, on_done, on_error, on_progress):
+        self.worker = worker
+        self.name = name
+        self.function = function
+        self.args = args
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.status = "queued"  # queued -> running -> done / failed / cancelled
+        self.submitted = time.perf_counter()
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(self.name)
+
+    def progress(self, message):
+        # Called from the worker thread; the callback runs on the Tk thread
+        self.worker.post(self, "progress", message)
+
+class JobWorker:
+    """
+    Runs jobs one at a time on a background thread so the Tk event loop never blocks.
+
+    Only the worker thread touches the model and the database while jobs run. Results,
+    errors and progress messages are handed back through a queue polled with app.after,
+    so every callback runs on the Tk thread.
+
+    Args:
+        app (Tk): Window whose event loop receives the callbacks.
+        on_status (callable): Called on the Tk thread with (running_job, queued_count)
+            whenever the queue changes.
+        poll_ms (int): Interval between checks for finished work.
+    """
+
+    def __init__(self, app, on_status=None, poll_ms=50):
+        self.app = app
+        self.on_status = on_status
+        self.poll_ms = poll_ms
+        self.jobs = queue.Queue()
+        self.events = queue.Queue()
+        self.pending = []  # Jobs queued or running, oldest first
+        self.thread = threading.Thread(target=self._run, name="job-worker", daemon=True)
+        self.thread.start()
+        self.app.after(self.poll_ms, self._poll)
+
+    def submit(self, name, function, *args, on_done=None, on_error=None, on_progress=None):
+        # Queue function(job, *args); returns the Job so the caller can cancel it
+        job = Job(self, name, function, args, on_done, on_error, on_progress)
+        self.pending.append(job)
+        self.jobs.put(job)
+        self._notify_status()
+        return job
+
+    def cancel_all(self):
+        # Cancel the running job (at its next check) and drop every queued job
+        for job in self.pending:
+            job.cancel()
+
+    def post(self, job, kind, value):
+        self.events.put((job, kind, value, time.perf_counter()))
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job.cancelled:
+                self.post(job, "cancelled", None)
+                continue
+            started = time.perf_counter()
+            observe(f"job.{job.name}.wait", started - job.submitted)
+            self.post(job, "running", None)
+            try:
+                result = job.function(job, *job.args)
+            except JobCancelled:
+                self.post(job, "cancelled", None)
+            except Exception as e:
+                self.post(job, "failed", e)
+            else:
+                self.post(job, "done", result)
+            observe(f"job.{job.name}.run", time.perf_counter() - started)
+
+    def _poll(self):
+        while True:
+            try:
+                job, kind, value, posted = self.events.get_nowait()
+            except queue.Empty:
+                break
+            # Time between the worker posting an event and the Tk loop picking it up
+            observe("tk.dispatch", time.perf_counter() - posted)
+            if kind == "progress":
+                if job.on_progress:
+                    job.on_progress(value)
+                continue
+            job.status = kind
+            if kind != "running":
+                self.pending.remove(job)
+                callback_start = time.perf_counter()
+                if kind == "done" and job.on_done:
+                    job.on_done(value)
+                elif kind == "failed" and job.on_error:
+                    job.on_error(value)
+                observe(f"job.{job.name}.callback", time.perf_counter() - callback_start)
+            self._notify_status()
+        self.app.after(self.poll_ms, self._poll)
+
+    def _notify_status(self):
+        if self.on_status:
+            running = next((job for job in self.pending if job.status == "running"), None)
+            self.on_status(running, sum(job.status == "queued" for job in self.pending))
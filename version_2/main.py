@@ -1,13 +1,42 @@
+import time
+STARTUP_START = time.perf_counter()  # Cold start to interactive is reported once the window is up
+
 from tkinter import Tk, Label, Entry, Button, filedialog, messagebox, Frame
 from tkinter.ttk import Combobox
+import argparse
+import os
 import re
-from db_manager import add_user, get_users, add_signature, get_signatures
-from signature_utils import preprocess_image, verify_signature
+import numpy as np
+from db_manager import add_user, get_users, add_signatures_bulk, content_hash, find_signature, replace_signature
+from job_worker import JobWorker
+from instrumentation import timer, profile_request
+from model_manager import ModelManager
 from tkinter import font
-from tensorflow.keras.models import load_model
 
-# Load the trained model
-model = load_model("C:/Users/krisa/Desktop/CPRO 2902/Offline-Signature-Verification/version_2/signature_similarity_model.h5")
+# TensorFlow is only imported by the model manager's thread (signature_utils and model_utils
+# import it), so the modules using it are imported inside the functions that run after loading
+
+# Model path (.h5 model or export_model.py folder): --model, else SIGNATURE_MODEL_PATH,
+# else the model next to this script
+parser = argparse.ArgumentParser(description="Offline signature verification app.")
+parser.add_argument("--model", default=os.environ.get("SIGNATURE_MODEL_PATH", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "signature_similarity_model.h5")))
+parser.add_argument("--uint8-input", action="store_true", help="Feed uint8 grayscale images to a Keras model through model_utils.add_uint8_input")
+args = parser.parse_args()
+MODEL_PATH = args.model
+UINT8_INPUT = args.uint8_input
+
+def load_models():
+    # Load the embedding tower and comparison head (split from a Keras model, or a TFLite
+    # export from export_model.py) and run one dummy prediction through both
+    from inference_backend import load_inference_models
+    from model_utils import warm_up_models
+    import signature_utils  # Imported here so the first verification doesn't pay for it
+    embedding_model, head_model, tag = load_inference_models(MODEL_PATH, uint8_input=UINT8_INPUT)
+    warm_up_models(embedding_model, head_model, signature_utils.IMAGE_SIZE)
+    return embedding_model, head_model, tag
+
+models = ModelManager(load_models, name="similarity model")
 
 # Helper Functions
 def is_valid_email(email):
@@ -16,10 +45,18 @@ def is_valid_email(email):
     return re.match(email_regex, email) is not None
 
 def refresh_users():
-    # Refresh the user list in the combobox
-    users = get_users()
-    user_combobox['values'] = [f"{user[0]} - {user[1]}" for user in users]
-    verify_user_combobox['values'] = [f"{user[0]} - {user[1]}" for user in users]
+    # Refresh the user list in the comboboxes (the query runs on the worker thread)
+    def show_users(users):
+        user_combobox['values'] = [f"{user[0]} - {user[1]}" for user in users]
+        verify_user_combobox['values'] = [f"{user[0]} - {user[1]}" for user in users]
+    worker.submit("Load users", lambda job: get_users(), on_done=show_users,
+                  on_error=lambda e: messagebox.showerror("Error", f"Could not load users: {e}"))
+
+def load_reference_embeddings(user_id):
+    # Load the cached embeddings of a user's signatures, computing any missing or stale ones
+    from reference_embeddings import load_reference_embeddings as load_embeddings
+    embedding_model, _, tag = models.get()
+    return load_embeddings(user_id, embedding_model, tag)
 
 def handle_add_user():
     # Handle adding a new user
@@ -34,14 +71,14 @@ def handle_add_user():
         messagebox.showwarning("Invalid Email", "Please enter a valid email address!")
         return
 
-    try:
-        add_user(name, email)
+    def user_added(_):
         messagebox.showinfo("Success", "User added successfully!")
         name_entry.delete(0, 'end')
         email_entry.delete(0, 'end')
         refresh_users()
-    except Exception as e:
-        messagebox.showerror("Error", f"Could not add user: {e}")
+
+    worker.submit("Add user", lambda job: add_user(name, email), on_done=user_added,
+                  on_error=lambda e: messagebox.showerror("Error", f"Could not add user: {e}"))
 
 def handle_browse_files(entry_widget, single_file=False):
     # Handle the file browsing functionality
@@ -58,6 +95,48 @@ def handle_browse_files(entry_widget, single_file=False):
             entry_widget.delete(0, 'end')
             entry_widget.insert(0, ", ".join(file_paths))  # Display multiple paths as comma-separated
 
+def read_signature_files(job, user_id, file_paths):
+    # Worker job: read and hash the selected files and look up the ones the user already has.
+    # Returns (image_data, signature_id or None) for every distinct file.
+    files = []
+    seen_hashes = set()
+    for i, file_path in enumerate(file_paths):
+        job.check_cancelled()
+        job.progress(f"Reading file {i + 1}/{len(file_paths)}")
+        # Read the image file as binary data (BLOB)
+        with open(file_path, "rb") as file:
+            image_data = file.read()
+
+        image_hash = content_hash(image_data)
+        if image_hash in seen_hashes:  # Same file selected twice
+            continue
+        seen_hashes.add(image_hash)
+        # Indexed lookup on user_id + content_hash
+        files.append((image_data, find_signature(user_id, image_hash)))
+    return files
+
+def store_signatures(job, user_id, new_signatures, replaced_signatures):
+    # Worker job: embed the new and replaced signatures, then write them in one go
+    if not models.done:
+        job.progress("Waiting for the model to load")
+    embedding_model, _, tag = models.get()
+    from signature_utils import signature_tensor_batch, embed_signatures, embedding_to_blob, MAX_BATCH_SIZE
+    images = new_signatures + [image_data for _, image_data in replaced_signatures]
+    embeddings = []
+    for start in range(0, len(images), MAX_BATCH_SIZE):
+        job.check_cancelled()
+        job.progress(f"Embedding signatures {start + 1}-{min(start + MAX_BATCH_SIZE, len(images))}/{len(images)}")
+        embeddings.extend(embedding_to_blob(embedding) for embedding in
+                          embed_signatures(signature_tensor_batch(images[start:start + MAX_BATCH_SIZE]), embedding_model))
+
+    job.check_cancelled()  # Last chance to cancel: nothing has been written yet
+    job.progress("Saving signatures")
+    # Insert the new signatures in a single transaction
+    add_signatures_bulk([(user_id, image_data, embedding, tag)
+                         for image_data, embedding in zip(new_signatures, embeddings)])
+    for (signature_id, image_data), embedding in zip(replaced_signatures, embeddings[len(new_signatures):]):
+        replace_signature(signature_id, image_data, embedding, tag)
+
 def handle_upload_signatures():
     # Handle uploading signatures
     selected_user = user_combobox.get()
@@ -72,38 +151,50 @@ def handle_upload_signatures():
 
     user_id = selected_user.split(" - ")[0]
 
-    # Get existing signature BLOBs for the selected user
-    existing_signatures = [row[0] for row in get_signatures(user_id)]
-
-    for file_path in file_paths:
-        try:
-            # Read the image file as binary data (BLOB)
-            with open(file_path, "rb") as file:
-                image_data = file.read()
-
-            # Check if the signature already exists by comparing BLOBs
-            if image_data in existing_signatures:
-                response = messagebox.askyesno(
-                    "Signature Exists",
-                    f"This signature already exists.\nDo you want to replace it?"
-                )
-                if response:  # If the user selects 'Yes', replace the signature
-                    # Replace the existing signature 
-                    existing_signatures.remove(image_data)  # Remove the old one
-                    add_signature(user_id, image_data)  # Add the new one
-                else:
-                    continue  # Skip this file if the user chooses not to replace
-                
-            else:
-                # Add the signature if it doesn't exist
-                add_signature(user_id, image_data)
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to upload signature: {e}")
-            return
+    def upload_failed(e):
+        messagebox.showerror("Error", f"Failed to upload signature: {e}")
+
+    def signatures_uploaded(_):
+        messagebox.showinfo("Success", "Signature(s) uploaded successfully!")
+        user_combobox.set('')
+        file_entry.delete(0, 'end')
+
+    def confirm_replacements(files):
+        # Runs on the Tk thread so the replace prompts can be shown
+        new_signatures = []
+        replaced_signatures = []
+        for image_data, signature_id in files:
+            if signature_id is None:
+                new_signatures.append(image_data)
+            elif messagebox.askyesno("Signature Exists", f"This signature already exists.\nDo you want to replace it?"):
+                replaced_signatures.append((signature_id, image_data))  # Replaced in place
+        worker.submit("Upload signatures", store_signatures, user_id, new_signatures, replaced_signatures,
+                      on_done=signatures_uploaded, on_error=upload_failed, on_progress=show_progress)
+
+    worker.submit("Read signatures", read_signature_files, user_id, file_paths,
+                  on_done=confirm_replacements, on_error=upload_failed, on_progress=show_progress)
+
+def verify_signature_file(job, user_id, file_path):
+    # Worker job: verify a signature file against the user's cached reference embeddings.
+    # Returns the score aggregates, or None if the user has no signatures.
+    # With SIGNATURE_TF_PROFILE_DIR set, each verification is also captured as a tf.profiler trace
+    embedding_model, head_model, _ = models.get()
+    from signature_utils import preprocess_image, embed_signatures, verify_signature_embeddings
+    with profile_request():
+        job.progress("Preprocessing signature")
+        uploaded_signature = preprocess_image(file_path)  # Preprocess the uploaded signature
+        job.check_cancelled()
+        job.progress("Loading reference signatures")
+        with timer("reference_embeddings"):
+            genuine_embeddings = load_reference_embeddings(user_id)
+        if not genuine_embeddings:
+            return None
 
-    messagebox.showinfo("Success", "Signature(s) uploaded successfully!")
-    user_combobox.set('')
-    file_entry.delete(0, 'end')
+        job.check_cancelled()
+        job.progress(f"Comparing against {len(genuine_embeddings)} signatures")
+        # Run the tower once on the query, then only the head against the cached embeddings
+        query_embedding = embed_signatures(uploaded_signature[np.newaxis], embedding_model)[0]
+        return verify_signature_embeddings(query_embedding, genuine_embeddings, head_model)
 
 def handle_verify_signature():
     # Handle verifying a signature
@@ -118,27 +209,41 @@ def handle_verify_signature():
         return
 
     user_id = selected_user.split(" - ")[0]
-    try:
-        uploaded_signature = preprocess_image(file_path)  # Preprocess the uploaded signature
-        genuine_signatures = [row[0] for row in get_signatures(user_id)]
 
-        if not genuine_signatures:
+    def show_result(result):
+        if result is None:
             messagebox.showerror("Error", "No genuine signatures found for this user.")
             return
-
-        # Verify signature against stored genuine signatures
-        max_score, is_verified = verify_signature(uploaded_signature, genuine_signatures, model)
-        result = "Verified" if is_verified else "Forged"
+        max_score = result["max_score"]
+        result = "Verified" if result["is_verified"] else "Forged"
         messagebox.showinfo("Verification Result", f"Signature {result}! Similarity: {max_score:.2f}")
         verify_user_combobox.set('')
         verify_file_entry.delete(0, 'end')
-    except Exception as e:
-        messagebox.showerror("Error", f"Could not verify signature: {e}")
+
+    worker.submit("Verify signature", verify_signature_file, user_id, file_path, on_done=show_result,
+                  on_error=lambda e: messagebox.showerror("Error", f"Could not verify signature: {e}"),
+                  on_progress=show_progress)
+
+def show_status(running_job, queued_count):
+    # Show what the worker is doing below the form
+    if running_job is None and not queued_count:
+        status_text["current"] = "Ready"
+    else:
+        status_text["current"] = f"Running: {running_job.name}" if running_job else "Waiting"
+        if queued_count:
+            status_text["current"] += f" ({queued_count} queued)"
+    status_label.config(text=status_text["current"])
+    cancel_button.config(state="normal" if running_job or queued_count else "disabled")
+
+def show_progress(message):
+    status_label.config(text=f"{status_text['current']} - {message}")
+
+status_text = {"current": "Ready"}
 
 # Tkinter UI
 app = Tk()
 app.title("Offline Signature Verification System")
-app.geometry("600x630")
+app.geometry("600x680")
 
 # Set background color for the main app window
 app.configure(bg="#D2B48C")  # Light gray background
@@ -206,10 +311,42 @@ verify_file_entry = Entry(verify_signature_frame, width=30, font=("Times New Rom
 verify_file_entry.grid(row=2, column=1, pady=5)
 verify_browse_button = Button(verify_signature_frame, text="Browse", command=lambda: handle_browse_files(verify_file_entry, single_file=True), font=button_font, bg="#8B4513", fg="white", relief="raised", bd=2)
 verify_browse_button.grid(row=2, column=2, padx=(10, 0))  # Added horizontal padding to separate button
-verify_button = Button(verify_signature_frame, text="Verify Signature", command=handle_verify_signature, font=button_font, bg="#8B4513", fg="white", relief="raised", bd=2)
+verify_button = Button(verify_signature_frame, text="Loading model...", command=handle_verify_signature, font=button_font, bg="#8B4513", fg="white", relief="raised", bd=2, state="disabled")
 verify_button.grid(row=3, column=0, columnspan=3, pady=15)
 
+# Worker status and cancellation
+status_frame = Frame(outer_frame, bg="#D2B48C")
+status_frame.pack(pady=5)
+status_label = Label(status_frame, text="Ready", font=("Times New Roman", 11), bg="#D2B48C", fg="#4E3629", width=45, anchor="w")
+status_label.grid(row=0, column=0, padx=(0, 10))
+cancel_button = Button(status_frame, text="Cancel", command=lambda: worker.cancel_all(), font=button_font, bg="#8B4513", fg="white", relief="raised", bd=2, state="disabled")
+cancel_button.grid(row=0, column=1)
+
+# Model and database work runs on this thread so the window stays responsive
+worker = JobWorker(app, on_status=show_status)
+
 # Populate user dropdown
 refresh_users()
 
+def report_window_ready():
+    print(f"Window interactive {time.perf_counter() - STARTUP_START:.2f}s after start")
+
+def check_model_ready():
+    # Enable verification once the model is loaded and warmed up
+    if not models.done:
+        app.after(100, check_model_ready)
+        return
+    if models.error is not None:
+        verify_button.config(text="Model unavailable")
+        messagebox.showerror("Error", f"Could not load the model from {MODEL_PATH}: {models.error}")
+        return
+    verify_button.config(text="Verify Signature", state="normal")
+    print(f"Model ready {time.perf_counter() - STARTUP_START:.2f}s after start "
+          f"(load and warmup took {models.load_seconds:.2f}s)")
+
+# Load the model in the background; only Verify waits for it
+models.start()
+app.after_idle(report_window_ready)
+app.after(100, check_model_ready)
+
 app.mainloop()
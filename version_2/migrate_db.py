@@ -0,0 +1,31 @@
+import argparse
+import os
+
+def main():
+    parser = argparse.ArgumentParser(description="Bring a signature database up to the current schema.")
+    parser.add_argument("db", nargs="?", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "signature_verification.db"))
+    parser.add_argument("--dry-run", action="store_true", help="Report the duplicate signatures that would be deleted without changing anything")
+    args = parser.parse_args()
+
+    # db_manager creates missing tables, columns and the user index on import; backfilling
+    # content hashes (which deletes duplicate uploads) and moving inline images to the blob
+    # store only happen here
+    os.environ["SIGNATURE_DB_PATH"] = args.db
+    from db_manager import cursor, BLOB_STORE, PENDING_MIGRATIONS, backfill_content_hashes, move_images_to_blob_store
+
+    if not PENDING_MIGRATIONS:
+        print(f"{args.db} is up to date")
+    if "content hashes" in PENDING_MIGRATIONS:
+        duplicates = backfill_content_hashes(dry_run=args.dry_run)
+        print(f"{'Would delete' if args.dry_run else 'Deleted'} {len(duplicates)} duplicate signature rows"
+              + (f" (signature_ids {', '.join(map(str, duplicates))})" if duplicates else ""))
+    if "blob store" in PENDING_MIGRATIONS and not args.dry_run:
+        print(f"Moved {move_images_to_blob_store()} images to {BLOB_STORE}")
+
+    cursor.execute("SELECT COUNT(*), COUNT(content_hash), SUM(length(image_data) = 0) FROM Signatures")
+    total, hashed, external = cursor.fetchone()
+    print(f"{args.db}: {hashed}/{total} signatures have a content hash, "
+          f"{external or 0}/{total} images are in {BLOB_STORE}")
+
+if __name__ == "__main__":
+    main()
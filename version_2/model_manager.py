@@ -0,0 +1,60 @@
+import threading
+import time
+
+class ModelManager:
+    """
+    Loads a model on a background thread the first time it is needed.
+
+    The load function should import TensorFlow itself, so importing this module (and
+    showing a window) stays fast. Anything the load function returns (e.g. a tuple of
+    split models) is handed back by get().
+
+    Args:
+        load (callable): Loads, warms up and returns the model.
+        name (str): Name used in error messages.
+    """
+
+    def __init__(self, load, name="model"):
+        self.load = load
+        self.name = name
+        self.value = None
+        self.error = None
+        self.load_seconds = None  # Time spent in load, including warmup
+        self._thread = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def start(self):
+        # Start loading in the background (does nothing if already started)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._load, name=f"load-{self.name}", daemon=True)
+                self._thread.start()
+
+    @property
+    def done(self):
+        # True once loading finished, successfully or not
+        return self._done.is_set()
+
+    @property
+    def ready(self):
+        return self._done.is_set() and self.error is None
+
+    def get(self, timeout=None):
+        # Return the loaded model, starting the load and waiting for it if needed
+        self.start()
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Timed out waiting for the {self.name} to load")
+        if self.error is not None:
+            raise RuntimeError(f"Could not load the {self.name}: {self.error}") from self.error
+        return self.value
+
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            self.value = self.load()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.load_seconds = time.perf_counter() - start
+            self._done.set()
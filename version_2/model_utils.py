@@ -0,0 +1,102 @@
+import os
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.models import Model, load_model
+from tensorflow.keras.layers import Input, Flatten, Lambda
+from signature_utils import takes_uint8_images, model_images
+
+def load_similarity_model(model_path, uint8_input=False):
+    # Load a trained siamese model without its training configuration, optionally wrapped
+    # to take uint8 grayscale images (see add_uint8_input)
+    model = load_model(model_path, compile=False)
+    if uint8_input and not takes_uint8_images(model):
+        model = add_uint8_input(model)
+    return model
+
+def add_uint8_input(model):
+    """
+    Wraps a model taking normalized float32 RGB images so it takes uint8 grayscale images.
+
+    Every (H, W, 3) image input is replaced by a uint8 (H, W, 1) input; the cast, the division
+    by 255 and the channel replication run in the graph. For grayscale scans this gives the
+    same values as load_img's RGB conversion, while host batches are 12x smaller than
+    float32 RGB. Other inputs (e.g. the embeddings of the comparison head) are passed through.
+    Works on existing .h5 models without retraining.
+
+    Args:
+        model (Model): Similarity model or embedding tower.
+
+    Returns:
+        Model: Model with the same outputs and input names.
+    """
+    names = list(getattr(model, "input_names", None) or [tensor.name.split(":")[0] for tensor in model.inputs])
+    inputs, forwarded = [], []
+    for name, tensor in zip(names, model.inputs):
+        shape = tuple(tensor.shape[1:])
+        if len(shape) == 3 and shape[-1] == 3:
+            image = Input(shape=(*shape[:2], 1), dtype="uint8", name=name)
+            inputs.append(image)
+            forwarded.append(Lambda(lambda images: tf.image.grayscale_to_rgb(tf.cast(images, tf.float32) / 255.0),
+                                    output_shape=shape, name=f"{name}_to_rgb")(image))
+        else:
+            passthrough = Input(shape=shape, dtype=tensor.dtype, name=name)
+            inputs.append(passthrough)
+            forwarded.append(passthrough)
+    outputs = model(forwarded if len(forwarded) > 1 else forwarded[0])
+    return Model(inputs if len(inputs) > 1 else inputs[0], outputs, name=f"{model.name}_uint8")
+
+def model_tag(model_path):
+    # Identify a model file so cached embeddings can be invalidated when it changes
+    return f"{os.path.basename(model_path)}:{int(os.path.getmtime(model_path))}"
+
+def split_similarity_model(model):
+    """
+    Splits a shared-tower siamese model into its embedding tower and comparison head.
+
+    Works for the train6_2inputs model (create_base_model tower + abs diff head) and the
+    train4_2inputs/train5 models (VGG16 tower + Flatten + distance head).
+
+    Args:
+        model (Model): Trained two-input similarity model.
+
+    Returns:
+        tuple: (embedding_model, head_model). embedding_model maps one image batch to
+        embedding vectors; head_model maps two embedding batches to similarity scores.
+    """
+    if takes_uint8_images(model):
+        # Wrapped by add_uint8_input: split the wrapped model and give its tower the same adapter
+        embedding_model, head_model = split_similarity_model(
+            next(layer for layer in model.layers if isinstance(layer, Model)))
+        return add_uint8_input(embedding_model), head_model
+
+    # The shared tower is the nested model both inputs are passed through
+    tower = next((layer for layer in model.layers if isinstance(layer, Model)), None)
+    if tower is None:
+        raise ValueError("Model has no shared embedding tower")
+
+    embedding = tower.output
+    if len(embedding.shape) > 2:  # train4/train5 flatten the VGG16 feature maps after the tower
+        embedding = Flatten()(embedding)
+    embedding_model = Model(tower.input, embedding, name="embedding_tower")
+
+    # The head starts at the Lambda layer that merges both embeddings
+    merge_index = next((i for i, layer in enumerate(model.layers) if isinstance(layer, Lambda)), None)
+    if merge_index is None:
+        raise ValueError("Model has no Lambda layer merging the two embeddings")
+
+    embedding_shape = embedding_model.output_shape[1:]
+    embedding_1 = Input(shape=embedding_shape, name="embedding1")
+    embedding_2 = Input(shape=embedding_shape, name="embedding2")
+    x = model.layers[merge_index]([embedding_1, embedding_2])
+    for layer in model.layers[merge_index + 1:]:
+        x = layer(x)
+    head_model = Model([embedding_1, embedding_2], x, name="comparison_head")
+
+    return embedding_model, head_model
+
+def warm_up_models(embedding_model, head_model, image_size=(224, 224)):
+    # Run one dummy batch through both parts so the first real prediction doesn't pay for
+    # building the predict function
+    images = model_images(np.zeros((1, *image_size), dtype=np.uint8), embedding_model)
+    embedding = embedding_model.predict_on_batch(images)
+    head_model.predict_on_batch([embedding, embedding])
@@ -0,0 +1,186 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+import numpy as np
+from instrumentation import count
+
+# Set SIGNATURE_CACHE_DIR to an empty string to disable the cache
+CACHE_DIR = os.environ.get("SIGNATURE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "signature_verification"))
+SHARD_SIZE = 1024
+FLUSH_EVERY = 256
+# Slots reserved from the shared counter at a time, so the inter-process lock is taken once per block
+SLOT_BLOCK = 64
+
+# Open caches, so every loader of one pipeline shares the same index
+_caches = {}
+_caches_lock = threading.Lock()
+
+@contextmanager
+def file_lock(lock_path):
+    # Exclusive lock between processes (held on the first byte of lock_path)
+    with open(lock_path, "a+b") as file:
+        if os.name == "nt":
+            import msvcrt
+            file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after 10 seconds; keep waiting
+                    continue
+            try:
+                yield
+            finally:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+class PreprocessCache:
+    """
+    On-disk cache of resized uint8 image tensors stored in memory-mapped .npy shards.
+
+    Each cached image is keyed by its absolute path, mtime and size; the preprocessing
+    parameters select the store directory, so changing any of them misses the cache and
+    the image is decoded again. The cache is safe to share between threads and processes:
+    slots are reserved from a counter file, shards are created and the index is merged
+    and written under an inter-process file lock, and slots are never reused, so an
+    entry only becomes visible once its pixels are flushed.
+
+    Args:
+        cache_dir (str): Root folder of the cache.
+        name (str): Name of the preprocessing pipeline using the cache.
+        decode (callable): Maps an image path to a uint8 array of image_shape, or None on failure.
+        image_shape (tuple): Shape of every cached image, e.g. (224, 224, 3).
+        params (dict): Preprocessing parameters that affect the decoded pixels.
+    """
+
+    def __init__(self, cache_dir, name, decode, image_shape, params=None):
+        self.decode = decode
+        self.image_shape = tuple(image_shape)
+        params = dict(params or {}, image_shape=list(self.image_shape))
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+        self.store_dir = os.path.join(cache_dir, f"{name}-{digest}")
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.index_path = os.path.join(self.store_dir, "index.json")
+        self.slot_path = os.path.join(self.store_dir, "next_slot")
+        self.lock_path = os.path.join(self.store_dir, "lock")
+
+        self.lock = threading.Lock()
+        self.shards = {}
+        self.pending = {}  # Entries written since the last flush
+        self.entries = self._read_index()  # path -> [mtime_ns, size, slot]
+        self.next_slot = self.slot_limit = 0  # Reserved block [next_slot, slot_limit)
+        atexit.register(self.flush)
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path) as file:
+            return json.load(file)
+
+    def _reserve_slots(self):
+        # Reserve the next SLOT_BLOCK slots of the store for this process
+        with file_lock(self.lock_path):
+            if os.path.exists(self.slot_path):
+                with open(self.slot_path) as file:
+                    start = int(file.read())
+            else:  # Store written before the counter existed
+                start = max((entry[2] for entry in self._read_index().values()), default=-1) + 1
+            with open(self.slot_path, "w") as file:
+                file.write(str(start + SLOT_BLOCK))
+        self.next_slot, self.slot_limit = start, start + SLOT_BLOCK
+
+    def _shard(self, slot):
+        shard_index = slot // SHARD_SIZE
+        if shard_index not in self.shards:
+            shard_path = os.path.join(self.store_dir, f"shard_{shard_index:05d}.npy")
+            with file_lock(self.lock_path):  # Another process may be creating the same shard
+                if os.path.exists(shard_path):
+                    self.shards[shard_index] = np.load(shard_path, mmap_mode="r+")
+                else:
+                    self.shards[shard_index] = np.lib.format.open_memmap(
+                        shard_path, mode="w+", dtype=np.uint8, shape=(SHARD_SIZE, *self.image_shape))
+        return self.shards[shard_index], slot % SHARD_SIZE
+
+    def get(self, image_path):
+        # Return the cached uint8 image, decoding and storing it on a miss
+        image_path = os.path.abspath(image_path)
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        key = [stat.st_mtime_ns, stat.st_size]
+
+        with self.lock:
+            entry = self.entries.get(image_path)
+            if entry is not None and entry[:2] == key:
+                count("preprocess_cache.hits")
+                shard, offset = self._shard(entry[2])
+                return np.array(shard[offset])
+
+        count("preprocess_cache.misses")
+
+        image = self.decode(image_path)
+        if image is None:
+            return None
+        image = np.asarray(image, dtype=np.uint8).reshape(self.image_shape)
+
+        with self.lock:
+            # Always a fresh slot: an existing one may be read by another process
+            if self.next_slot == self.slot_limit:
+                self._reserve_slots()
+            slot = self.next_slot
+            self.next_slot += 1
+            shard, offset = self._shard(slot)
+            shard[offset] = image
+            self.entries[image_path] = self.pending[image_path] = key + [slot]
+            if len(self.pending) >= FLUSH_EVERY:
+                self._flush_locked()
+        return image
+
+    def flush(self):
+        # Persist pending shard writes and the index
+        with self.lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self.pending:
+            return
+        for shard in self.shards.values():
+            shard.flush()
+        # Merge with entries other processes wrote since the index was read
+        with file_lock(self.lock_path):
+            entries = self._read_index()
+            entries.update(self.pending)
+            temp_path = self.index_path + f".{os.getpid()}.tmp"
+            with open(temp_path, "w") as file:
+                json.dump(entries, file)
+            os.replace(temp_path, self.index_path)
+        self.entries = entries
+        self.pending = {}
+
+def cached_loader(name, decode, image_shape, params=None, cache_dir=None):
+    """
+    Wraps an image decode function with the on-disk preprocessing cache.
+
+    Returns:
+        callable: Maps an image path to the uint8 image (or None if it cannot be decoded).
+        Falls back to calling decode directly when the cache is disabled.
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    if not cache_dir:
+        return decode
+    key = (os.path.abspath(cache_dir), name, tuple(image_shape), json.dumps(params or {}, sort_keys=True))
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = PreprocessCache(cache_dir, name, decode, image_shape, params)
+        return _caches[key].get
@@ -0,0 +1,160 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+from instrumentation import timer, timed
+
+# Bump when decoding changes (color conversion, size, interpolation) so stored tensors,
+# cached images and embeddings produced by an older pipeline are recomputed. Pipelines are
+# keyed by all of their parameters, so adding one doesn't require a bump.
+PIPELINE_VERSION = 2  # 2: "nearest" samples pixel centres like PIL and tf.image.resize
+IMAGE_SIZE = (224, 224)
+COLOR_MODES = {"grayscale": cv2.IMREAD_GRAYSCALE, "rgb": cv2.IMREAD_COLOR, "bgr": cv2.IMREAD_COLOR}
+# INTER_NEAREST_EXACT picks the same pixels as load_img (PIL) and tf.image.resize "nearest";
+# cv2.INTER_NEAREST doesn't
+INTERPOLATIONS = {"nearest": cv2.INTER_NEAREST_EXACT, "linear": cv2.INTER_LINEAR}
+
+def make_pipeline(color_mode="grayscale", interpolation="nearest"):
+    # Parameters of a decoding pipeline; they key cached images and compiled datasets
+    if color_mode not in COLOR_MODES or interpolation not in INTERPOLATIONS:
+        raise ValueError(f"Unsupported pipeline: {color_mode}, {interpolation}")
+    return {"version": PIPELINE_VERSION, "color_mode": color_mode, "size": list(IMAGE_SIZE),
+            "interpolation": interpolation, "dtype": "uint8"}
+
+# Default pipeline: grayscale, nearest-neighbour resize (the resize of load_img,
+# flow_from_directory and tf.data), used by version_2, its stored tensors and new models
+PIPELINE = make_pipeline()
+# Legacy entry points keep the decoding their saved models were trained and evaluated with:
+# cv2.imread + cv2.resize (INTER_LINEAR) in grayscale (train0-2, test0, version_1) or in
+# BGR color (test1_vgg16, test2_onesignature), and load_img RGB (train4_2inputs, train5)
+CV2_GRAY_PIPELINE = make_pipeline("grayscale", "linear")
+CV2_COLOR_PIPELINE = make_pipeline("bgr", "linear")
+LOAD_IMG_PIPELINE = make_pipeline("rgb", "nearest")
+WORKERS = int(os.environ.get("SIGNATURE_PREPROCESS_WORKERS", min(8, os.cpu_count() or 1)))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    # Shared decode pool; cv2 releases the GIL while decoding and resizing
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="preprocess")
+        return _executor
+
+def pipeline_tag(tag, pipeline=PIPELINE):
+    # Tag of embeddings computed by a model from images of this pipeline
+    if pipeline == PIPELINE:
+        return f"{tag}:pipeline{PIPELINE_VERSION}"
+    return f"{tag}:pipeline{PIPELINE_VERSION}-{pipeline['color_mode']}-{pipeline['interpolation']}"
+
+def image_shape(pipeline=PIPELINE):
+    # Shape of one image decoded by the pipeline
+    return IMAGE_SIZE if pipeline["color_mode"] == "grayscale" else (*IMAGE_SIZE, 3)
+
+def read_source(source):
+    # Encoded bytes of a path, bytes-like object or blob_store.SignatureHandle, or None if a file can't be read
+    if isinstance(source, (str, os.PathLike)):
+        try:
+            return np.fromfile(source, dtype=np.uint8)  # Unlike cv2.imread, works with non-ASCII Windows paths
+        except OSError:
+            return None
+    if hasattr(source, "read"):
+        source = source.read()
+    return np.frombuffer(source, dtype=np.uint8)
+
+# cv2 conversion of a decoded (grayscale, RGB or RGBA) array to a color mode, by channel count
+_ARRAY_CONVERSIONS = {
+    (1, "rgb"): cv2.COLOR_GRAY2RGB, (1, "bgr"): cv2.COLOR_GRAY2BGR,
+    (3, "grayscale"): cv2.COLOR_RGB2GRAY, (3, "bgr"): cv2.COLOR_RGB2BGR,
+    (4, "grayscale"): cv2.COLOR_RGBA2GRAY, (4, "rgb"): cv2.COLOR_RGBA2RGB, (4, "bgr"): cv2.COLOR_RGBA2BGR,
+}
+
+def decode_image(source, out=None, pipeline=PIPELINE):
+    """
+    Decodes one image with a pipeline.
+
+    Args:
+        source: File path, bytes/bytearray/memoryview of an encoded image, SignatureHandle,
+            or an already decoded grayscale (H, W) or RGB (H, W, 3) uint8 array.
+        out (np.ndarray): Optional uint8 array of image_shape(pipeline) the result is written into.
+        pipeline (dict): Pipeline from make_pipeline (defaults to PIPELINE).
+
+    Returns:
+        np.ndarray: uint8 (224, 224) grayscale or (224, 224, 3) color image (out if given),
+        or None if the source can't be read or decoded.
+    """
+    color_mode = pipeline["color_mode"]
+    if isinstance(source, np.ndarray) and source.ndim > 1:  # Decoded image
+        image = source[..., 0] if source.ndim == 3 and source.shape[-1] == 1 else source
+        conversion = _ARRAY_CONVERSIONS.get((1 if image.ndim == 2 else image.shape[-1], color_mode))
+        if conversion is not None:
+            image = cv2.cvtColor(image, conversion)
+    else:
+        data = read_source(source)
+        if data is None or not data.size:
+            return None
+        with timer("decode.imdecode"):
+            image = cv2.imdecode(data, COLOR_MODES[color_mode])
+        if image is None:
+            return None
+        if color_mode == "rgb":
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    with timer("decode.resize"):
+        return cv2.resize(image, IMAGE_SIZE, dst=out, interpolation=INTERPOLATIONS[pipeline["interpolation"]])
+
+@timed("preprocess_batch")
+def decode_batch(sources, out=None, executor=None, pipeline=PIPELINE):
+    """
+    Decodes a batch of images on a thread pool into one preallocated array.
+
+    Args:
+        sources (list): Anything decode_image accepts, mixed freely.
+        out (np.ndarray): Optional uint8 (N, *image_shape(pipeline)) array (e.g. a memmap) to fill.
+        executor (Executor): Thread pool to decode on (defaults to the shared pool).
+        pipeline (dict): Pipeline from make_pipeline (defaults to PIPELINE).
+
+    Returns:
+        tuple: (images, ok). images is the uint8 (N, 224, 224) grayscale or (N, 224, 224, 3)
+        color batch; ok is a bool array marking the rows that were decoded (the others are zero).
+    """
+    sources = list(sources)
+    images = np.empty((len(sources), *image_shape(pipeline)), dtype=np.uint8) if out is None else out
+    ok = np.zeros(len(sources), dtype=bool)
+
+    def decode(i):
+        ok[i] = decode_image(sources[i], images[i], pipeline) is not None
+
+    if executor is None and (len(sources) == 1 or WORKERS == 1):  # Not worth a thread handoff
+        for i in range(len(sources)):
+            decode(i)
+    elif sources:
+        list((executor or get_executor()).map(decode, range(len(sources))))
+    images[~ok] = 0
+    return images, ok
+
+def preprocess_batch(sources, out=None, executor=None, pipeline=PIPELINE):
+    # Like decode_batch, but raises ValueError if any image can't be decoded
+    sources = list(sources)
+    images, ok = decode_batch(sources, out, executor, pipeline)
+    if not ok.all():
+        source = sources[int(np.argmin(ok))]
+        raise ValueError(f"Could not load image: {source}" if isinstance(source, (str, os.PathLike))
+                         else "Could not decode signature image")
+    return images
+
+def to_float(images, channels=3):
+    # Normalize uint8 images to float32 in [0, 1]; grayscale images get the given number of
+    # channels (3 for the VGG16-based models, 1 for the single-channel CNNs), color images keep theirs
+    images = np.asarray(images)
+    if images.ndim == 4 and images.shape[-1] == channels:  # Already has its channels (e.g. an RGB bank)
+        result = images.astype(np.float32)
+    else:
+        if images.ndim == 4:
+            images = images[..., 0]
+        result = np.empty((*images.shape, channels), dtype=np.float32)
+        result[...] = images[..., np.newaxis]
+    result /= 255.0
+    return result
@@ -0,0 +1,28 @@
+from db_manager import get_signature_embeddings, set_signature_embedding, get_signature_tensors
+from signature_utils import embed_signatures, embedding_to_blob, blob_to_embedding
+
+def load_reference_embeddings(user_id, embedding_model, tag):
+    """
+    Loads the cached embeddings of a user's enrolled signatures.
+
+    Embeddings missing or computed by another model (a different tag) are computed in one
+    batch from the stored model-ready tensors and cached in the database.
+
+    Args:
+        user_id (int): User whose signatures are loaded.
+        embedding_model (Model): Embedding tower (Keras or inference_backend.TFLiteModel).
+        tag (str): Identifies embedding_model (see inference_backend.load_inference_models).
+
+    Returns:
+        list: One float32 embedding per signature, ordered by signature_id.
+    """
+    rows = get_signature_embeddings(user_id, tag)
+    stale_ids = [signature_id for signature_id, embedding, _ in rows if embedding is None]
+    computed = {}
+    if stale_ids:
+        tensors = get_signature_tensors(user_id, stale_ids)
+        for signature_id, embedding in zip(stale_ids, embed_signatures(tensors, embedding_model)):
+            computed[signature_id] = embedding_to_blob(embedding)
+            set_signature_embedding(signature_id, computed[signature_id], tag)
+    return [blob_to_embedding(embedding if embedding is not None else computed[signature_id])
+            for signature_id, embedding, _ in rows]
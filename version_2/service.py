@@ -0,0 +1,319 @@
+import argparse
+import base64
+import json
+import os
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from signature_utils import signature_tensor_batch, model_images, aggregate_scores, embedding_to_blob
+import instrumentation
+
+HEAD_BATCH_SIZE = 4096
+LATENCY_WINDOW = 10000  # Latency samples kept per endpoint
+
+class MicroBatcher:
+    """
+    Collects images from concurrent requests into batches for the embedding tower.
+
+    A batch is run as soon as max_batch_size images are waiting, or max_wait_ms after
+    its first image arrived, whichever comes first. Only the batcher thread calls the model.
+
+    Args:
+        model: Embedding tower (anything with predict_on_batch). Images are queued as uint8
+            tensors and converted to the model's input per batch (see model_images).
+        max_batch_size (int): Largest batch sent to the model.
+        max_wait_ms (float): Longest time the first image of a batch waits for others.
+    """
+
+    def __init__(self, model, max_batch_size=32, max_wait_ms=5.0):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.max_queue_depth = 0
+        self.batches = 0
+        self.batched_images = 0
+        self.thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self.thread.start()
+
+    def embed(self, images):
+        # Embed preprocessed images, blocking until their batches have run
+        futures = []
+        for image in images:
+            future = Future()
+            self.queue.put((image, future))
+            futures.append(future)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return np.stack([future.result() for future in futures])
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                with instrumentation.timer("model.embed_batch"):
+                    embeddings = self.model.predict_on_batch(model_images(np.stack([image for image, _ in batch]), self.model))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.batched_images += len(batch)
+            for (_, future), embedding in zip(batch, np.asarray(embeddings, dtype=np.float32)):
+                future.set_result(embedding)
+
+class LatencyStats:
+    # Request counts and latency percentiles per endpoint over the last LATENCY_WINDOW requests
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self.counts = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def record(self, endpoint, seconds, ok):
+        with self.lock:
+            self.samples[endpoint].append(seconds)
+            self.counts[endpoint] += 1
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def snapshot(self):
+        with self.lock:
+            stats = {}
+            for endpoint, samples in self.samples.items():
+                p50, p95, p99 = np.percentile(np.asarray(samples) * 1000, [50, 95, 99])
+                stats[endpoint] = {"count": self.counts[endpoint], "errors": self.errors[endpoint],
+                                   "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+            return stats
+
+class VerificationService:
+    """
+    Enrollment, 1:1 verification and 1:N identification around one long-lived model.
+
+    Query and enrollment images go through a shared MicroBatcher. Reference embeddings
+    are loaded from the database once per user and kept in memory until the user enrolls
+    new signatures. The database connection of db_manager is shared by all request
+    threads and used under a lock, which also covers loading references into the cache so
+    an enrollment can't be overwritten by references read just before it.
+
+    Each endpoint has a parse_* method that decodes the request payload (ValueError,
+    KeyError or TypeError for a bad request) and a method that serves the decoded request.
+
+    Args:
+        model_path (str): .h5 model or export_model.py folder (see inference_backend).
+        max_batch_size (int): Micro-batch size limit.
+        max_wait_ms (float): Micro-batch wait limit.
+        uint8_input (bool): Wrap a Keras tower with model_utils.add_uint8_input.
+    """
+
+    def __init__(self, model_path, max_batch_size=32, max_wait_ms=5.0, uint8_input=False):
+        # Imported here so SIGNATURE_DB_PATH can be set before the database is opened
+        import db_manager
+        from inference_backend import load_inference_models
+        from model_utils import warm_up_models
+        from reference_embeddings import load_reference_embeddings
+        self.db = db_manager
+        self.load_reference_embeddings = load_reference_embeddings
+
+        self.embedding_model, self.head_model, self.tag = load_inference_models(model_path, uint8_input=uint8_input)
+        warm_up_models(self.embedding_model, self.head_model)
+        self.batcher = MicroBatcher(self.embedding_model, max_batch_size, max_wait_ms)
+        self.stats = LatencyStats()
+        self.started = time.time()
+        self.db_lock = threading.Lock()
+        self.head_lock = threading.Lock()
+        self.references = {}  # user_id -> float32 (N, D) embeddings
+
+    def decode(self, encoded_image):
+        # Base64 image file -> uint8 (224, 224) grayscale tensor
+        return signature_tensor_batch([base64.b64decode(encoded_image)])[0]
+
+    def user_references(self, user_id):
+        embeddings = self.references.get(user_id)
+        if embeddings is None:
+            with self.db_lock:
+                embeddings = self.references.get(user_id)  # Loaded by another thread meanwhile
+                if embeddings is None:
+                    embeddings = self.load_reference_embeddings(user_id, self.embedding_model, self.tag)
+                    embeddings = np.asarray(embeddings, dtype=np.float32) if embeddings else np.empty((0, 0), np.float32)
+                    self.references[user_id] = embeddings
+        return embeddings
+
+    def score(self, query_embedding, reference_embeddings):
+        # Score one query embedding against many references with the comparison head
+        scores = np.empty(len(reference_embeddings), dtype=np.float32)
+        with self.head_lock:
+            for start in range(0, len(reference_embeddings), HEAD_BATCH_SIZE):
+                references = reference_embeddings[start:start + HEAD_BATCH_SIZE]
+                queries = np.broadcast_to(query_embedding, references.shape)
+                scores[start:start + len(references)] = self.head_model.predict_on_batch([queries, references]).reshape(-1)
+        return scores
+
+    def parse_enroll(self, request):
+        # {"name", "email", "images": [base64, ...]}
+        encoded_images = [base64.b64decode(image) for image in request["images"]]
+        return {"name": str(request["name"]), "email": str(request["email"]),
+                "encoded_images": encoded_images, "images": signature_tensor_batch(encoded_images)}
+
+    def enroll(self, request):
+        # -> {"user_id", "added"}
+        embeddings = self.batcher.embed(request["images"])
+        with self.db_lock:
+            user_ids, added, _ = self.db.enroll_users_bulk([(request["name"], request["email"], [
+                (image, embedding_to_blob(embedding), self.tag)
+                for image, embedding in zip(request["encoded_images"], embeddings)])])
+            user_id = user_ids[request["email"]]
+            self.references.pop(user_id, None)
+        return {"user_id": user_id, "added": added}
+
+    def parse_verify(self, request):
+        # {"user_id", "image", "threshold"?, "top_k"?}
+        return {"user_id": int(request["user_id"]), "image": self.decode(request["image"]),
+                "threshold": float(request.get("threshold", 0.5)), "top_k": int(request.get("top_k", 3))}
+
+    def verify(self, request):
+        # -> score aggregates
+        user_id = request["user_id"]
+        references = self.user_references(user_id)
+        if not len(references):
+            raise LookupError(f"No genuine signatures found for user {user_id}")
+        query_embedding = self.batcher.embed(request["image"][np.newaxis])[0]
+        result = aggregate_scores(self.score(query_embedding, references), request["threshold"], request["top_k"])
+        return {"user_id": user_id, "is_verified": bool(result["is_verified"]), "max_score": result["max_score"],
+                "top_k_mean": result["top_k_mean"], "top_k_scores": result["top_k_scores"].tolist()}
+
+    def parse_identify(self, request):
+        # {"image", "top_k"?}
+        return {"image": self.decode(request["image"]), "top_k": int(request.get("top_k", 5))}
+
+    def identify(self, request):
+        # -> best scoring users, best score per user
+        with self.db_lock:
+            users = self.db.get_users()
+        query_embedding = self.batcher.embed(request["image"][np.newaxis])[0]
+        matches = []
+        for user_id, name in users:
+            references = self.user_references(user_id)
+            if len(references):
+                matches.append((user_id, name, references))
+        if not matches:
+            return {"matches": []}
+
+        scores = self.score(query_embedding, np.concatenate([references for _, _, references in matches]))
+        ends = np.cumsum([len(references) for _, _, references in matches])
+        best = [float(user_scores.max()) for user_scores in np.split(scores, ends[:-1])]
+        order = np.argsort(best)[::-1][:request["top_k"]]
+        return {"matches": [{"user_id": matches[i][0], "name": matches[i][1], "score": best[i]} for i in order]}
+
+    def metrics(self):
+        return {
+            "endpoints": self.stats.snapshot(),
+            "queue_depth": self.batcher.queue.qsize(),
+            "max_queue_depth": self.batcher.max_queue_depth,
+            "batches": self.batcher.batches,
+            "mean_batch_size": self.batcher.batched_images / self.batcher.batches if self.batcher.batches else 0.0,
+            "cached_users": len(self.references),
+            "uptime_s": time.time() - self.started,
+            "stages": instrumentation.snapshot() if instrumentation.ENABLED else None,
+        }
+
+class RequestHandler(BaseHTTPRequestHandler):
+    # POST /enroll, /verify and /identify take and return JSON; GET /metrics, /metrics/prometheus
+    # (stage timings, with SIGNATURE_PROFILE set) and /health
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == "/metrics":
+            self.send_json(200, service.metrics())
+        elif self.path == "/metrics/prometheus":
+            data = instrumentation.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif self.path == "/health":
+            self.send_json(200, {"status": "ok", "model": service.tag})
+        else:
+            self.send_json(404, {"error": f"Unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        service = self.server.service
+        endpoint = {"/enroll": (service.parse_enroll, service.enroll),
+                    "/verify": (service.parse_verify, service.verify),
+                    "/identify": (service.parse_identify, service.identify)}.get(self.path)
+        if endpoint is None:
+            self.send_json(404, {"error": f"Unknown endpoint {self.path}"})
+            return
+
+        parse, serve = endpoint
+        start = time.perf_counter()
+        status = 200
+        try:
+            request = parse(json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0)))))
+        except (ValueError, KeyError, TypeError) as e:  # Malformed JSON, missing fields, undecodable images
+            status, response = 400, {"error": f"Bad request: {e}"}
+        if status == 200:
+            try:
+                response = serve(request)
+            except LookupError as e:  # Unknown user or no enrolled signatures
+                status, response = 404, {"error": str(e)}
+            except Exception as e:
+                status, response = 500, {"error": str(e)}
+        service.stats.record(self.path, time.perf_counter() - start, status == 200)
+        self.send_json(status, response)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Request logging would dominate the cost of small requests; see /metrics
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP signature verification service with micro-batching.")
+    parser.add_argument("--model", default=os.environ.get("SIGNATURE_MODEL_PATH", os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "signature_similarity_model.h5")),
+        help=".h5 model or export_model.py folder")
+    parser.add_argument("--db", default=None, help="Database file (default: SIGNATURE_DB_PATH or signature_verification2.db)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--uint8-input", action="store_true", help="Feed uint8 grayscale images to a Keras model through model_utils.add_uint8_input")
+    args = parser.parse_args()
+
+    if args.db:
+        os.environ["SIGNATURE_DB_PATH"] = args.db  # Must be set before db_manager is imported
+    service = VerificationService(args.model, args.max_batch_size, args.max_wait_ms, args.uint8_input)
+    server = ThreadingHTTPServer((args.host, args.port), RequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    print(f"Serving {service.tag} on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import zlib
+import numpy as np
+from preprocessing import PIPELINE_VERSION, IMAGE_SIZE, decode_image
+
+# Stored tensors are recomputed when the preprocessing pipeline changes
+PREPROCESS_VERSION = PIPELINE_VERSION
+TENSOR_SIZE = IMAGE_SIZE
+
+def signature_to_tensor(image_data):
+    # Decode a signature image (bytes or a SignatureHandle) into a 224x224 grayscale uint8 array
+    # with the preprocessing pipeline. Returns None if it can't be decoded.
+    return decode_image(image_data)
+
+def tensor_to_blob(tensor):
+    # Compress a 224x224 uint8 tensor for the SignatureTensors table
+    return zlib.compress(np.ascontiguousarray(tensor, dtype=np.uint8).tobytes())
+
+def blob_to_tensor(blob):
+    # Decompress a tensor stored by tensor_to_blob
+    return np.frombuffer(zlib.decompress(blob), dtype=np.uint8).reshape(TENSOR_SIZE)
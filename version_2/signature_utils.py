@@ -1,35 +1,229 @@
 import numpy as np
-import cv2
-from tensorflow.keras.preprocessing.image import load_img, img_to_array
+from concurrent.futures import ThreadPoolExecutor
+from tensorflow.keras.utils import Sequence
+from preprocess_cache import cached_loader
+from preprocessing import IMAGE_SIZE, PIPELINE, decode_image, preprocess_batch, to_float
+from instrumentation import timer, timed
+
+MAX_BATCH_SIZE = 32
+
+# Decoded images are cached on disk, keyed by path, mtime, size and the pipeline parameters
+load_cached_image = cached_loader("version_2", decode_image, IMAGE_SIZE, {"pipeline": PIPELINE})
 
 # Preprocess an image for VGG16 input
+@timed("preprocess_image")
 def preprocess_image(image_path):
-    image = load_img(image_path, target_size=(224, 224))
-    image = img_to_array(image)
-    image = image / 255.0  # Normalize
-    return image
+    # Normalized float32 (224, 224, 3) image from a file path or an already decoded image array
+    image = load_cached_image(image_path) if isinstance(image_path, str) else decode_image(image_path)
+    if image is None:
+        raise ValueError(f"Could not load image: {image_path}" if isinstance(image_path, str) else "Could not decode image")
+    return to_float(image[np.newaxis])[0]
+
+def signature_tensor_batch(genuine_signatures):
+    # Decode encoded signature images (bytes or SignatureHandles) into a uint8 (N, 224, 224)
+    # grayscale batch; stacked tensors from db_manager.get_signature_tensors are returned as is
+    if isinstance(genuine_signatures, np.ndarray):
+        return genuine_signatures
+    return preprocess_batch(genuine_signatures)
+
+@timed("preprocess_signatures")
+def preprocess_signatures(genuine_signatures):
+    # Build a normalized float32 batch from stored signatures. Accepts encoded images or the
+    # stacked uint8 tensors of db_manager.get_signature_tensors, which skip the decode entirely.
+    return bank_to_float(signature_tensor_batch(genuine_signatures), slice(None))
+
+def takes_uint8_images(model):
+    # True if the model's image input is the uint8 grayscale adapter of model_utils.add_uint8_input
+    if hasattr(model, "uint8_input"):  # inference_backend.TFLiteModel
+        return model.uint8_input
+    inputs = getattr(model, "inputs", None)
+    return bool(inputs) and getattr(inputs[0].dtype, "name", inputs[0].dtype) == "uint8"
+
+def model_images(images, model):
+    """
+    Converts an image batch to the input the model takes.
+
+    Models wrapped by model_utils.add_uint8_input take uint8 (N, 224, 224, 1) grayscale
+    images and normalize them in the graph; other models take normalized float32 RGB.
+
+    Args:
+        images (np.ndarray): uint8 (N, 224, 224) grayscale or (N, 224, 224, 3) RGB images,
+            or normalized float32 RGB images.
+        model: Keras model or inference_backend.TFLiteModel.
+
+    Returns:
+        np.ndarray: The batch to pass to model.predict_on_batch.
+    """
+    images = np.asarray(images)
+    if not takes_uint8_images(model):
+        return bank_to_float(images, slice(None)) if images.dtype == np.uint8 else images
+    if images.dtype != np.uint8:  # Normalized float images
+        images = np.rint(images * np.float32(255.0)).astype(np.uint8)
+    return bank_to_uint8(images, slice(None))
+
+def score_signatures(uploaded_signature, genuine_batch, model, max_batch_size=MAX_BATCH_SIZE):
+    # Score the uploaded signature against every reference, one forward call per chunk
+    uploaded_signature = np.asarray(uploaded_signature)
+    if uploaded_signature.ndim == 2 or (uploaded_signature.ndim == 3 and uploaded_signature.shape[-1] in (1, 3)):  # Single image
+        uploaded_signature = uploaded_signature[np.newaxis]
+    uploaded_signature = model_images(uploaded_signature, model)
+    genuine_batch = model_images(genuine_batch, model)
+    scores = np.empty(len(genuine_batch), dtype=np.float32)
+    for start in range(0, len(genuine_batch), max_batch_size):
+        references = genuine_batch[start:start + max_batch_size]
+        queries = np.broadcast_to(uploaded_signature, references.shape)
+        with timer("model.predict"):
+            scores[start:start + len(references)] = model.predict_on_batch([queries, references]).reshape(-1)
+    return scores
+
+def aggregate_scores(scores, threshold=0.5, top_k=3):
+    # Summarize per-reference similarity scores
+    top_scores = np.sort(scores)[::-1][:top_k]
+    max_score = float(top_scores[0])
+    return {
+        "scores": scores,
+        "max_score": max_score,
+        "top_k_scores": top_scores,
+        "top_k_mean": float(top_scores.mean()),
+        "is_verified": max_score > threshold,
+    }
+
+def verify_signature_batch(uploaded_signature, genuine_signatures, model, threshold=0.5,
+                           top_k=3, max_batch_size=MAX_BATCH_SIZE):
+    # Verify a signature against all stored signatures and return score aggregates
+    if not len(genuine_signatures):
+        raise ValueError("No genuine signatures to verify against")
+    # uint8 tensors are only expanded to float32 RGB for models without the uint8 adapter
+    genuine_batch = signature_tensor_batch(genuine_signatures)
+    scores = score_signatures(uploaded_signature, genuine_batch, model, max_batch_size)
+    return aggregate_scores(scores, threshold, top_k)
+
+@timed("model.embed")
+def embed_signatures(images, embedding_model, max_batch_size=MAX_BATCH_SIZE):
+    # Run the embedding tower over a batch of images (uint8 or preprocessed float, see model_images)
+    embeddings = [embedding_model.predict_on_batch(model_images(images[start:start + max_batch_size], embedding_model))
+                  for start in range(0, len(images), max_batch_size)]
+    return np.concatenate(embeddings).astype(np.float32)
+
+def embedding_to_blob(embedding):
+    # Serialize an embedding vector for the Signatures table
+    return np.asarray(embedding, dtype=np.float32).tobytes()
 
-def verify_signature(uploaded_signature, genuine_signatures, model, threshold=0.5):
-    # Verify a signature against stored signatures
-    similarity_scores = []
-    for genuine_image_data in genuine_signatures:
-        genuine_image = np.frombuffer(genuine_image_data, dtype=np.uint8)
-        genuine_image = cv2.imdecode(genuine_image, cv2.IMREAD_GRAYSCALE)
-        genuine_image = preprocess_image(genuine_image)
+def blob_to_embedding(blob):
+    # Deserialize an embedding vector stored by embedding_to_blob
+    return np.frombuffer(blob, dtype=np.float32)
 
-        similarity = model.predict([uploaded_signature, genuine_image])[0][0]
-        similarity_scores.append(similarity)
+def verify_signature_embeddings(query_embedding, reference_embeddings, head_model, threshold=0.5,
+                                top_k=3, max_batch_size=MAX_BATCH_SIZE):
+    # Verify a query embedding against cached reference embeddings using only the comparison head
+    if not len(reference_embeddings):
+        raise ValueError("No genuine signatures to verify against")
+    reference_embeddings = np.asarray(reference_embeddings, dtype=np.float32)
+    query_embedding = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+    scores = np.empty(len(reference_embeddings), dtype=np.float32)
+    for start in range(0, len(reference_embeddings), max_batch_size):
+        references = reference_embeddings[start:start + max_batch_size]
+        queries = np.broadcast_to(query_embedding, references.shape)
+        with timer("model.head"):
+            scores[start:start + len(references)] = head_model.predict_on_batch([queries, references]).reshape(-1)
+    return aggregate_scores(scores, threshold, top_k)
 
-    max_score = max(similarity_scores)
-    return max_score, max_score > threshold
+@timed("verify_signature")
+def verify_signature(uploaded_signature, genuine_signatures, model, threshold=0.5,
+                     max_batch_size=MAX_BATCH_SIZE):
+    # Verify a signature against stored signatures. model can be a Keras model or any backend
+    # with predict_on_batch, e.g. a whole-model export from inference_backend.load_pair_model
+    result = verify_signature_batch(uploaded_signature, genuine_signatures, model, threshold,
+                                    max_batch_size=max_batch_size)
+    return result["max_score"], result["is_verified"]
 
 # Load pairs of images and their labels
-def load_pairs(pairs, labels):
-    X1, X2, y = [], [], []
-    for img1_path, img2_path in pairs:
-        img1 = preprocess_image(img1_path)
-        img2 = preprocess_image(img2_path)
-        X1.append(img1)
-        X2.append(img2)
-        y.append(labels.pop(0))
-    return np.array(X1), np.array(X2), np.array(y)
+def load_pairs(pairs, labels, workers=8):
+    image_bank, index1, index2, y = load_pair_indices(pairs, labels, workers)
+    return bank_to_float(image_bank, index1), bank_to_float(image_bank, index2), y
+
+def load_image_bank(image_paths, workers=8):
+    # Decode each image exactly once into a preallocated uint8 grayscale bank
+    image_bank = np.empty((len(image_paths), *IMAGE_SIZE), dtype=np.uint8)
+
+    def decode(i):
+        image = load_cached_image(image_paths[i])
+        if image is None:
+            raise ValueError(f"Could not load image: {image_paths[i]}")
+        image_bank[i] = image
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if load_cached_image is decode_image:  # Cache disabled: decode straight into the bank
+            return preprocess_batch(image_paths, image_bank, executor)
+        list(executor.map(decode, range(len(image_paths))))
+    return image_bank
+
+def load_pair_indices(pairs, labels, workers=8):
+    """
+    Loads image pairs as indices into a bank of unique decoded images.
+
+    Every unique path is decoded once (on a thread pool), however many pairs it is part of.
+
+    Returns:
+        tuple: (image_bank, index1, index2, y) where image_bank is a uint8 grayscale
+        (n_unique, 224, 224) array and index1/index2 are int32 arrays of bank rows.
+    """
+    unique_paths = list(dict.fromkeys(path for pair in pairs for path in pair))
+    path_index = {path: i for i, path in enumerate(unique_paths)}
+    index1 = np.fromiter((path_index[img1_path] for img1_path, _ in pairs), dtype=np.int32, count=len(pairs))
+    index2 = np.fromiter((path_index[img2_path] for _, img2_path in pairs), dtype=np.int32, count=len(pairs))
+    return load_image_bank(unique_paths, workers), index1, index2, np.asarray(labels)
+
+def bank_to_float(image_bank, indices):
+    # Materialize normalized float32 RGB images for the given bank rows (grayscale banks are
+    # replicated to 3 channels)
+    return to_float(image_bank[indices])
+
+def bank_to_uint8(image_bank, indices):
+    # Gather uint8 (N, 224, 224, 1) grayscale images for models with the uint8 input adapter.
+    # RGB banks hold decoded grayscale scans, so their channels are equal and the first is kept.
+    images = image_bank[indices]
+    if images.ndim == 4:
+        images = images[..., :1]
+    return images.reshape(*images.shape[:3], 1)
+
+class PairBatchSequence(Sequence):
+    """
+    Keras Sequence over image pairs stored as indices into a uint8 image bank.
+
+    Only the current batch is converted to float32, so memory stays at the size of
+    the unique uint8 images instead of two float32 copies per pair. With input_names,
+    batches are dicts keyed by the model input names (e.g. "signature1", "signature2").
+    With uint8_input, batches stay uint8 grayscale for a model wrapped by
+    model_utils.add_uint8_input, which normalizes them in the graph.
+    """
+
+    def __init__(self, image_bank, index1, index2, labels, batch_size=32, shuffle=True, seed=None,
+                 input_names=None, uint8_input=False, **kwargs):
+        super().__init__(**kwargs)
+        self.image_bank = image_bank
+        self.index1 = index1
+        self.index2 = index2
+        self.labels = labels
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.input_names = input_names
+        self.to_batch = bank_to_uint8 if uint8_input else bank_to_float
+        self.rng = np.random.default_rng(seed)
+        self.order = np.arange(len(labels))
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(len(self.labels) / self.batch_size))
+
+    def __getitem__(self, index):
+        batch = self.order[index * self.batch_size:(index + 1) * self.batch_size]
+        x1 = self.to_batch(self.image_bank, self.index1[batch])
+        x2 = self.to_batch(self.image_bank, self.index2[batch])
+        if self.input_names:
+            return dict(zip(self.input_names, (x1, x2))), self.labels[batch]
+        return (x1, x2), self.labels[batch]
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.rng.shuffle(self.order)
@@ -4,16 +4,43 @@ from tensorflow.keras.layers import Input, Dense, Flatten, Lambda
 import tensorflow as tf
 import matplotlib.pyplot as plt
 from data_preparation import prepare_data
-from signature_utils import load_pairs
+from signature_utils import load_pair_indices, PairBatchSequence
+from compile_dataset import CompiledDataset
+from model_utils import add_uint8_input
 from tensorflow.keras.callbacks import EarlyStopping
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image_utils"))
+from count_images import DatasetIndex
 
 # Directories for training data
 train_genuine_dir = 'C:/Users/krisa/Desktop/CPRO 2902/signature_verification_dataset2/train/genuine'
 train_forged_dir = 'C:/Users/krisa/Desktop/CPRO 2902/signature_verification_dataset2/train/forged'
 
-# Prepare training data
-train_pairs, train_labels = prepare_data(train_genuine_dir, train_forged_dir)
-X1_train, X2_train, y_train = load_pairs(train_pairs, train_labels)
+# Output folder of compile_dataset.py; when set, training reads the memmap instead of the folders above
+compiled_dataset_dir = None
+
+# Feed uint8 grayscale batches and normalize them in the graph (model_utils.add_uint8_input)
+uint8_input = False
+
+if compiled_dataset_dir:
+    # Hold out the last 30% of the pairs for validation (same split as validation_split=0.3)
+    train_sequence, validation_sequence = CompiledDataset(compiled_dataset_dir).sequences(validation_fraction=0.3, batch_size=32,
+                                                                                          uint8_input=uint8_input)
+else:
+    # Prepare training data (each unique image is decoded once into a uint8 bank)
+    # Folder listings come from the cached dataset index (image_utils/count_images.py)
+    dataset_index = DatasetIndex(os.path.dirname(train_genuine_dir))
+    train_pairs, train_labels = prepare_data(train_genuine_dir, train_forged_dir, dataset_index)
+    image_bank, index1, index2, y_train = load_pair_indices(train_pairs, train_labels)
+
+    # Hold out the last 30% of the pairs for validation (same split as validation_split=0.3)
+    split = int(len(y_train) * 0.7)
+    train_sequence = PairBatchSequence(image_bank, index1[:split], index2[:split], y_train[:split], batch_size=32,
+                                       uint8_input=uint8_input)
+    validation_sequence = PairBatchSequence(image_bank, index1[split:], index2[split:], y_train[split:], batch_size=32, shuffle=False,
+                                            uint8_input=uint8_input)
 
 # Base VGG16 model
 def create_base_model():
@@ -50,6 +77,8 @@ def build_similarity_model():
 
 # Build and compile the model
 model = build_similarity_model()
+if uint8_input:
+    model = add_uint8_input(model)
 model.compile(optimizer="adam", loss="binary_crossentropy", metrics=["accuracy"])
 
 # Initialize EarlyStopping callback
@@ -62,10 +91,8 @@ early_stopping = EarlyStopping(
 try:
     # Train the model
     history = model.fit(
-        [X1_train, X2_train],
-        y_train,
-        validation_split=0.3,
-        batch_size=32,
+        train_sequence,
+        validation_data=validation_sequence,
         epochs=10,
         callbacks=[early_stopping]
     )